@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from ocr_extraction import SUPPORTED_EXTENSIONS, extract_document
+from uploads import SpooledUpload, spool_file, spool_upload
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/ocr/batch", tags=["OCR"])
+
+# Documents extracted at the same time across all batch jobs
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))
+# Most documents accepted in one batch, counting ZIP members individually
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 500))
+# Memory kept per queued document before it is spilled to disk
+BATCH_MEMORY_LIMIT_MB = int(os.getenv("BATCH_MEMORY_LIMIT_MB", 1))
+# Finished jobs remembered for polling; older ones are forgotten
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", 100))
+# Limits on one ZIP archive, checked against its directory before anything is extracted: total
+# uncompressed size of the members to extract, and entries of any kind (folders and skipped files too)
+BATCH_MAX_ZIP_MB = int(os.getenv("BATCH_MAX_ZIP_MB", 1024))
+BATCH_MAX_ZIP_MEMBERS = int(os.getenv("BATCH_MAX_ZIP_MEMBERS", 5000))
+
+_batch_semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+# Running jobs and the documents they hold, so shutdown can cancel them and delete what they spooled
+_tasks: "Dict[asyncio.Task, List[Tuple[str, Optional[SpooledUpload]]]]" = {}
+
+
+def _zip_documents(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    """Members to treat as documents, after checking the archive against the ZIP limits"""
+    entries = archive.infolist()
+    if len(entries) > BATCH_MAX_ZIP_MEMBERS:
+        raise HTTPException(status_code=413, detail=f"ZIP archive exceeds {BATCH_MAX_ZIP_MEMBERS} entries")
+    members = [
+        info for info in entries
+        if not (info.is_dir() or info.filename.startswith("__MACOSX/")
+                or os.path.basename(info.filename).startswith("."))
+    ]
+    if len(members) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_FILES} files")
+    # file_size is the declared size, and zipfile stops reading a member there, so it bounds what is spooled
+    extracted = sum(info.file_size for info in members
+                    if os.path.splitext(info.filename)[1].lower() in SUPPORTED_EXTENSIONS)
+    if extracted > BATCH_MAX_ZIP_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"ZIP archive expands beyond {BATCH_MAX_ZIP_MB} MB")
+    return members
+
+
+def _expand_zip(upload: SpooledUpload) -> List[Tuple[str, Optional[SpooledUpload]]]:
+    """Spool every member of a ZIP archive; unsupported members get no upload"""
+    documents = []
+    try:
+        with upload.open() as f, zipfile.ZipFile(f) as archive:
+            for info in _zip_documents(archive):
+                name = info.filename
+                if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                    documents.append((name, None))
+                    continue
+                with archive.open(info) as member:
+                    documents.append((name, spool_file(member, name, BATCH_MEMORY_LIMIT_MB * 1024 * 1024)))
+    except BaseException:
+        for _, document in documents:
+            if document is not None:
+                document.close()
+        raise
+    return documents
+
+
+async def _run_document(job: Dict[str, Any], result: Dict[str, Any], upload: Optional[SpooledUpload]):
+    try:
+        async with _batch_semaphore:
+            result["status"] = "running"
+            start = time.perf_counter()
+            try:
+                if upload is None:
+                    extension = os.path.splitext(result["filename"])[1].lower()
+                    raise HTTPException(status_code=400, detail=f"Unsupported file format: {extension}")
+                extracted = await extract_document(result["filename"], upload)
+                result.update(status="done", text=extracted["text"], cached=extracted["cached"])
+                job["completed"] += 1
+            except HTTPException as he:
+                result.update(status="error", error=he.detail)
+                job["failed"] += 1
+            except Exception as e:
+                logger.error(f"Batch extraction error for {result['filename']}: {str(e)}")
+                result.update(status="error", error=str(e))
+                job["failed"] += 1
+            finally:
+                result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    finally:
+        # Also reached when the job is cancelled while this document waits for the semaphore
+        if upload is not None:
+            await run_in_threadpool(upload.close)
+
+
+async def _run_job(job: Dict[str, Any], documents: List[Tuple[str, Optional[SpooledUpload]]]):
+    job["status"] = "running"
+    await asyncio.gather(*[
+        _run_document(job, result, upload) for result, (_, upload) in zip(job["results"], documents)
+    ])
+    job["status"] = "completed"
+    job["finished_at"] = time.time()
+    logger.info(f"Batch job {job['job_id']} finished: {job['completed']} done, {job['failed']} failed")
+
+
+def _remember_job(job: Dict[str, Any]):
+    _jobs[job["job_id"]] = job
+    for job_id in list(_jobs):
+        if len(_jobs) <= BATCH_MAX_JOBS:
+            break
+        if _jobs[job_id]["status"] == "completed":
+            del _jobs[job_id]
+
+
+@router.post("/")
+async def submit_batch(files: List[UploadFile] = File(...)):
+    """Queue many documents (or ZIP archives of them) for extraction and return a job id"""
+    documents: List[Tuple[str, Optional[SpooledUpload]]] = []
+    try:
+        for file in files:
+            extension = os.path.splitext(file.filename)[1].lower()
+            if extension == ".zip":
+                archive = await spool_upload(file)
+                try:
+                    documents.extend(await run_in_threadpool(_expand_zip, archive))
+                except zipfile.BadZipFile as ze:
+                    raise HTTPException(status_code=400, detail=f"Invalid ZIP archive {file.filename}: {str(ze)}")
+                finally:
+                    await run_in_threadpool(archive.close)
+            elif extension in SUPPORTED_EXTENSIONS:
+                documents.append((file.filename, await spool_upload(file, BATCH_MEMORY_LIMIT_MB * 1024 * 1024)))
+            else:
+                documents.append((file.filename, None))
+            if len(documents) > BATCH_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_FILES} files")
+    except BaseException:
+        for _, upload in documents:
+            if upload is not None:
+                upload.close()
+        raise
+
+    if not documents:
+        raise HTTPException(status_code=400, detail="No documents found in batch")
+
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "status": "queued",
+        "created_at": time.time(),
+        "finished_at": None,
+        "total": len(documents),
+        "completed": 0,
+        "failed": 0,
+        "results": [{"filename": name, "status": "queued"} for name, _ in documents]
+    }
+    _remember_job(job)
+    task = asyncio.create_task(_run_job(job, documents))
+    _tasks[task] = documents
+    task.add_done_callback(lambda done: _tasks.pop(done, None))
+    return {"job_id": job["job_id"], "status": job["status"], "total": job["total"]}
+
+
+async def shutdown_batches():
+    """Cancel running batch jobs and delete the documents they spooled but did not finish"""
+    running = list(_tasks.items())
+    for task, _ in running:
+        task.cancel()
+    await asyncio.gather(*[task for task, _ in running], return_exceptions=True)
+    # A job cancelled before its first step never ran _run_document, so nothing closed its uploads
+    for _, documents in running:
+        for _, upload in documents:
+            if upload is not None:
+                await run_in_threadpool(upload.close)
+
+
+@router.get("/{job_id}")
+async def get_batch(job_id: str, include_text: bool = True):
+    """Progress and per-file results of a batch job"""
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch job: {job_id}")
+    response = {key: value for key, value in job.items() if key != "results"}
+    response["results"] = [
+        result if include_text else {key: value for key, value in result.items() if key != "text"}
+        for result in job["results"]
+    ]
+    return response
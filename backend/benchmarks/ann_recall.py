@@ -0,0 +1,115 @@
+"""Recall-vs-latency report for the approximate vector index tiers, against exact flat search.
+
+Uses synthetic clustered embeddings by default, or the vectors of a saved index:
+
+    python -m benchmarks.ann_recall --vectors 200000 --queries 500
+    python -m benchmarks.ann_recall --index data/faiss_index.bin --kinds ivf,hnsw --output ann.json
+
+Run it from the backend directory.
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, List
+import numpy as np
+import faiss
+from vector_index import build_index, index_kind, search
+
+SWEEPS = {
+    "ivf": ("nprobe", [1, 4, 16, 64, 256]),
+    "ivfpq": ("nprobe", [1, 4, 16, 64, 256]),
+    "hnsw": ("ef_search", [16, 32, 64, 128, 256]),
+}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def synthetic_vectors(count: int, dimension: int, clusters: int, seed: int) -> np.ndarray:
+    """Unit vectors around random centres, roughly how sentence embeddings of related texts sit"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimension)).astype("float32")
+    vectors = centres[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dimension)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def load_vectors(path: str) -> np.ndarray:
+    index = faiss.read_index(path)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int, exact: np.ndarray, **knobs) -> Dict[str, Any]:
+    """Search one query at a time, as /query-vector does; recall is the share of exact top-k found"""
+    latencies: List[float] = []
+    found = 0
+    for query, truth in zip(queries, exact):
+        start = time.perf_counter()
+        _, ids = search(index, query[None, :], k, **knobs)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found += len(set(ids[0]) & set(truth))
+    return {
+        "recall": round(found / exact.size, 4),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3)
+    }
+
+
+def report(vectors: np.ndarray, queries: np.ndarray, k: int, kinds: List[str]) -> List[Dict[str, Any]]:
+    dimension = vectors.shape[1]
+    flat = build_index("flat", vectors, dimension)
+    _, exact = flat.search(queries, k)
+    rows = [{"index": "flat", "knob": "-", "build_s": 0.0, **measure(flat, queries, k, exact)}]
+    for kind in kinds:
+        started = time.perf_counter()
+        index = build_index(kind, vectors, dimension)
+        build_seconds = round(time.perf_counter() - started, 2)
+        knob, values = SWEEPS[kind]
+        for value in values:
+            row = measure(index, queries, k, exact, **{knob: value})
+            rows.append({"index": index_kind(index), "knob": f"{knob}={value}", "build_s": build_seconds, **row})
+    return rows
+
+
+def print_rows(rows: List[Dict[str, Any]]):
+    columns = ["index", "knob", "build_s", "recall", "p50_ms", "p95_ms", "p99_ms"]
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index", help="saved faiss index whose vectors to use instead of synthetic ones")
+    parser.add_argument("--vectors", type=int, default=100000, help="synthetic database size")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--kinds", default="ivf,ivfpq,hnsw", help="comma-separated index kinds to compare")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    if args.index:
+        vectors = load_vectors(args.index)
+    else:
+        vectors = synthetic_vectors(args.vectors + args.queries, args.dimension, args.clusters, args.seed)
+    # Held-out queries: drawn from the same distribution but not stored
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(vectors))
+    queries, vectors = vectors[order[:args.queries]], np.ascontiguousarray(vectors[np.sort(order[args.queries:])])
+
+    rows = report(vectors, queries, min(args.k, len(vectors)), args.kinds.split(","))
+    print_rows(rows)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": time.time(), "args": vars(args), "vectors": len(vectors), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Synthetic document corpus for benchmarks: text PDFs, scanned PDFs, DOCX files and images.
+
+    python -m benchmarks.corpus --out bench_corpus --count 3 --pages 4
+"""
+import argparse
+import io
+import os
+import random
+from typing import Dict, List
+import fitz  # PyMuPDF
+from docx import Document
+from PIL import Image, ImageDraw
+
+WORDS = {
+    "finance": ["revenue", "quarter", "operating", "costs", "margin", "cash", "flow", "invoice", "balance", "growth"],
+    "healthcare": ["patient", "diagnosis", "dosage", "clinic", "treatment", "symptoms", "follow-up", "laboratory"],
+    "legal": ["agreement", "party", "clause", "termination", "liability", "governing", "law", "obligations"],
+}
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+
+
+def _sentence(rng: random.Random, words: List[str]) -> str:
+    chosen = [rng.choice(words) for _ in range(rng.randint(8, 18))]
+    return " ".join(chosen).capitalize() + "."
+
+
+def page_texts(rng: random.Random, pages: int) -> List[str]:
+    """Page bodies with a repeated header and a numbered footer, like real reports"""
+    topic = rng.choice(sorted(WORDS))
+    texts = []
+    for number in range(1, pages + 1):
+        paragraphs = [" ".join(_sentence(rng, WORDS[topic]) for _ in range(rng.randint(3, 6))) for _ in range(4)]
+        texts.append(f"Synthetic {topic.title()} Report\n\n" + "\n\n".join(paragraphs) + f"\n\nPage {number} of {pages}")
+    return texts
+
+
+def text_pdf(path: str, texts: List[str]):
+    document = fitz.open()
+    for text in texts:
+        page = document.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_textbox(fitz.Rect(50, 50, PAGE_WIDTH - 50, PAGE_HEIGHT - 50), text, fontsize=10)
+    document.save(path)
+    document.close()
+
+
+def render_page(text: str, dpi: int = 150) -> Image.Image:
+    """Draw text onto a white page image, as a scanner would produce it"""
+    scale = dpi / 72
+    image = Image.new("L", (int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    y = int(50 * scale)
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) > 80:
+                draw.text((int(50 * scale), y), line, fill=0)
+                y += 18
+                line = ""
+            line = f"{line} {word}".strip()
+        draw.text((int(50 * scale), y), line, fill=0)
+        y += 18
+    return image
+
+
+def scanned_pdf(path: str, texts: List[str]):
+    document = fitz.open()
+    for text in texts:
+        buffer = io.BytesIO()
+        render_page(text).save(buffer, format="PNG")
+        page = document.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    document.save(path)
+    document.close()
+
+
+def docx_file(path: str, texts: List[str]):
+    document = Document()
+    for text in texts:
+        for paragraph in text.split("\n\n"):
+            document.add_paragraph(paragraph)
+        document.add_page_break()
+    document.save(path)
+
+
+def generate_corpus(directory: str, count: int = 3, pages: int = 3, seed: int = 0) -> Dict[str, List[str]]:
+    """Write ``count`` documents of each kind to directory and return their paths by kind"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    corpus: Dict[str, List[str]] = {"text_pdf": [], "scanned_pdf": [], "docx": [], "image": []}
+    for i in range(count):
+        texts = page_texts(rng, pages)
+        paths = {
+            "text_pdf": os.path.join(directory, f"text_{i}.pdf"),
+            "scanned_pdf": os.path.join(directory, f"scanned_{i}.pdf"),
+            "docx": os.path.join(directory, f"document_{i}.docx"),
+            "image": os.path.join(directory, f"image_{i}.png"),
+        }
+        text_pdf(paths["text_pdf"], texts)
+        scanned_pdf(paths["scanned_pdf"], texts)
+        docx_file(paths["docx"], texts)
+        render_page(texts[0]).save(paths["image"])
+        for kind, path in paths.items():
+            corpus[kind].append(path)
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default="bench_corpus")
+    parser.add_argument("--count", type=int, default=3, help="documents of each kind")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    corpus = generate_corpus(args.out, args.count, args.pages, args.seed)
+    for kind, paths in corpus.items():
+        print(f"{kind}: {len(paths)} files")
+
+
+if __name__ == "__main__":
+    main()
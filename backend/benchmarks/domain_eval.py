@@ -0,0 +1,152 @@
+"""Accuracy and calibration of the local domain classifier on labelled documents.
+
+Reads JSON lines with "text" and "domain" (one of the DOMAIN_EXAMPLES labels). For each softmax
+temperature it reports accuracy, the gap between mean score and accuracy per score bin (expected
+calibration error), and, for each threshold, how many documents the fast path would answer and how
+many of those it gets right. Thresholds apply to the calibrated confidence, i.e. the accuracy observed
+in the score bin, which is what the service compares once --calibration-output has written its bins:
+
+    python -m benchmarks.domain_eval --data labelled.jsonl --temperatures 0.02,0.05,0.1
+    python -m benchmarks.domain_eval --data labelled.jsonl --target-accuracy 0.97 --output domain_eval.json
+    python -m benchmarks.domain_eval --data labelled.jsonl --calibration-output data/domain_calibration.json
+
+Run it from the backend directory. It embeds with the configured EMBEDDING_MODEL.
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+from domain_classifier import calibrate, label_similarities, labels, softmax_scores
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95]
+
+
+def load_examples(path: str) -> List[Dict[str, str]]:
+    known = set(labels())
+    examples = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            example = json.loads(line)
+            if example["domain"] not in known:
+                raise ValueError(f"Line {number}: unknown domain '{example['domain']}'")
+            examples.append(example)
+    return examples
+
+
+def calibration_error(scores: np.ndarray, correct: np.ndarray, bins: int = 10) -> float:
+    """Expected calibration error: per score bin, |mean score - accuracy|, weighted by the bin's share"""
+    edges = np.linspace(0, 1, bins + 1)
+    error = 0.0
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (scores > low) & (scores <= high)
+        if in_bin.any():
+            error += in_bin.mean() * abs(scores[in_bin].mean() - correct[in_bin].mean())
+    return float(error)
+
+
+def calibration_bins(scores: np.ndarray, correct: np.ndarray, bins: int = 10) -> List[List[float]]:
+    """[upper bound, accuracy] per score bin, made non-decreasing by pooling adjacent bins that break
+    the order (isotonic regression), so a higher score never maps to a lower confidence. Empty bins
+    take their neighbours' accuracy."""
+    edges = np.linspace(0, 1, bins + 1)
+    # Blocks of [first bin, last bin, correct count, document count]
+    blocks: List[List[float]] = []
+    for index, (low, high) in enumerate(zip(edges[:-1], edges[1:])):
+        in_bin = (scores > low) & (scores <= high)
+        if not in_bin.any():
+            continue
+        blocks.append([index, index, float(correct[in_bin].sum()), float(in_bin.sum())])
+        while len(blocks) > 1 and blocks[-2][2] / blocks[-2][3] > blocks[-1][2] / blocks[-1][3]:
+            last = blocks.pop()
+            blocks[-1][1] = last[1]
+            blocks[-1][2] += last[2]
+            blocks[-1][3] += last[3]
+    accuracies = np.full(bins, np.nan)
+    for first, last, hits, count in blocks:
+        accuracies[int(first):int(last) + 1] = hits / count
+    filled = np.flatnonzero(~np.isnan(accuracies))
+    accuracies = np.interp(np.arange(bins), filled, accuracies[filled])
+    return [[round(float(high), 3), round(float(accuracy), 3)] for high, accuracy in zip(edges[1:], accuracies)]
+
+
+def evaluate(similarities: np.ndarray, truth: np.ndarray, temperature: float,
+             target_accuracy: float) -> Dict[str, Any]:
+    probabilities = softmax_scores(similarities, temperature)
+    predicted = probabilities.argmax(axis=1)
+    scores = probabilities.max(axis=1)
+    correct = (predicted == truth).astype(float)
+    bins = calibration_bins(scores, correct)
+    confidences = np.array([calibrate(float(score), bins) for score in scores])
+
+    thresholds = []
+    for threshold in THRESHOLDS:
+        answered = confidences >= threshold
+        thresholds.append({
+            "threshold": threshold,
+            "coverage": round(float(answered.mean()), 3),
+            "accuracy": round(float(correct[answered].mean()), 3) if answered.any() else None
+        })
+    # Lowest threshold at which the documents answered locally reach the target accuracy
+    recommended: Optional[float] = None
+    for threshold in np.unique(confidences):
+        answered = confidences >= threshold
+        if correct[answered].mean() >= target_accuracy:
+            recommended = round(float(threshold), 3)
+            break
+    return {
+        "temperature": temperature,
+        "accuracy": round(float(correct.mean()), 3),
+        "calibration_error": round(calibration_error(scores, correct), 3),
+        "thresholds": thresholds,
+        "recommended_threshold": recommended,
+        "bins": bins
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"temperature {report['temperature']}: accuracy {report['accuracy']}, "
+          f"calibration error {report['calibration_error']}, "
+          f"recommended threshold {report['recommended_threshold']}")
+    for row in report["thresholds"]:
+        print(f"  threshold {row['threshold']:<5} coverage {row['coverage']:<6} accuracy {row['accuracy']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", required=True, help="JSON lines with 'text' and 'domain'")
+    parser.add_argument("--temperatures", default="0.02,0.05,0.1,0.2", help="comma-separated softmax temperatures")
+    parser.add_argument("--target-accuracy", type=float, default=0.95,
+                        help="accuracy the fast path must reach on the documents it answers")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--calibration-output",
+                        help="write the bins of the best-calibrated temperature for DOMAIN_CALIBRATION_PATH")
+    args = parser.parse_args()
+
+    examples = load_examples(args.data)
+    names = labels()
+    truth = np.array([names.index(example["domain"]) for example in examples])
+    similarities = np.stack([label_similarities(example["text"]) for example in examples])
+
+    reports = [evaluate(similarities, truth, float(temperature), args.target_accuracy)
+               for temperature in args.temperatures.split(",")]
+    for report in reports:
+        print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": time.time(), "args": vars(args), "examples": len(examples), "results": reports}, f, indent=2)
+    if args.calibration_output:
+        best = min(reports, key=lambda report: report["calibration_error"])
+        with open(args.calibration_output, "w") as f:
+            json.dump({"created_at": time.time(), "examples": len(examples),
+                       "temperature": best["temperature"], "bins": best["bins"]}, f, indent=2)
+        # The service ignores bins measured at another temperature
+        print(f"Wrote calibration for temperature {best['temperature']}; "
+              f"set DOMAIN_CLASSIFIER_TEMPERATURE={best['temperature']} and "
+              f"DOMAIN_FASTPATH_THRESHOLD={best['recommended_threshold']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Local stand-in for the Perplexity chat-completions API, for benchmarks and offline runs.
+
+Run it and point the service at it:
+
+    STUB_LATENCY_MS=800 STUB_FAILURE_RATE=0.05 uvicorn benchmarks.llm_stub:app --port 8901
+    PERPLEXITY_API_KEY=stub PERPLEXITY_API_URL=http://127.0.0.1:8901/chat/completions uvicorn main:app
+
+Answers are canned but valid for every prompt the routers send, so responses
+pass the same validation as real ones.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Fixed latency per completion, plus uniform jitter and a per-prompt-token cost
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", 500))
+STUB_JITTER_MS = float(os.getenv("STUB_JITTER_MS", 100))
+STUB_MS_PER_1K_TOKENS = float(os.getenv("STUB_MS_PER_1K_TOKENS", 50))
+# Share of requests answered with STUB_FAILURE_STATUS (comma-separated codes are picked at random)
+STUB_FAILURE_RATE = float(os.getenv("STUB_FAILURE_RATE", 0))
+STUB_FAILURE_STATUS = [int(code) for code in os.getenv("STUB_FAILURE_STATUS", "429,503").split(",")]
+# Delay between streamed chunks
+STUB_STREAM_CHUNK_MS = float(os.getenv("STUB_STREAM_CHUNK_MS", 20))
+
+app = FastAPI()
+stats = {"requests": 0, "failures": 0, "streams": 0, "started_at": time.time()}
+
+
+def _answer(prompt: str) -> str:
+    if "domain classifier" in prompt:
+        return json.dumps({"domain": "Finance", "confidence": 0.92, "reason": "Mentions revenue, costs and cash flow."})
+    if "combining partial analyses" in prompt:
+        return json.dumps({"domain_summary": "The document reports steady growth with rising costs across all parts."})
+    if "Insight Agent" in prompt:
+        return json.dumps({
+            "detailed_insights": [
+                {
+                    "title": f"Insight {i}",
+                    "description": f"Observation {i} drawn from the document content.",
+                    "supporting_data": [f"Figure {i}"],
+                    "risk_factors": [f"Risk {i}"]
+                }
+                for i in range(1, 4)
+            ],
+            "domain_summary": "A financial report showing steady growth with rising operating costs."
+        })
+    if "Suggestion Agent" in prompt:
+        count = max(1, len(re.findall(r'"title"', prompt)))
+        return json.dumps([f"Act on insight {i} by reviewing the related figures." for i in range(1, count + 1)])
+    if "goal specification" in prompt:
+        return json.dumps({
+            "procedure": "Review the document and plan the work in stages.",
+            "approach": "Focus on the sections most relevant to the goal. Track progress weekly.",
+            "steps": ["Read the key sections", "List the gaps", "Assign owners", "Review outcomes"]
+        })
+    return json.dumps({"response": "Based on the stored documents, revenue grew while costs increased."})
+
+
+def _latency(prompt: str) -> float:
+    tokens = len(prompt) / 4
+    jitter = random.uniform(-STUB_JITTER_MS, STUB_JITTER_MS)
+    return max(0.0, STUB_LATENCY_MS + jitter + tokens / 1000 * STUB_MS_PER_1K_TOKENS) / 1000
+
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = body["messages"][-1]["content"]
+    stats["requests"] += 1
+    if random.random() < STUB_FAILURE_RATE:
+        stats["failures"] += 1
+        await asyncio.sleep(_latency("") / 4)
+        return JSONResponse({"error": {"message": "stub failure"}}, status_code=random.choice(STUB_FAILURE_STATUS))
+
+    content = _answer(prompt)
+    if not body.get("stream"):
+        await asyncio.sleep(_latency(prompt))
+        return {"model": body.get("model"), "choices": [{"message": {"role": "assistant", "content": content}}]}
+
+    stats["streams"] += 1
+
+    async def chunks():
+        await asyncio.sleep(_latency(prompt) / 2)
+        for i in range(0, len(content), 16):
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": content[i:i + 16]}}]}) + "\n\n"
+            await asyncio.sleep(STUB_STREAM_CHUNK_MS / 1000)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
@@ -0,0 +1,384 @@
+"""Drive every router at fixed concurrency levels; report latency percentiles, throughput and peak RSS.
+
+By default this starts the LLM stub and the service itself (in a scratch
+working directory, so benchmark data never touches ./data):
+
+    python -m benchmarks.run --concurrency 1,8,32 --requests 40
+    python -m benchmarks.run --scenarios domain,insights --stub-latency-ms 1500 --stub-failure-rate 0.1
+    python -m benchmarks.run --app-url http://127.0.0.1:8000 --app-pid 4242
+    python -m benchmarks.run --output current.json --baseline baseline.json   # exits 1 on regressions
+
+Run it from the backend directory.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import httpx
+from benchmarks.corpus import generate_corpus, page_texts
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLL_SECONDS = 0.2
+TERMINAL_JOB_STATUSES = ("completed", "cancelled")
+
+
+class Scenario:
+    """One endpoint call pattern.
+
+    ``build(i)`` returns the keyword arguments of the i-th request. When
+    ``poll`` is set, the response carries a job id and the request only counts
+    as finished once polling that path reports a terminal status.
+    """
+
+    def __init__(self, name: str, method: str, path: str, build: Callable[[int], Dict[str, Any]],
+                 poll: Optional[str] = None, events: bool = False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.build = build
+        self.poll = poll
+        self.events = events
+
+    async def execute(self, client: httpx.AsyncClient, i: int) -> Tuple[bool, Optional[float]]:
+        """Send request i; returns whether it succeeded and the time to its first body byte"""
+        start = time.perf_counter()
+        first_byte = None
+        body = b""
+        async with client.stream(self.method, self.path, **self.build(i)) as response:
+            async for chunk in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+                body += chunk
+        if response.status_code >= 400:
+            return False, first_byte
+        if self.events and (b"event: error" in body or b'"status": "error"' in body):
+            return False, first_byte
+        if self.poll:
+            job_id = json.loads(body)["job_id"]
+            while True:
+                await asyncio.sleep(POLL_SECONDS)
+                job = (await client.get(self.poll.format(job_id=job_id))).json()
+                if job.get("status") in TERMINAL_JOB_STATUSES:
+                    return job.get("failed", 0) == 0, first_byte
+        return True, first_byte
+
+
+def _read_file(path: str, i: int, unique: bool) -> bytes:
+    with open(path, "rb") as f:
+        data = f.read()
+    # PDF, ZIP (DOCX) and PNG readers all ignore trailing bytes, so this defeats content-hash caches
+    return data + f"\n%bench-{i}-{time.time_ns()}\n".encode() if unique else data
+
+
+def build_scenarios(corpus: Dict[str, List[str]], unique: bool) -> List[Scenario]:
+    text = "\n--- End of Page 1 ---\n".join(page_texts(random.Random(1), 4))
+    all_files = [path for paths in corpus.values() for path in paths]
+
+    def tag(i: int) -> str:
+        return f"\n\nReference {i}-{time.time_ns()}" if unique else ""
+
+    def upload(kind: str) -> Callable[[int], Dict[str, Any]]:
+        def build(i: int) -> Dict[str, Any]:
+            path = corpus[kind][i % len(corpus[kind])]
+            return {"files": {"file": (os.path.basename(path), _read_file(path, i, unique))}}
+        return build
+
+    def many_files(field: str, count: int) -> Callable[[int], Dict[str, Any]]:
+        def build(i: int) -> Dict[str, Any]:
+            paths = [all_files[(i + n) % len(all_files)] for n in range(count)]
+            return {"files": [(field, (os.path.basename(p), _read_file(p, i, unique))) for p in paths]}
+        return build
+
+    insights = [
+        {"title": f"Insight {n}", "description": f"Costs rose in quarter {n}.", "supporting_data": [],
+         "risk_factors": ["Margin pressure"]}
+        for n in range(1, 4)
+    ]
+    scenarios = [
+        Scenario("ocr_text_pdf", "POST", "/ocr/extract-text", upload("text_pdf")),
+        Scenario("ocr_scanned_pdf", "POST", "/ocr/extract-text", upload("scanned_pdf")),
+        Scenario("ocr_docx", "POST", "/ocr/extract-text", upload("docx")),
+        Scenario("ocr_image", "POST", "/ocr/extract-text", upload("image")),
+        Scenario("ocr_stream", "POST", "/ocr/extract-text/stream", upload("scanned_pdf")),
+        Scenario("ocr_batch", "POST", "/ocr/batch/", many_files("files", 4), poll="/ocr/batch/{job_id}?include_text=false"),
+        Scenario("domain", "POST", "/identify-domain/", lambda i: {"json": {"text": text + tag(i)}}),
+        Scenario("insights", "POST", "/generate-insights/",
+                 lambda i: {"json": {"domain": "Finance", "content": text + tag(i)}}),
+        Scenario("insights_stream", "POST", "/generate-insights/stream",
+                 lambda i: {"json": {"domain": "Finance", "content": text + tag(i)}}, events=True),
+        Scenario("suggestions", "POST", "/generate-suggestions/",
+                 lambda i: {"json": {"insights": insights + [{"title": tag(i) or "Extra", "risk_factors": []}]}}),
+        Scenario("store_vector", "POST", "/store-vector", lambda i: {"json": {"text": text + tag(i)}}),
+        Scenario("query_vector", "POST", "/query-vector", lambda i: {"json": {"query": "How did revenue change?" + tag(i)}}),
+        Scenario("query_vector_stream", "POST", "/query-vector/stream",
+                 lambda i: {"json": {"query": "How did revenue change?" + tag(i)}}, events=True),
+        Scenario("goal", "POST", "/specify-goal/",
+                 lambda i: {"json": {"goal": "Cut operating costs" + tag(i), "pdf_content": text}}),
+        Scenario("goal_stream", "POST", "/specify-goal/stream",
+                 lambda i: {"json": {"goal": "Cut operating costs" + tag(i), "pdf_content": text}}, events=True),
+        Scenario("analyze", "POST", "/analyze/", lambda i: {"data": {"text": text + tag(i)}}, events=True),
+        Scenario("jobs", "POST", "/jobs/", many_files("files", 2), poll="/jobs/{job_id}"),
+        Scenario("vector_db_stats", "GET", "/vector-db-stats", lambda i: {}),
+        Scenario("llm_cache_stats", "GET", "/llm/cache-stats", lambda i: {}),
+    ]
+    return scenarios
+
+
+class RssSampler:
+    """Polls the resident set size of the server (and its worker processes) and keeps the peak"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _rss(self) -> int:
+        if psutil is not None:
+            try:
+                process = psutil.Process(self.pid)
+                return sum(p.memory_info().rss for p in [process] + process.children(recursive=True))
+            except psutil.Error:
+                return 0
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    async def _sample(self):
+        while True:
+            self.peak = max(self.peak, self._rss())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = 0
+        if self.pid:
+            self._task = asyncio.create_task(self._sample())
+
+    async def stop(self) -> Optional[float]:
+        if self._task is None:
+            return None
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        return round(self.peak / (1024 * 1024), 1)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_level(client: httpx.AsyncClient, scenario: Scenario, concurrency: int, requests: int,
+                    sampler: RssSampler) -> Dict[str, Any]:
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            start = time.perf_counter()
+            try:
+                ok, first_byte = await scenario.execute(client, i)
+            except Exception:
+                ok, first_byte = False, None
+            if ok:
+                latencies.append((time.perf_counter() - start) * 1000)
+                if first_byte is not None:
+                    first_bytes.append(first_byte * 1000)
+            else:
+                errors += 1
+
+    sampler.start()
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - start
+    peak_rss = await sampler.stop()
+    return {
+        "scenario": scenario.name,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "first_byte_p50_ms": round(percentile(first_bytes, 0.50), 1),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "peak_rss_mb": peak_rss,
+    }
+
+
+def _wait_until_ready(url: str, timeout: float, process: Optional[subprocess.Popen] = None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before it was ready")
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} was not ready after {timeout:.0f}s")
+
+
+def start_servers(args) -> Tuple[List[subprocess.Popen], str, Optional[int]]:
+    """Start the LLM stub and the service; returns the processes, service URL and service pid"""
+    stub_env = {
+        **os.environ,
+        "STUB_LATENCY_MS": str(args.stub_latency_ms),
+        "STUB_JITTER_MS": str(args.stub_jitter_ms),
+        "STUB_FAILURE_RATE": str(args.stub_failure_rate),
+    }
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.llm_stub:app", "--port", str(args.stub_port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=stub_env
+    )
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    app_env = {
+        **os.environ,
+        "PERPLEXITY_API_URL": f"http://127.0.0.1:{args.stub_port}/chat/completions",
+        # The stub ignores the key, but the service refuses to start without one
+        "PERPLEXITY_API_KEY": os.environ.get("PERPLEXITY_API_KEY") or "stub",
+        "PYTHONPATH": os.pathsep.join([BACKEND_DIR, os.environ.get("PYTHONPATH", "")]),
+    }
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR, "--port", str(args.app_port),
+         "--log-level", "warning"],
+        cwd=workdir, env=app_env
+    )
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    try:
+        _wait_until_ready(f"http://127.0.0.1:{args.stub_port}/stats", 30, stub)
+        _wait_until_ready(f"{app_url}/llm/cache-stats", args.startup_timeout, app)
+    except BaseException:
+        for process in (app, stub):
+            process.terminate()
+        raise
+    print(f"Service running in {workdir}")
+    return [app, stub], app_url, app.pid
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    """Regressions against a baseline result file: p95 up or throughput down by more than tolerance"""
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        label = f"{result['scenario']} @ {result['concurrency']}"
+        if before["p95_ms"] and result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        if before["throughput_rps"] and result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{label}: errors {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+def print_table(results: List[Dict[str, Any]]):
+    columns = ["scenario", "concurrency", "requests", "errors", "p50_ms", "p95_ms", "p99_ms",
+               "first_byte_p50_ms", "throughput_rps", "peak_rss_mb"]
+    widths = [max(len(column), *(len(str(r[column])) for r in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+async def run(args, app_url: str, app_pid: Optional[int]) -> List[Dict[str, Any]]:
+    corpus = generate_corpus(args.corpus_dir, args.corpus_count, args.corpus_pages)
+    scenarios = build_scenarios(corpus, unique=not args.allow_cache)
+    if args.scenarios:
+        wanted = set(args.scenarios.split(","))
+        unknown = wanted - {scenario.name for scenario in scenarios}
+        if unknown:
+            raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+
+    sampler = RssSampler(app_pid)
+    results = []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=app_url, timeout=args.request_timeout, limits=limits) as client:
+        for scenario in scenarios:
+            for concurrency in [int(level) for level in args.concurrency.split(",")]:
+                result = await run_level(client, scenario, concurrency, args.requests, sampler)
+                print(f"{scenario.name} @ {concurrency}: p95 {result['p95_ms']} ms, "
+                      f"{result['throughput_rps']} req/s, {result['errors']} errors")
+                results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=40, help="requests per scenario and level")
+    parser.add_argument("--scenarios", help="comma-separated scenario names (default: all)")
+    parser.add_argument("--allow-cache", action="store_true", help="repeat identical inputs so caches can hit")
+    parser.add_argument("--app-url", help="benchmark an already running service instead of starting one")
+    parser.add_argument("--app-pid", type=int, help="pid of the running service, for RSS sampling")
+    parser.add_argument("--app-port", type=int, default=8900)
+    parser.add_argument("--stub-port", type=int, default=8901)
+    parser.add_argument("--stub-latency-ms", type=float, default=500)
+    parser.add_argument("--stub-jitter-ms", type=float, default=100)
+    parser.add_argument("--stub-failure-rate", type=float, default=0.0)
+    parser.add_argument("--startup-timeout", type=float, default=600, help="seconds to wait for model loading")
+    parser.add_argument("--request-timeout", type=float, default=600)
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "bench_corpus"))
+    parser.add_argument("--corpus-count", type=int, default=3)
+    parser.add_argument("--corpus-pages", type=int, default=3)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="results JSON to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown before flagging")
+    args = parser.parse_args()
+
+    processes: List[subprocess.Popen] = []
+    app_url, app_pid = args.app_url, args.app_pid
+    if app_url is None:
+        processes, app_url, app_pid = start_servers(args)
+    try:
+        results = asyncio.run(run(args, app_url, app_pid))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=30)
+
+    print()
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": time.time(), "args": vars(args), "results": results}, f, indent=2)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join("data", "cache")
+
+
+class TieredCache:
+    """Two-tier JSON cache: a byte-bounded in-memory LRU in front of an on-disk store.
+
+    Values are serialized once on write, so the memory tier is accounted in
+    encoded bytes. The disk tier keeps one file per key and evicts the least
+    recently used files once its total size exceeds ``disk_max_bytes``. When
+    ``ttl_seconds`` is set, entries older than that are treated as misses.
+    """
+
+    def __init__(self, name: str, memory_max_bytes: int, disk_max_bytes: int,
+                 ttl_seconds: Optional[float] = None):
+        self.name = name
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.directory = os.path.join(CACHE_DIR, name)
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = sum(
+            os.path.getsize(os.path.join(self.directory, f)) for f in os.listdir(self.directory)
+        )
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, created_at: float, payload: bytes):
+        """Put a payload in the memory tier, evicting least recently used entries"""
+        self._forget(key)
+        if len(payload) > self.memory_max_bytes:
+            return
+        self._memory[key] = (created_at, payload)
+        self._memory_bytes += len(payload)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _forget(self, key: str):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old[1])
+
+    def _remove_file(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._disk_bytes -= size
+        except FileNotFoundError:
+            pass
+
+    def _read_file(self, path: str) -> Optional[Tuple[float, bytes]]:
+        """Read a disk entry: a creation timestamp line followed by the JSON payload"""
+        try:
+            with open(path, "rb") as f:
+                header, _, payload = f.read().partition(b"\n")
+            return float(header), payload
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning(f"Discarding unreadable {self.name} cache entry {path}")
+            self._remove_file(path)
+            return None
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._is_expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return json.loads(entry[1])
+                self._forget(key)
+
+            path = self._path(key)
+            entry = self._read_file(path)
+            if entry is not None and self._is_expired(entry[0]):
+                self.expired += 1
+                self._forget(key)
+                self._remove_file(path)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            os.utime(path)
+            self.disk_hits += 1
+            self._remember(key, *entry)
+        return json.loads(entry[1])
+
+    def set(self, key: str, value: Any):
+        """Store a JSON-serializable value in both tiers"""
+        created_at = time.time()
+        payload = json.dumps(value).encode("utf-8")
+        with self._lock:
+            self._remember(key, created_at, payload)
+            path = self._path(key)
+            self._remove_file(path)
+            data = repr(created_at).encode("ascii") + b"\n" + payload
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._disk_bytes += len(data)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def discard(self, key: str):
+        """Remove one entry from both tiers"""
+        with self._lock:
+            self._forget(key)
+            self._remove_file(self._path(key))
+
+    def _evict_disk(self):
+        """Delete least recently used files until the disk tier is back under its limit"""
+        entries = []
+        for f in os.listdir(self.directory):
+            path = os.path.join(self.directory, f)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        for _, size, path in entries:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            os.remove(path)
+            self._disk_bytes -= size
+        logger.info(f"Evicted {self.name} cache entries, disk usage now {self._disk_bytes} bytes")
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for f in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, f))
+            self._disk_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "ttl_seconds": self.ttl_seconds
+            }
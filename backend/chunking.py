@@ -0,0 +1,73 @@
+import hashlib
+import os
+import re
+from typing import List
+
+# Rough characters per token for budgeting prompts without a tokenizer
+CHARS_PER_TOKEN = 4
+# Token budget of one document chunk sent to the LLM (the old 10,000-character cut)
+LLM_CHUNK_TOKENS = int(os.getenv("LLM_CHUNK_TOKENS", 2500))
+# A paragraph ends a chunk early (once it is half full) when its hash is divisible by this
+CHUNK_BOUNDARY_MODULUS = int(os.getenv("CHUNK_BOUNDARY_MODULUS", 4))
+
+PARAGRAPH_BREAK = re.compile(r"\n?--- End of Page \d+ ---\n?|\n\s*\n")
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _pieces(text: str, max_chars: int) -> List[str]:
+    """Paragraphs of text, with page markers dropped and oversized paragraphs split at whitespace"""
+    pieces = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(paragraph[:cut])
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            pieces.append(paragraph)
+    return pieces
+
+
+def _is_boundary(piece: str) -> bool:
+    digest = hashlib.md5(piece.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") % CHUNK_BOUNDARY_MODULUS == 0
+
+
+def chunk_text(text: str, max_tokens: int = LLM_CHUNK_TOKENS) -> List[str]:
+    """Split text into paragraph-aligned chunks of at most max_tokens.
+
+    Boundaries are content-defined: past half the budget a chunk ends after any
+    paragraph whose hash picks it as a boundary, so an edit only moves the
+    boundaries near it and the other chunks (and their cached results) stay
+    identical.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    current: List[str] = []
+    size = 0
+    for piece in _pieces(text, max_chars):
+        if current and size + len(piece) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 2
+        if size >= max_chars // 2 and _is_boundary(piece):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def excerpt(text: str, max_chars: int, windows: int = 4) -> str:
+    """Up to max_chars of text taken from evenly spaced windows, so later pages are represented too"""
+    if len(text) <= max_chars:
+        return text
+    separator = "\n...\n"
+    size = (max_chars - len(separator) * (windows - 1)) // windows
+    step = (len(text) - size) / (windows - 1) if windows > 1 else 0
+    return separator.join(text[int(i * step):int(i * step) + size] for i in range(windows))
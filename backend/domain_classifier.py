@@ -0,0 +1,235 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+from vector_database import vector_db
+
+logger = logging.getLogger(__name__)
+
+# Answer locally when the top label's confidence reaches this, otherwise ask the LLM. Off until
+# benchmarks/domain_eval.py shows, on labelled documents, that the threshold meets the agreed accuracy
+DOMAIN_FASTPATH_ENABLED = os.getenv("DOMAIN_FASTPATH_ENABLED", "0") == "1"
+DOMAIN_FASTPATH_THRESHOLD = float(os.getenv("DOMAIN_FASTPATH_THRESHOLD", 0.7))
+# Score bins written by benchmarks/domain_eval.py --calibration-output. When present, the reported
+# confidence is the accuracy observed for scores in the bin instead of the raw softmax score
+DOMAIN_CALIBRATION_PATH = os.getenv("DOMAIN_CALIBRATION_PATH", os.path.join("data", "domain_calibration.json"))
+# Softmax temperature over cosine similarities; lower makes scores sharper
+DOMAIN_CLASSIFIER_TEMPERATURE = float(os.getenv("DOMAIN_CLASSIFIER_TEMPERATURE", 0.05))
+# The document is embedded as up to this many evenly spaced windows, averaged
+DOMAIN_CLASSIFIER_WINDOWS = int(os.getenv("DOMAIN_CLASSIFIER_WINDOWS", 4))
+DOMAIN_CLASSIFIER_WINDOW_CHARS = int(os.getenv("DOMAIN_CLASSIFIER_WINDOW_CHARS", 1000))
+
+# Labelled seed examples per domain; each label's centroid is the mean of its example embeddings
+DOMAIN_EXAMPLES: Dict[str, List[str]] = {
+    "Healthcare": [
+        "Patient discharge summary with diagnosis, prescribed medication and dosage instructions.",
+        "Laboratory report showing blood glucose, cholesterol and haemoglobin levels with reference ranges.",
+        "Clinical notes from a physician describing symptoms, examination findings and treatment plan.",
+        "Hospital admission record listing allergies, vital signs and follow-up appointments.",
+        "Medical insurance claim for surgery, consultation fees and pharmacy charges.",
+    ],
+    "Finance": [
+        "Quarterly financial statement with revenue, operating expenses, net profit and cash flow.",
+        "Bank account statement listing deposits, withdrawals, balance and interest credited.",
+        "Invoice with line items, tax amounts, payment terms and total amount due.",
+        "Investment portfolio report covering equities, mutual funds, returns and asset allocation.",
+        "Loan agreement schedule with principal, interest rate, EMI and repayment tenure.",
+    ],
+    "Education": [
+        "Student mark sheet with subjects, grades, credits and cumulative GPA.",
+        "Course syllabus describing learning outcomes, lecture schedule, assignments and exams.",
+        "Lecture notes explaining a concept with examples and practice questions for students.",
+        "University admission letter with program details, semester fees and orientation dates.",
+        "Research thesis chapter with literature review, methodology and references.",
+    ],
+    "Legal": [
+        "Contract between two parties setting out obligations, termination clauses and governing law.",
+        "Court judgment summarising the petition, arguments of counsel and the order of the bench.",
+        "Non-disclosure agreement defining confidential information, term and remedies for breach.",
+        "Power of attorney authorising an agent to act on behalf of the principal.",
+        "Legal notice demanding payment and warning of proceedings under the relevant act and section.",
+    ],
+    "Resume/Career": [
+        "Resume with contact details, professional summary, work experience and education.",
+        "Curriculum vitae listing technical skills such as Python, React and SQL and personal projects.",
+        "Candidate profile with internships, certifications, achievements and career objective.",
+        "Cover letter applying for a software engineer position highlighting relevant experience.",
+        "Job offer letter stating designation, joining date, salary package and reporting manager.",
+    ],
+    "Technology": [
+        "Software design document describing system architecture, APIs, databases and deployment.",
+        "Technical specification of a cloud service with configuration, scalability and security details.",
+        "Product manual explaining hardware components, installation steps and troubleshooting.",
+        "Engineering report on machine learning model training, accuracy metrics and datasets.",
+        "Release notes listing new features, bug fixes and known issues in the application.",
+    ],
+    "Government": [
+        "Government notification announcing a new public scheme, eligibility criteria and application process.",
+        "Official circular from a ministry issuing guidelines to departments and state authorities.",
+        "Tax assessment order issued by the revenue department with assessment year and demand.",
+        "Identity certificate issued by a municipal office with registration number and seal.",
+        "Policy document on public administration, budget allocation and welfare programmes.",
+    ],
+    "General Knowledge": [
+        "Encyclopedia style article about the history, geography and culture of a country.",
+        "Informational essay explaining how the solar system formed and the planets that orbit the sun.",
+        "Overview of a famous historical event, its causes, key figures and consequences.",
+        "Biography describing the life, achievements and legacy of a well known scientist.",
+        "Article explaining everyday science facts about weather, plants and animals.",
+    ],
+    "Others": [
+        "Personal letter to a friend sharing news about family and weekend plans.",
+        "Recipe listing ingredients and cooking steps for a dinner dish.",
+        "Travel itinerary with flight times, hotel bookings and sightseeing plans.",
+        "Short story with characters, dialogue and a plot twist.",
+        "Shopping list and household to-do notes.",
+    ],
+}
+
+_centroids: Optional[np.ndarray] = None
+_labels: List[str] = list(DOMAIN_EXAMPLES)
+_centroid_lock = threading.Lock()
+_calibration: Optional[List[List[float]]] = None
+_stats_lock = threading.Lock()
+_stats = {"fast_path": 0, "llm_fallback": 0, "fast_path_ms": 0.0}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _get_centroids() -> np.ndarray:
+    """Embed the seed examples once and return one unit-length centroid per label"""
+    global _centroids
+    with _centroid_lock:
+        if _centroids is None:
+            centroids = []
+            for label in _labels:
+                embeddings = vector_db.embed(DOMAIN_EXAMPLES[label])
+                centroids.append(_normalize(embeddings).mean(axis=0))
+            _centroids = _normalize(np.stack(centroids))
+            logger.info(f"Built domain centroids for {len(_labels)} labels")
+    return _centroids
+
+
+def _windows(text: str) -> List[str]:
+    """Evenly spaced slices of the text, so long documents are not judged by their first page alone"""
+    text = text.strip()
+    size = DOMAIN_CLASSIFIER_WINDOW_CHARS
+    if len(text) <= size:
+        return [text]
+    count = min(DOMAIN_CLASSIFIER_WINDOWS, -(-len(text) // size))
+    starts = np.linspace(0, len(text) - size, count).astype(int)
+    return [text[start:start + size] for start in starts]
+
+
+def labels() -> List[str]:
+    return list(_labels)
+
+
+def label_similarities(text: str) -> np.ndarray:
+    """Cosine similarity of text to each label's centroid, in labels() order (blocking)"""
+    centroids = _get_centroids()
+    embeddings = vector_db.embed(_windows(text))
+    document = _normalize(_normalize(embeddings).mean(axis=0))
+    return centroids @ document
+
+
+def softmax_scores(similarities: np.ndarray, temperature: float = DOMAIN_CLASSIFIER_TEMPERATURE) -> np.ndarray:
+    scores = np.exp((similarities - similarities.max(axis=-1, keepdims=True)) / temperature)
+    return scores / scores.sum(axis=-1, keepdims=True)
+
+
+def calibrate(score: float, bins: List[List[float]]) -> float:
+    """Accuracy recorded for the bin score falls in; bins are [upper bound, accuracy] in ascending order"""
+    for upper, accuracy in bins:
+        if score <= upper:
+            return accuracy
+    return bins[-1][1]
+
+
+def _get_calibration() -> List[List[float]]:
+    """Calibration bins for the configured temperature, or [] when there are none"""
+    global _calibration
+    if _calibration is None:
+        bins = []
+        if os.path.exists(DOMAIN_CALIBRATION_PATH):
+            try:
+                with open(DOMAIN_CALIBRATION_PATH) as f:
+                    calibration = json.load(f)
+                if calibration["temperature"] == DOMAIN_CLASSIFIER_TEMPERATURE:
+                    bins = calibration["bins"]
+                else:
+                    logger.warning(f"Ignoring {DOMAIN_CALIBRATION_PATH}: it was measured at temperature "
+                                   f"{calibration['temperature']}, not {DOMAIN_CLASSIFIER_TEMPERATURE}")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable {DOMAIN_CALIBRATION_PATH}: {str(e)}")
+        _calibration = bins
+    return _calibration
+
+
+def classify(text: str) -> Dict[str, Any]:
+    """Nearest-centroid label for text, in the LLM's {domain, confidence, reason} shape (blocking).
+
+    ``confidence`` is the calibrated score when a calibration file exists and the raw softmax score
+    otherwise; ``calibrated`` says which, and ``classifier_score`` always holds the raw score.
+    """
+    similarities = label_similarities(text)
+    probabilities = softmax_scores(similarities)
+
+    best, runner_up = np.argsort(-probabilities)[:2]
+    score = float(probabilities[best])
+    bins = _get_calibration()
+    return {
+        "domain": _labels[best],
+        "confidence": round(calibrate(score, bins) if bins else score, 3),
+        "source": "local_classifier",
+        "calibrated": bool(bins),
+        "classifier_score": round(score, 3),
+        "reason": (
+            f"Closest to {_labels[best]} examples (similarity {similarities[best]:.2f}); "
+            f"next is {_labels[runner_up]} ({similarities[runner_up]:.2f})"
+        )
+    }
+
+
+def try_fast_path(text: str) -> Optional[Dict[str, Any]]:
+    """Local classification if it is confident enough, else None (blocking, run it in a thread)"""
+    if not DOMAIN_FASTPATH_ENABLED:
+        return None
+    start = time.perf_counter()
+    try:
+        result = classify(text)
+    except Exception as e:
+        logger.error(f"Local domain classifier failed: {str(e)}")
+        result = None
+    elapsed = (time.perf_counter() - start) * 1000
+
+    with _stats_lock:
+        if result is not None and result["confidence"] >= DOMAIN_FASTPATH_THRESHOLD:
+            _stats["fast_path"] += 1
+            _stats["fast_path_ms"] += elapsed
+            return result
+        _stats["llm_fallback"] += 1
+    if result is not None:
+        logger.info(f"Domain fast path unsure ({result['domain']} at {result['confidence']}), asking the LLM")
+    return None
+
+
+def fast_path_stats() -> Dict[str, Any]:
+    calibrated = bool(_get_calibration())
+    with _stats_lock:
+        total = _stats["fast_path"] + _stats["llm_fallback"]
+        return {
+            "enabled": DOMAIN_FASTPATH_ENABLED,
+            "threshold": DOMAIN_FASTPATH_THRESHOLD,
+            "calibrated": calibrated,
+            "fast_path": _stats["fast_path"],
+            "llm_fallback": _stats["llm_fallback"],
+            "fast_path_rate": _stats["fast_path"] / total if total else 0.0,
+            "avg_fast_path_ms": round(_stats["fast_path_ms"] / _stats["fast_path"], 2) if _stats["fast_path"] else 0.0
+        }
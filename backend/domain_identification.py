@@ -1,27 +1,28 @@
 import json
 import logging
-import requests
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from domain_classifier import fast_path_stats, try_fast_path
+from chunking import excerpt
+from llm_client import chat_completion, forget_completion
 from models import TextInput
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/identify-domain", tags=["Domain Identification"])
 
-# Replace with your actual Perplexity API key
-PERPLEXITY_API_KEY = "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"
-HEADERS = {
-    "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-    "Content-Type": "application/json"
-}
-PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
 
 @router.post("/")
-async def identify_domain(input: TextInput):
+async def identify_domain(input: TextInput, request: Request):
     if not input.text.strip():
         logger.warning("Empty text received")
         raise HTTPException(status_code=400, detail="Text input cannot be empty")
 
+    # Confident local classifications skip the LLM call
+    fast_result = await run_in_threadpool(try_fast_path, input.text)
+    if fast_result is not None:
+        return fast_result
+
     prompt = f"""
 You are an expert domain classifier. Carefully read the provided text and classify it into one of the following broad domains:
 
@@ -47,29 +48,11 @@ Respond ONLY with a valid JSON object in this format:
 }}
 
 Text:
-{input.text[:10000]}
+{excerpt(input.text, 10000)}
     """
 
-    payload = {
-        "model": "sonar-pro",
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
-
     try:
-        response = requests.post(PERPLEXITY_API_URL, headers=HEADERS, json=payload)
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Perplexity API error: {response.text}"
-            )
-        response_json = response.json()
-        logger.debug(f"Perplexity API response: {response_json}")
-
-        message_content = response_json.get("choices", [{}])[0].get("message", {}).get("content", "")
-        if not message_content:
-            raise HTTPException(status_code=500, detail="Empty response from Perplexity API")
+        message_content = await chat_completion(prompt, request=request)
 
         result = json.loads(message_content)
         if not all(key in result for key in ['domain', 'confidence', 'reason']):
@@ -78,8 +61,16 @@ Text:
         return result
 
     except json.JSONDecodeError:
+        await forget_completion(prompt)
         logger.error(f"Invalid JSON response: {message_content}")
         raise HTTPException(status_code=500, detail="Invalid JSON format returned by Perplexity API")
     except Exception as e:
+        await forget_completion(prompt)
         logger.error(f"Error in identify_domain: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to identify domain: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to identify domain: {str(e)}")
+
+
+@router.get("/fast-path-stats")
+async def get_fast_path_stats():
+    """How often domains were answered by the local classifier instead of the LLM"""
+    return fast_path_stats()
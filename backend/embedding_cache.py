@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import numpy as np
+from cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Embeddings kept in memory (384 float32s = 1.5 KB each)
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", 20000))
+# Embeddings kept in the memory-mapped disk tier; 0 disables it
+EMBEDDING_CACHE_DISK_ITEMS = int(os.getenv("EMBEDDING_CACHE_DISK_ITEMS", 100000))
+
+KEY_BYTES = 16
+
+
+def embedding_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+
+def model_fingerprint(name: str, encode: Callable[[List[str]], Any]) -> str:
+    """Identify a model by its name and its embedding of a fixed probe, so changed weights invalidate too"""
+    probe = np.round(np.asarray(encode(["embedding cache probe sentence"]), dtype="float32"), 4)
+    return hashlib.sha256(name.encode("utf-8") + str(probe.shape).encode("ascii") + probe.tobytes()).hexdigest()
+
+
+class EmbeddingCache:
+    """Content-hash keyed embedding cache: an LRU over a preallocated float32 matrix, in front of an
+    optional memory-mapped ring buffer on disk.
+
+    Keys are hashes of the text alone; the disk tier records the model fingerprint it was filled
+    with and starts empty when it changes. Disk slots are reused oldest first. Methods are blocking.
+    """
+
+    def __init__(self, name: str, fingerprint: str, dimension: int,
+                 memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS, disk_items: int = EMBEDDING_CACHE_DISK_ITEMS):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.dimension = dimension
+        self.directory = os.path.join(CACHE_DIR, name)
+        self._lock = threading.Lock()
+
+        self._memory = np.zeros((memory_items, dimension), dtype="float32")
+        self._memory_slots: "OrderedDict[bytes, int]" = OrderedDict()
+        self._free_slots = list(range(memory_items - 1, -1, -1))
+
+        self.disk_items = disk_items
+        self._disk_slots: Dict[bytes, int] = {}
+        if disk_items:
+            self._open_disk()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _open_disk(self):
+        """Map the disk tier, discarding it if it was written by another model or with another size"""
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, "meta.json")
+        meta = {"fingerprint": self.fingerprint, "dimension": self.dimension, "capacity": self.disk_items}
+        existing = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                existing = json.load(f)
+        mode = "r+" if existing == meta else "w+"
+        if existing is not None and existing != meta:
+            logger.info(f"Embedding model or cache size changed, discarding the {self.name} disk tier")
+        if mode == "w+":
+            # Write the meta file last, so an interrupted reset is redone on the next start
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+        self._vectors = np.memmap(os.path.join(self.directory, "vectors.f32"), dtype="float32", mode=mode,
+                                  shape=(self.disk_items, self.dimension))
+        self._keys = np.memmap(os.path.join(self.directory, "keys.bin"), dtype="uint8", mode=mode,
+                               shape=(self.disk_items, KEY_BYTES))
+        # Write order of each slot; 0 marks an empty one
+        self._sequence = np.memmap(os.path.join(self.directory, "sequence.u64"), dtype="uint64", mode=mode,
+                                   shape=(self.disk_items,))
+        if mode == "w+":
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+        for slot in np.flatnonzero(self._sequence):
+            self._disk_slots[self._keys[slot].tobytes()] = int(slot)
+        self._next_sequence = int(self._sequence.max()) + 1
+        self._next_slot = (int(self._sequence.argmax()) + 1) % self.disk_items if self._disk_slots else 0
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        slot = self._memory_slots.get(key)
+        if slot is None:
+            if not self._free_slots:
+                if not self._memory_slots:
+                    return
+                _, slot = self._memory_slots.popitem(last=False)
+            else:
+                slot = self._free_slots.pop()
+            self._memory_slots[key] = slot
+        else:
+            self._memory_slots.move_to_end(key)
+        self._memory[slot] = vector
+
+    def _store_on_disk(self, key: bytes, vector: np.ndarray):
+        if not self.disk_items or key in self._disk_slots:
+            return
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.disk_items
+        if self._sequence[slot]:
+            self._disk_slots.pop(self._keys[slot].tobytes(), None)
+        # Clear the slot first so a half-written entry is never read back as valid
+        self._sequence[slot] = 0
+        self._vectors[slot] = vector
+        self._keys[slot] = np.frombuffer(key, dtype="uint8")
+        self._sequence[slot] = self._next_sequence
+        self._next_sequence += 1
+        self._disk_slots[key] = slot
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """Cached vectors (copies) for keys, None for misses; disk hits are promoted to memory"""
+        found: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for key in keys:
+                slot = self._memory_slots.get(key)
+                if slot is not None:
+                    self._memory_slots.move_to_end(key)
+                    self.memory_hits += 1
+                    found.append(self._memory[slot].copy())
+                    continue
+                slot = self._disk_slots.get(key)
+                if slot is not None:
+                    vector = np.array(self._vectors[slot])
+                    self.disk_hits += 1
+                    self._remember(key, vector)
+                    found.append(vector)
+                    continue
+                self.misses += 1
+                found.append(None)
+        return found
+
+    def put_many(self, keys: Sequence[bytes], vectors: np.ndarray):
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector)
+                self._store_on_disk(key, vector)
+
+    def encode(self, texts: Sequence[str], encode: Callable[[List[str]], Any]) -> np.ndarray:
+        """Embeddings for texts as a float32 matrix, calling encode once for the distinct texts not cached"""
+        keys = [embedding_key(text) for text in texts]
+        vectors = self.get_many(keys)
+        missing: Dict[bytes, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        if missing:
+            encoded = np.asarray(encode(list(missing.values())), dtype="float32").reshape(len(missing), -1)
+            self.put_many(list(missing), encoded)
+            fresh = dict(zip(missing, encoded))
+            vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+        if not vectors:
+            return np.zeros((0, self.dimension), dtype="float32")
+        return np.vstack(vectors)
+
+    def flush(self):
+        """Write the disk tier's dirty pages back (called on shutdown)"""
+        if self.disk_items:
+            with self._lock:
+                for array in (self._vectors, self._keys, self._sequence):
+                    array.flush()
+
+    def clear(self):
+        with self._lock:
+            self._memory_slots.clear()
+            self._free_slots = list(range(len(self._memory) - 1, -1, -1))
+            if self.disk_items:
+                self._sequence[:] = 0
+                self._disk_slots.clear()
+                self._next_slot = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory_slots),
+                "memory_bytes": len(self._memory_slots) * self.dimension * 4,
+                "disk_entries": len(self._disk_slots),
+                "disk_capacity": self.disk_items,
+                "fingerprint": self.fingerprint[:12]
+            }
@@ -0,0 +1,193 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Most texts encoded in one model call, and longest a request waits for others to share its batch
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 64))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", 5))
+# Longest a caller waits for its embeddings before giving up
+EMBEDDING_REQUEST_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_REQUEST_TIMEOUT_SECONDS", 120))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+LATENCY_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Histogram:
+    """Counts per upper bucket bound (the last bucket is unbounded) plus recent values for percentiles"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self._recent: "deque[float]" = deque(maxlen=1000)
+
+    def observe(self, value: float):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self._recent.append(value)
+
+    def summary(self) -> Dict[str, Any]:
+        recent = list(self._recent)
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "p50": round(_percentile(recent, 0.50), 2),
+            "p95": round(_percentile(recent, 0.95), 2),
+            "p99": round(_percentile(recent, 0.99), 2)
+        }
+
+
+class EmbeddingBatcher:
+    """Collects encode calls from concurrent requests into larger batches on one worker thread.
+
+    ``encode(texts)`` blocks its caller until the batch containing its texts has run. The worker takes
+    the first waiting request, then keeps adding requests until the batch holds ``max_batch_size``
+    texts or ``max_wait_ms`` has passed, makes one model call and resolves each caller's future with
+    its rows. A request larger than ``max_batch_size`` is encoded on its own. The model releases the
+    GIL while it computes, so a thread is enough to keep the event loop and the threadpool free.
+    After ``close()`` new requests fail at once instead of waiting on a stopped worker.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], Any], max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE,
+                 max_wait_ms: float = EMBEDDING_BATCH_MAX_WAIT_MS):
+        self._encode = encode
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Optional[Tuple[List[str], Future, float]]]" = queue.Queue()
+        self._pending: Optional[Tuple[List[str], Future, float]] = None
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.requests_per_batch = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_latency_ms = Histogram(LATENCY_MS_BUCKETS)
+        self.encode_ms = Histogram(LATENCY_MS_BUCKETS)
+        self.counters = {"requests": 0, "texts": 0, "batches": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+        # Guards _closed, so no request is queued behind the stop sentinel
+        self._submit_lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        if not texts:
+            future.set_result(np.zeros((0, 0), dtype="float32"))
+            return future
+        with self._submit_lock:
+            if self._closed:
+                future.set_exception(RuntimeError("Embedding batcher is stopped"))
+                return future
+            self._queue.put((list(texts), future, time.monotonic()))
+        return future
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as float32 rows, sharing a model call with concurrent callers (blocking)"""
+        return self.submit(texts).result(timeout=EMBEDDING_REQUEST_TIMEOUT_SECONDS)
+
+    def _next_batch(self) -> Optional[List[Tuple[List[str], Future, float]]]:
+        first = self._pending or self._queue.get()
+        self._pending = None
+        if first is None:
+            return None
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                # Starts the next batch, so no batch grows past the limit because of a late arrival
+                self._pending = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                self._fail_remaining()
+                return
+            started = time.monotonic()
+            texts = [text for request_texts, _, _ in batch for text in request_texts]
+            try:
+                vectors = np.asarray(self._encode(texts), dtype="float32").reshape(len(texts), -1)
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(texts)} texts failed: {str(e)}")
+                with self._stats_lock:
+                    self.counters["errors"] += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            encode_ms = (time.monotonic() - started) * 1000
+
+            offset = 0
+            for request_texts, future, _ in batch:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+            with self._stats_lock:
+                self.counters["requests"] += len(batch)
+                self.counters["texts"] += len(texts)
+                self.counters["batches"] += 1
+                self.batch_sizes.observe(len(texts))
+                self.requests_per_batch.observe(len(batch))
+                self.encode_ms.observe(encode_ms)
+                for _, _, enqueued_at in batch:
+                    self.queue_latency_ms.observe((started - enqueued_at) * 1000)
+
+    def _fail_remaining(self):
+        """Fail requests left behind the stop sentinel, so their callers don't wait for a stopped worker"""
+        leftovers = [self._pending] if self._pending is not None else []
+        self._pending = None
+        while True:
+            try:
+                leftovers.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for request in leftovers:
+            if request is not None:
+                request[1].set_exception(RuntimeError("Embedding batcher is stopped"))
+
+    def close(self):
+        """Finish queued requests and stop the worker; later requests fail at once"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            batches = self.counters["batches"]
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self._queue.qsize(),
+                "mean_batch_size": round(self.counters["texts"] / batches, 2) if batches else 0.0,
+                "batch_size": self.batch_sizes.summary(),
+                "requests_per_batch": self.requests_per_batch.summary(),
+                "queue_latency_ms": self.queue_latency_ms.summary(),
+                "encode_ms": self.encode_ms.summary(),
+                **self.counters
+            }
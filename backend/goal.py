@@ -1,28 +1,30 @@
 import json
 import logging
-import requests
-from fastapi import APIRouter, HTTPException
+import os
+from typing import Any, Dict, Tuple
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from chunking import excerpt
+from llm_client import chat_completion, forget_completion
+from llm_scheduler import PRIORITY_INTERACTIVE
+from streaming import sse_response, stream_json_completion
+from prompt_compaction import compact_for_query
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/specify-goal", tags=["Goal Specification"])
 
-# Replace with your actual Perplexity API key
-PERPLEXITY_API_KEY = "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"
-HEADERS = {
-    "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-    "Content-Type": "application/json"
-}
-PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
+# Token budget for document content in the goal prompt; the sentences most relevant to the goal are kept
+GOAL_CONTENT_TOKENS = int(os.getenv("GOAL_CONTENT_TOKENS", 2500))
+
 
 # Input model for the endpoint
 class GoalInput(BaseModel):
     goal: str
     pdf_content: str
 
-@router.post("/")
-async def specify_goal(input: GoalInput):
+def check_goal_input(input: GoalInput):
     if not input.goal.strip():
         logger.warning("Empty goal received")
         raise HTTPException(status_code=400, detail="Goal input cannot be empty")
@@ -30,12 +32,20 @@ async def specify_goal(input: GoalInput):
         logger.warning("Empty PDF content received")
         raise HTTPException(status_code=400, detail="PDF content cannot be empty")
 
-    prompt = f"""
+
+async def compact_goal_input(input: GoalInput) -> Tuple[GoalInput, Dict[str, int]]:
+    """The input with its content reduced to the goal-relevant sentences that fit GOAL_CONTENT_TOKENS"""
+    content, report = await run_in_threadpool(compact_for_query, input.pdf_content, input.goal, GOAL_CONTENT_TOKENS)
+    return GoalInput(goal=input.goal, pdf_content=content), report
+
+
+def build_goal_prompt(input: GoalInput) -> str:
+    return f"""
 You are an expert goal specification assistant. Your task is to analyze the provided user goal and PDF content, then generate a clear and actionable plan to achieve the goal. The response should include a structured procedure, a general approach, and specific steps tailored to the goal and context provided by the PDF content.
 
 **Input:**
 - User Goal: {input.goal}
-- PDF Content: {input.pdf_content[:10000]}
+- PDF Content: {excerpt(input.pdf_content, 10000)}
 
 **Instructions:**
 AT first iniatlly check that query is not related to user document sent the false in all json 
@@ -64,47 +74,54 @@ Return a JSON object with the following structure:
 - The response must be valid JSON.
 """
 
-    payload = {
-        "model": "sonar-pro",
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
 
-    try:
-        response = requests.post(PERPLEXITY_API_URL, headers=HEADERS, json=payload)
-        if response.status_code != 200:
-            logger.error(f"Perplexity API error: {response.text}")
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Perplexity API error: {response.text}"
-            )
-        response_json = response.json()
-        logger.debug(f"Perplexity API response: {response_json}")
-
-        message_content = response_json.get("choices", [{}])[0].get("message", {}).get("content", "")
-        if not message_content:
-            logger.error("Empty response from Perplexity API")
-            raise HTTPException(status_code=500, detail="Empty response from Perplexity API")
-
-        # Parse the response as JSON
-        result = json.loads(message_content)
-        
-        # Validate the response structure
-        required_keys = ["procedure", "approach", "steps"]
-        if not all(key in result for key in required_keys):
-            logger.error(f"Missing required fields in response: {result}")
-            raise HTTPException(status_code=500, detail="Missing required fields in response")
-        
-        if not isinstance(result["steps"], list) or len(result["steps"]) < 3 or len(result["steps"]) > 5:
-            logger.error(f"Invalid steps format or count: {result['steps']}")
-            raise HTTPException(status_code=500, detail="Steps must be a list of 3-5 items")
+def parse_goal_plan(message_content: str) -> Dict[str, Any]:
+    """Parse and validate the plan JSON (raises json.JSONDecodeError or HTTPException)"""
+    result = json.loads(message_content)
+
+    # Validate the response structure
+    required_keys = ["procedure", "approach", "steps"]
+    if not all(key in result for key in required_keys):
+        logger.error(f"Missing required fields in response: {result}")
+        raise HTTPException(status_code=500, detail="Missing required fields in response")
+
+    if not isinstance(result["steps"], list) or len(result["steps"]) < 3 or len(result["steps"]) > 5:
+        logger.error(f"Invalid steps format or count: {result['steps']}")
+        raise HTTPException(status_code=500, detail="Steps must be a list of 3-5 items")
+
+    return result
 
+
+@router.post("/")
+async def specify_goal(input: GoalInput, request: Request):
+    check_goal_input(input)
+    input, compaction = await compact_goal_input(input)
+    prompt = build_goal_prompt(input)
+
+    try:
+        message_content = await chat_completion(prompt, request=request, priority=PRIORITY_INTERACTIVE)
+        result = parse_goal_plan(message_content)
+        result["prompt_compaction"] = compaction
         return result
 
     except json.JSONDecodeError:
+        await forget_completion(prompt)
         logger.error(f"Invalid JSON response: {message_content}")
         raise HTTPException(status_code=500, detail="Invalid JSON format returned by Perplexity API")
     except Exception as e:
+        await forget_completion(prompt)
         logger.error(f"Error in specify_goal: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to specify goal: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to specify goal: {str(e)}")
+
+
+@router.post("/stream")
+async def specify_goal_stream(input: GoalInput):
+    """Server-sent events: upstream tokens, the procedure, approach and each step as soon as they are complete, then the validated plan"""
+    check_goal_input(input)
+    input, compaction = await compact_goal_input(input)
+
+    def parse(message_content: str) -> Dict[str, Any]:
+        return {**parse_goal_plan(message_content), "prompt_compaction": compaction}
+
+    watch = {("procedure",): "procedure", ("approach",): "approach", ("steps", "*"): "step"}
+    return sse_response(stream_json_completion(build_goal_prompt(input), watch, parse))
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import time
+from typing import Dict, Tuple
+import numpy as np
+from PIL import Image
+
+# Each stage can be switched off to trade OCR accuracy against throughput
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") == "1"
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "1") == "1"
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "1") == "1"
+OCR_DESKEW = os.getenv("OCR_DESKEW", "0") == "1"
+# Images scanned above this resolution are downscaled to it
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", 300))
+# Longest side allowed when the image carries no usable DPI (A4 at 300 DPI)
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", 3508))
+# Skew angles searched by deskew, in degrees either side of horizontal
+OCR_DESKEW_MAX_ANGLE = float(os.getenv("OCR_DESKEW_MAX_ANGLE", 5))
+OCR_DESKEW_STEP = float(os.getenv("OCR_DESKEW_STEP", 0.5))
+# Bumped when a stage's output changes, so OCR cached under older preprocessing is not reused
+PREPROCESS_VERSION = 2
+
+
+def settings_fingerprint() -> str:
+    """Short digest of the preprocessing settings, for keying cached OCR output"""
+    settings = (PREPROCESS_VERSION, OCR_PREPROCESS, OCR_GRAYSCALE, OCR_BINARIZE, OCR_DESKEW, OCR_TARGET_DPI,
+                OCR_MAX_SIDE, OCR_DESKEW_MAX_ANGLE, OCR_DESKEW_STEP)
+    return hashlib.sha256(repr(settings).encode("utf-8")).hexdigest()[:8]
+
+
+def to_grayscale(image: Image.Image) -> Image.Image:
+    """Grayscale copy of the image, with any transparency flattened onto white first.
+
+    Transparent pixels are usually stored as black, so converting without flattening turns a
+    transparent background black, where Tesseract itself would have put the image on white.
+    """
+    if image.mode == "P" and "transparency" in image.info:
+        image = image.convert("RGBA")
+    if image.mode in ("RGBA", "LA", "PA"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return image.convert("L")
+
+
+def downscale(image: Image.Image) -> Image.Image:
+    """Reduce the image to OCR_TARGET_DPI, or to OCR_MAX_SIDE when DPI is unknown"""
+    scale = 1.0
+    dpi = image.info.get("dpi")
+    if dpi and dpi[0] and float(dpi[0]) > OCR_TARGET_DPI:
+        scale = OCR_TARGET_DPI / float(dpi[0])
+    elif max(image.size) > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / max(image.size)
+    if scale >= 1.0:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+
+def binarize(image: Image.Image) -> Image.Image:
+    """Black-and-white image using Otsu's global threshold"""
+    pixels = np.asarray(to_grayscale(image), dtype=np.uint8)
+    hist = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    omega = np.cumsum(hist) / pixels.size
+    mu = np.cumsum(hist * np.arange(256)) / pixels.size
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between_var = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    threshold = int(np.nanargmax(between_var)) if np.isfinite(between_var).any() else 127
+    return Image.fromarray(np.where(pixels > threshold, 255, 0).astype(np.uint8), "L")
+
+
+def deskew(image: Image.Image) -> Image.Image:
+    """Rotate by the angle that makes text rows sharpest in the horizontal projection"""
+    gray = to_grayscale(image)
+    thumb = gray.copy()
+    thumb.thumbnail((800, 800))
+
+    def sharpness(angle: float) -> float:
+        rotated = np.asarray(thumb.rotate(angle, fillcolor=255), dtype=np.uint8)
+        rows = (rotated < 128).sum(axis=1).astype(np.float64)
+        return float(np.square(np.diff(rows)).sum())
+
+    best_angle, best_score = 0.0, sharpness(0.0)
+    for angle in np.arange(-OCR_DESKEW_MAX_ANGLE, OCR_DESKEW_MAX_ANGLE + 1e-9, OCR_DESKEW_STEP):
+        score = sharpness(float(angle))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    if abs(best_angle) < OCR_DESKEW_STEP / 2:
+        return gray
+    return gray.rotate(best_angle, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+
+
+def preprocess(image: Image.Image) -> Tuple[Image.Image, Dict[str, float]]:
+    """Run the enabled stages in order and return the image with per-stage timings in ms"""
+    timings: Dict[str, float] = {}
+    if not OCR_PREPROCESS:
+        return image, timings
+
+    stages = [
+        ("grayscale", OCR_GRAYSCALE, to_grayscale),
+        ("downscale", True, downscale),
+        ("binarize", OCR_BINARIZE, binarize),
+        ("deskew", OCR_DESKEW, deskew),
+    ]
+    for name, enabled, stage in stages:
+        if not enabled:
+            continue
+        start = time.perf_counter()
+        image = stage(image)
+        timings[name] = (time.perf_counter() - start) * 1000
+    return image, timings
@@ -1,27 +1,44 @@
+import asyncio
 import json
 import logging
-import requests
-from fastapi import APIRouter, HTTPException
+import os
+import re
+from typing import Any, AsyncIterator, Dict, List, Tuple, Union
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from chunking import chunk_text
+from llm_client import chat_completion, forget_completion
+from llm_scheduler import PRIORITY_BULK
+from streaming import sse_event, sse_response, stream_json_completion
 from models import InsightInput
+from prompt_compaction import compact_document
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/generate-insights", tags=["Insights Generation"])
 
-PERPLEXITY_API_KEY = "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"  # ⚠️ MOVE TO ENV in production
-HEADERS = {
-    "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-    "Content-Type": "application/json"
-}
-PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
+# Documents longer than one chunk are analysed chunk by chunk and merged
+INSIGHTS_MAP_REDUCE_ENABLED = os.getenv("INSIGHTS_MAP_REDUCE_ENABLED", "1") == "1"
+# Chunks of one document analysed at the same time
+INSIGHTS_CHUNK_CONCURRENCY = int(os.getenv("INSIGHTS_CHUNK_CONCURRENCY", 4))
+# Most insights kept after merging chunks (suggestions are generated one per insight)
+INSIGHTS_MAX_MERGED = int(os.getenv("INSIGHTS_MAX_MERGED", 10))
 
-@router.post("/")
-async def generate_insights(input: InsightInput):
+
+def check_insight_input(input: InsightInput):
     if not input.content.strip() or not input.domain.strip():
         logger.warning("Empty content or domain received")
         raise HTTPException(status_code=400, detail="Content and domain cannot be empty")
 
-    prompt = f"""
+
+async def compact_insight_input(input: InsightInput) -> Tuple[InsightInput, Dict[str, int]]:
+    """The input with its content stripped of boilerplate and excess whitespace, plus the token report"""
+    content, report = await run_in_threadpool(compact_document, input.content)
+    return InsightInput(domain=input.domain, content=content, language=input.language), report
+
+
+def build_insights_prompt(input: InsightInput) -> str:
+    return f"""
 You are a highly skilled and domain-aware AI Insight Agent. Analyze the document below based on its **domain** and **full content**. Your goal is to extract deep, meaningful insights, present a domain-aware summary, and highlight potential **risk factors** based on the document content and its context.
 
 Respond ONLY with a valid JSON object in the following exact format:
@@ -65,47 +82,219 @@ Content:
 {input.content[:10000]}
 """
 
-    payload = {
-        "model": "sonar-pro",
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
 
-    try:
-        response = requests.post(PERPLEXITY_API_URL, headers=HEADERS, json=payload)
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Perplexity API error: {response.text}"
-            )
+def parse_insights(message_content: str) -> Dict[str, Any]:
+    """Extract the insights JSON from a completion and validate it (raises json.JSONDecodeError or HTTPException)"""
+    json_start = message_content.find('{')
+    json_end = message_content.rfind('}') + 1
+    pure_json = message_content[json_start:json_end]
+
+    result = json.loads(pure_json)
 
-        response_json = response.json()
-        logger.debug(f"Perplexity API response: {response_json}")
+    if "detailed_insights" not in result or "domain_summary" not in result:
+        raise HTTPException(status_code=500, detail="Missing required fields in response")
+    if not isinstance(result["detailed_insights"], list):
+        raise HTTPException(status_code=500, detail="detailed_insights must be a list")
 
-        message_content = response_json.get("choices", [{}])[0].get("message", {}).get("content", "")
-        if not message_content:
-            raise HTTPException(status_code=500, detail="Empty response from Perplexity API")
+    # Validate risk_factors field in each insight
+    for insight in result["detailed_insights"]:
+        if "risk_factors" not in insight:
+            raise HTTPException(status_code=500, detail="Missing risk_factors in insights")
 
-        json_start = message_content.find('{')
-        json_end = message_content.rfind('}') + 1
-        pure_json = message_content[json_start:json_end]
+    return result
 
-        result = json.loads(pure_json)
 
-        if "detailed_insights" not in result or "domain_summary" not in result:
-            raise HTTPException(status_code=500, detail="Missing required fields in response")
-        if not isinstance(result["detailed_insights"], list):
-            raise HTTPException(status_code=500, detail="detailed_insights must be a list")
+def _merge_insights(results: List[Dict[str, Any]], limit: int = INSIGHTS_MAX_MERGED) -> List[Dict[str, Any]]:
+    """Fold chunk insights with the same title and description together and keep the ``limit`` best.
 
-        # Validate risk_factors field in each insight
+    Insights found in more chunks rank first, then those with more supporting data and risk
+    factors; ties keep document order.
+    """
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    found_in: Dict[Tuple[str, str], int] = {}
+    for result in results:
         for insight in result["detailed_insights"]:
-            if "risk_factors" not in insight:
-                raise HTTPException(status_code=500, detail="Missing risk_factors in insights")
+            key = tuple(re.sub(r"\W+", " ", str(insight.get(field, ""))).strip().lower()
+                        for field in ("title", "description"))
+            found_in[key] = found_in.get(key, 0) + 1
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = dict(insight)
+                continue
+            for field in ("supporting_data", "risk_factors"):
+                if isinstance(existing.get(field), list) and isinstance(insight.get(field), list):
+                    existing[field] = existing[field] + [item for item in insight[field] if item not in existing[field]]
+
+    def evidence(key: Tuple[str, str]) -> int:
+        return sum(len(merged[key].get(field) or []) for field in ("supporting_data", "risk_factors"))
+
+    ranked = sorted(merged, key=lambda key: (-found_in[key], -evidence(key)))
+    return [merged[key] for key in ranked[:limit]]
+
+
+async def _summarize_chunks(input: InsightInput, summaries: List[str], request: Request) -> str:
+    """Combine per-chunk summaries into one; falls back to joining them if the LLM call fails or its answer is unusable"""
+    if len(summaries) == 1:
+        return summaries[0]
+    numbered = "\n".join(f"{i}. {summary}" for i, summary in enumerate(summaries, 1))
+    prompt = f"""
+You are combining partial analyses of one long document. Each numbered summary below covers one consecutive part of the document. Write a single coherent, domain-aware summary of the whole document that keeps the important facts from every part.
+
+Respond ONLY with a valid JSON object in this format:
+{{
+  "domain_summary": "..."
+}}
+
+Domain: {input.domain}
+Language: {input.language}
+
+Partial summaries:
+{numbered}
+"""
+    try:
+        message_content = await chat_completion(prompt, request=request, priority=PRIORITY_BULK)
+        result = json.loads(message_content[message_content.find('{'):message_content.rfind('}') + 1])
+        if isinstance(result.get("domain_summary"), str) and result["domain_summary"].strip():
+            return result["domain_summary"]
+    except (json.JSONDecodeError, AttributeError):
+        pass
+    except HTTPException as e:
+        # Every chunk was analysed, so an upstream failure here costs only the merged wording
+        if e.status_code == 499:
+            raise
+        logger.warning(f"Summary merge request failed: {e.detail}")
+    await forget_completion(prompt)
+    logger.warning("Could not merge chunk summaries, joining them instead")
+    return " ".join(summaries)
+
+
+async def _analyse_chunk(input: InsightInput, chunk: str, semaphore: asyncio.Semaphore,
+                         request: Request) -> Dict[str, Any]:
+    # The prompt depends only on the chunk itself, so unchanged chunks are served from the LLM cache
+    prompt = build_insights_prompt(InsightInput(domain=input.domain, content=chunk, language=input.language))
+    async with semaphore:
+        message_content = await chat_completion(prompt, request=request, priority=PRIORITY_BULK)
+    try:
+        return parse_insights(message_content)
+    except (json.JSONDecodeError, HTTPException):
+        await forget_completion(prompt)
+        raise
+
 
+def _start_chunks(input: InsightInput, chunks: List[str], request: Request) -> List[asyncio.Task]:
+    """One task per chunk, resolving to (index, insights or the exception that stopped it)"""
+    semaphore = asyncio.Semaphore(INSIGHTS_CHUNK_CONCURRENCY)
+
+    async def analyse(index: int, chunk: str) -> Tuple[int, Union[Dict[str, Any], Exception]]:
+        try:
+            return index, await _analyse_chunk(input, chunk, semaphore, request)
+        except Exception as e:
+            return index, e
+
+    return [asyncio.create_task(analyse(index, chunk)) for index, chunk in enumerate(chunks)]
+
+
+def _check_chunk(outcome: Union[Dict[str, Any], Exception]):
+    """Re-raise a disconnected client; other chunk failures are logged and left out"""
+    if isinstance(outcome, HTTPException) and outcome.status_code == 499:
+        raise outcome
+    if isinstance(outcome, Exception):
+        logger.error(f"Chunk insight extraction failed: {str(outcome)}")
+
+
+async def _reduce_chunks(input: InsightInput, outcomes: List[Union[Dict[str, Any], Exception]],
+                         request: Request) -> Dict[str, Any]:
+    """Merge the chunk results, in document order, into one response"""
+    results = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+    errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+    if not results:
+        raise errors[0]
+
+    summary = await _summarize_chunks(input, [result["domain_summary"] for result in results], request)
+    logger.info(f"Merged insights from {len(results)} of {len(outcomes)} chunks")
+    return {
+        "detailed_insights": _merge_insights(results, INSIGHTS_MAX_MERGED),
+        "domain_summary": summary,
+        "chunks": {"total": len(outcomes), "failed": len(errors)}
+    }
+
+
+async def generate_insights_map_reduce(input: InsightInput, chunks: List[str], request: Request) -> Dict[str, Any]:
+    """Extract insights from every chunk concurrently, then merge them into one response.
+
+    Chunks that fail are left out and counted; the request fails only if every chunk does.
+    """
+    tasks = _start_chunks(input, chunks, request)
+    outcomes: List[Union[Dict[str, Any], Exception]] = [None] * len(chunks)
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, outcome = await next_done
+            _check_chunk(outcome)
+            outcomes[index] = outcome
+    finally:
+        for task in tasks:
+            task.cancel()
+    return await _reduce_chunks(input, outcomes, request)
+
+
+async def stream_insights_map_reduce(input: InsightInput, chunks: List[str], compaction: Dict[str, int],
+                                     request: Request) -> AsyncIterator[str]:
+    """Server-sent events for a multi-chunk document: a ``chunk`` (or ``chunk_error``) event as each
+    chunk is analysed, the merged ``summary``, then the same ``result`` as the non-streaming endpoint"""
+    tasks = _start_chunks(input, chunks, request)
+    outcomes: List[Union[Dict[str, Any], Exception]] = [None] * len(chunks)
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, outcome = await next_done
+            _check_chunk(outcome)
+            outcomes[index] = outcome
+            if isinstance(outcome, Exception):
+                detail = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+                yield sse_event("chunk_error", {"index": index, "total": len(chunks), "detail": detail})
+            else:
+                yield sse_event("chunk", {"index": index, "total": len(chunks), "value": outcome})
+        result = await _reduce_chunks(input, outcomes, request)
+    except HTTPException as he:
+        yield sse_event("error", {"status_code": he.status_code, "detail": he.detail})
+        return
+    except Exception as e:
+        logger.error(f"Error streaming insights: {str(e)}")
+        yield sse_event("error", {"status_code": 500, "detail": f"Failed to generate insights: {str(e)}"})
+        return
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield sse_event("summary", {"path": ["domain_summary"], "value": result["domain_summary"]})
+    result["prompt_compaction"] = compaction
+    yield sse_event("result", result)
+
+
+@router.post("/")
+async def generate_insights(input: InsightInput, request: Request):
+    check_insight_input(input)
+    input, compaction = await compact_insight_input(input)
+    chunks = chunk_text(input.content)
+    if INSIGHTS_MAP_REDUCE_ENABLED and len(chunks) > 1:
+        try:
+            result = await generate_insights_map_reduce(input, chunks, request)
+            result["prompt_compaction"] = compaction
+            return result
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating insights: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to generate insights: {str(e)}")
+
+    prompt = build_insights_prompt(input)
+
+    try:
+        message_content = await chat_completion(prompt, request=request, priority=PRIORITY_BULK)
+        result = parse_insights(message_content)
+        result["prompt_compaction"] = compaction
         return result
 
     except json.JSONDecodeError as je:
+        await forget_completion(prompt)
         logger.error(f"Invalid JSON response: {message_content}")
         logger.error(f"JSON decode error: {str(je)}")
         raise HTTPException(status_code=422, detail={
@@ -115,5 +304,23 @@ Content:
         })
 
     except Exception as e:
+        await forget_completion(prompt)
         logger.error(f"Error generating insights: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate insights: {str(e)}")
+
+
+@router.post("/stream")
+async def generate_insights_stream(input: InsightInput, request: Request):
+    """Server-sent events: upstream tokens, each insight and the summary as soon as they are complete, then the
+    validated result. Documents longer than one chunk stream per-chunk results instead (stream_insights_map_reduce)."""
+    check_insight_input(input)
+    input, compaction = await compact_insight_input(input)
+    chunks = chunk_text(input.content)
+    if INSIGHTS_MAP_REDUCE_ENABLED and len(chunks) > 1:
+        return sse_response(stream_insights_map_reduce(input, chunks, compaction, request))
+
+    def parse(message_content: str) -> Dict[str, Any]:
+        return {**parse_insights(message_content), "prompt_compaction": compaction}
+
+    watch = {("detailed_insights", "*"): "insight", ("domain_summary",): "summary"}
+    return sse_response(stream_json_completion(build_insights_prompt(input), watch, parse))
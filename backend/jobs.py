@@ -0,0 +1,326 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from ocr_extraction import SUPPORTED_EXTENSIONS
+from pipeline import AnalysisPipeline
+from uploads import SpooledUpload, spool_upload
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/jobs", tags=["Analysis Jobs"])
+
+JOBS_DIR = os.path.join("data", "jobs")
+JOBS_DB_PATH = os.path.join(JOBS_DIR, "jobs.sqlite3")
+# Documents analysed at the same time across all jobs
+JOBS_MAX_CONCURRENCY = int(os.getenv("JOBS_MAX_CONCURRENCY", 4))
+# Most documents accepted in one job
+JOBS_MAX_DOCUMENTS = int(os.getenv("JOBS_MAX_DOCUMENTS", 1000))
+
+TERMINAL_STATUSES = ("done", "error", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    language TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS documents (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT,
+    status TEXT NOT NULL,
+    stages TEXT NOT NULL DEFAULT '{}',
+    results TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    elapsed_ms REAL,
+    PRIMARY KEY (job_id, position)
+);
+"""
+
+
+class JobStore:
+    """SQLite record of jobs and their documents, so progress and results survive restarts.
+
+    Methods are blocking; call them from a thread.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def create_job(self, job_id: str, language: str, documents: List[Dict[str, Any]]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, status, language, created_at, total) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, language, time.time(), len(documents))
+            )
+            self._conn.executemany(
+                "INSERT INTO documents (job_id, position, filename, path, status, error) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, d["position"], d["filename"], d["path"], d["status"], d.get("error")) for d in documents]
+            )
+            failed = sum(1 for d in documents if d["status"] == "error")
+            self._conn.execute("UPDATE jobs SET failed = ? WHERE job_id = ?", (failed, job_id))
+
+    def set_job_status(self, job_id: str, status: str):
+        finished_at = time.time() if status in ("completed", "cancelled") else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ? AND status != 'cancelled'",
+                (status, finished_at, job_id)
+            )
+
+    def update_document(self, job_id: str, position: int, status: str,
+                        stages: Optional[Dict[str, Any]] = None, results: Optional[Dict[str, Any]] = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE documents SET status = ?, stages = COALESCE(?, stages), results = COALESCE(?, results) "
+                "WHERE job_id = ? AND position = ? AND status != 'cancelled'",
+                (status, None if stages is None else json.dumps(stages),
+                 None if results is None else json.dumps(results), job_id, position)
+            )
+
+    def finish_document(self, job_id: str, position: int, status: str, error: Optional[str], elapsed_ms: float):
+        """Record a document's outcome and count it on its job (unless the job was cancelled meanwhile)"""
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE documents SET status = ?, error = ?, elapsed_ms = ?, path = NULL "
+                "WHERE job_id = ? AND position = ? AND status != 'cancelled'",
+                (status, error, elapsed_ms, job_id, position)
+            ).rowcount
+            if updated:
+                column = "completed" if status == "done" else "failed"
+                self._conn.execute(f"UPDATE jobs SET {column} = {column} + 1 WHERE job_id = ?", (job_id,))
+
+    def cancel_job(self, job_id: str) -> bool:
+        """Mark a job and its unfinished documents cancelled; False if it had already finished"""
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id)
+            ).rowcount
+            if updated:
+                self._conn.execute(
+                    "UPDATE documents SET status = 'cancelled', path = NULL WHERE job_id = ? AND status IN ('queued', 'running')",
+                    (job_id,)
+                )
+            return bool(updated)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_jobs(self, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_documents(self, job_id: str, statuses: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM documents WHERE job_id = ?"
+        params: list = [job_id]
+        if statuses:
+            query += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params.extend(statuses)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY position", params).fetchall()
+        documents = []
+        for row in rows:
+            document = dict(row)
+            document["stages"] = json.loads(document["stages"])
+            document["results"] = json.loads(document["results"])
+            documents.append(document)
+        return documents
+
+    def unfinished_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        return [dict(row) for row in rows]
+
+
+store = JobStore(JOBS_DB_PATH)
+_job_semaphore = asyncio.Semaphore(JOBS_MAX_CONCURRENCY)
+_job_tasks: Dict[str, asyncio.Task] = {}
+
+
+async def _run_document(job_id: str, language: str, document: Dict[str, Any]):
+    position = document["position"]
+    async with _job_semaphore:
+        start = time.perf_counter()
+        await run_in_threadpool(store.update_document, job_id, position, "running")
+        # A document resumed after a restart keeps the stages it finished, so its vectors aren't stored twice
+        stages = {stage: event for stage, event in document["stages"].items() if event["status"] == "done"}
+        results = {stage: result for stage, result in document["results"].items() if stage in stages}
+        try:
+            upload = await run_in_threadpool(SpooledUpload.from_path, document["path"])
+            pipeline = AnalysisPipeline(None, language, upload=upload, filename=document["filename"],
+                                        completed=results)
+            events = pipeline.run()
+            try:
+                async for event in events:
+                    stage = event.pop("stage")
+                    if "result" in event:
+                        results[stage] = event.pop("result")
+                    stages[stage] = event
+                    await run_in_threadpool(store.update_document, job_id, position, "running", stages, results)
+            finally:
+                await events.aclose()
+            failed = [stage for stage, event in stages.items() if event["status"] != "done"]
+            status, error = ("error", f"Stages did not complete: {', '.join(failed)}") if failed else ("done", None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} document {document['filename']} failed: {str(e)}")
+            status, error = "error", str(e)
+
+        elapsed = round((time.perf_counter() - start) * 1000, 1)
+        await run_in_threadpool(store.finish_document, job_id, position, status, error, elapsed)
+        await run_in_threadpool(_remove_file, document["path"])
+
+
+def _remove_file(path: Optional[str]):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+async def _run_job(job_id: str, language: str, documents: List[Dict[str, Any]]):
+    await run_in_threadpool(store.set_job_status, job_id, "running")
+    await asyncio.gather(*[_run_document(job_id, language, document) for document in documents])
+    await run_in_threadpool(store.set_job_status, job_id, "completed")
+    await run_in_threadpool(shutil.rmtree, os.path.join(JOBS_DIR, job_id), True)
+    logger.info(f"Analysis job {job_id} finished")
+
+
+def _start_job(job_id: str, language: str, documents: List[Dict[str, Any]]):
+    task = asyncio.create_task(_run_job(job_id, language, documents))
+    _job_tasks[job_id] = task
+    task.add_done_callback(lambda _: _job_tasks.pop(job_id, None))
+
+
+async def resume_jobs():
+    """Restart every job left queued or running by the previous process (called on application startup).
+
+    Documents that were running pick up after the last stage they finished.
+    """
+    for job in await run_in_threadpool(store.unfinished_jobs):
+        documents = await run_in_threadpool(store.get_documents, job["job_id"], ("queued", "running"))
+        logger.info(f"Resuming analysis job {job['job_id']} with {len(documents)} documents left")
+        _start_job(job["job_id"], job["language"], documents)
+
+
+async def shutdown_jobs():
+    """Stop running jobs; their unfinished documents stay queued or running in the store for resume_jobs"""
+    tasks = list(_job_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _save_upload(upload: SpooledUpload, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with upload.open() as source, open(path, "wb") as target:
+        shutil.copyfileobj(source, target)
+
+
+@router.post("/")
+async def submit_job(files: List[UploadFile] = File(...), language: str = Form("English")):
+    """Queue documents for the full analysis pipeline and return a job id to poll"""
+    if len(files) > JOBS_MAX_DOCUMENTS:
+        raise HTTPException(status_code=413, detail=f"Job exceeds {JOBS_MAX_DOCUMENTS} documents")
+
+    job_id = uuid.uuid4().hex
+    documents = []
+    try:
+        for position, file in enumerate(files):
+            extension = os.path.splitext(file.filename or "")[1].lower()
+            document = {"position": position, "filename": file.filename, "path": None, "status": "queued"}
+            if extension not in SUPPORTED_EXTENSIONS:
+                document.update(status="error", error=f"Unsupported file format: {extension}")
+            else:
+                upload = await spool_upload(file)
+                document["path"] = os.path.join(JOBS_DIR, job_id, f"{position}{extension}")
+                try:
+                    await run_in_threadpool(_save_upload, upload, document["path"])
+                finally:
+                    await run_in_threadpool(upload.close)
+            documents.append(document)
+        await run_in_threadpool(store.create_job, job_id, language, documents)
+    except BaseException:
+        await run_in_threadpool(shutil.rmtree, os.path.join(JOBS_DIR, job_id), True)
+        raise
+
+    _start_job(job_id, language, [document for document in documents if document["status"] == "queued"])
+    return {"job_id": job_id, "status": "queued", "total": len(documents)}
+
+
+@router.get("/")
+async def list_jobs(limit: int = 50):
+    """Most recent jobs with their progress counters"""
+    return await run_in_threadpool(store.list_jobs, limit)
+
+
+async def _get_job_or_404(job_id: str) -> Dict[str, Any]:
+    job = await run_in_threadpool(store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown analysis job: {job_id}")
+    return job
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Job progress with the stage status of every document"""
+    job = await _get_job_or_404(job_id)
+    documents = await run_in_threadpool(store.get_documents, job_id)
+    job["pending"] = sum(1 for document in documents if document["status"] not in TERMINAL_STATUSES)
+    job["documents"] = [
+        {key: value for key, value in document.items() if key not in ("results", "path")} for document in documents
+    ]
+    return job
+
+
+@router.get("/{job_id}/results")
+async def get_job_results(job_id: str, include_text: bool = False):
+    """Stage results produced so far, including those of documents still being analysed"""
+    await _get_job_or_404(job_id)
+    documents = await run_in_threadpool(store.get_documents, job_id)
+    response = []
+    for document in documents:
+        results = document["results"]
+        if not include_text and "extract" in results:
+            results["extract"] = {key: value for key, value in results["extract"].items() if key != "text"}
+        response.append({"position": document["position"], "filename": document["filename"],
+                         "status": document["status"], "results": results})
+    return response
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Stop a job; finished documents keep their results"""
+    await _get_job_or_404(job_id)
+    if not await run_in_threadpool(store.cancel_job, job_id):
+        raise HTTPException(status_code=409, detail="Job has already finished")
+    task = _job_tasks.get(job_id)
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    await run_in_threadpool(shutil.rmtree, os.path.join(JOBS_DIR, job_id), True)
+    return {"job_id": job_id, "status": "cancelled"}
@@ -0,0 +1,345 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from cache import TieredCache
+from llm_scheduler import LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/llm", tags=["LLM"])
+
+# Required; checked at startup by check_api_key. Any value works against benchmarks/llm_stub.py
+PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
+# Point this at a local stub server to run without the real API
+PERPLEXITY_API_URL = os.getenv("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions")
+LLM_MODEL = os.getenv("LLM_MODEL", "sonar-pro")
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 120))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", 10))
+# Pooled keep-alive connections to the upstream API
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 10))
+# Upstream requests allowed in flight at once across all routers
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+# Token-bucket rate limit on upstream requests (0 disables); halved on 429s down to the minimum
+LLM_RATE_LIMIT_RPS = float(os.getenv("LLM_RATE_LIMIT_RPS", 5))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", 10))
+LLM_MIN_RATE_RPS = float(os.getenv("LLM_MIN_RATE_RPS", 0.5))
+# Retries of 429/5xx and connection errors, with full-jitter exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 1))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 30))
+# Time a completion may spend queued and retrying before it fails (0 = no deadline)
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", 300))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Completions are cached by model and whitespace-normalized prompt
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 24 * 60 * 60))
+LLM_CACHE_MEMORY_MB = int(os.getenv("LLM_CACHE_MEMORY_MB", 32))
+LLM_CACHE_DISK_MB = int(os.getenv("LLM_CACHE_DISK_MB", 256))
+
+llm_cache = TieredCache(
+    "llm",
+    memory_max_bytes=LLM_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_max_bytes=LLM_CACHE_DISK_MB * 1024 * 1024,
+    ttl_seconds=LLM_CACHE_TTL_SECONDS
+)
+
+_client: Optional[httpx.AsyncClient] = None
+scheduler = LLMScheduler(LLM_MAX_CONCURRENCY, LLM_RATE_LIMIT_RPS, LLM_RATE_BURST, LLM_MIN_RATE_RPS)
+
+
+def check_api_key():
+    """Refuse to run without an API key rather than fail on the first completion"""
+    if not PERPLEXITY_API_KEY:
+        raise RuntimeError("PERPLEXITY_API_KEY is not set")
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it on first use"""
+    global _client
+    if _client is None:
+        check_api_key()
+        _client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {PERPLEXITY_API_KEY}", "Content-Type": "application/json"},
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+    return _client
+
+
+async def close_client():
+    """Close pooled connections (called on application shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def build_payload(prompt: str, model: str = LLM_MODEL) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+
+def prompt_key(prompt: str, model: str = LLM_MODEL) -> str:
+    """Cache key for a completion: model plus the prompt with whitespace runs collapsed"""
+    normalized = re.sub(r"\s+", " ", prompt).strip()
+    return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+async def forget_completion(prompt: str, model: str = LLM_MODEL):
+    """Drop a cached completion, e.g. after the caller found it unusable"""
+    if LLM_CACHE_ENABLED:
+        await run_in_threadpool(llm_cache.discard, prompt_key(prompt, model))
+
+
+class _Flight:
+    """One upstream completion shared by every caller waiting on the same prompt key"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+_inflight: Dict[str, _Flight] = {}
+_flight_stats = {"leaders": 0, "coalesced": 0, "cancelled": 0}
+# How often a waiting handler checks whether its client has gone away
+LLM_DISCONNECT_POLL_SECONDS = float(os.getenv("LLM_DISCONNECT_POLL_SECONDS", 1.0))
+
+
+def _deadline(timeout: Optional[float]) -> Optional[float]:
+    timeout = LLM_DEADLINE_SECONDS if timeout is None else timeout
+    return time.monotonic() + timeout if timeout > 0 else None
+
+
+async def _fetch_and_cache(key: str, prompt: str, model: str, priority: int, deadline: Optional[float]) -> str:
+    message_content = await _request_completion(prompt, model, priority, deadline)
+    if LLM_CACHE_ENABLED:
+        await run_in_threadpool(llm_cache.set, key, message_content)
+    return message_content
+
+
+async def _wait_for_flight(flight: _Flight, request: Optional[Request]) -> str:
+    shared = asyncio.shield(flight.task)
+    if request is None:
+        return await shared
+    while True:
+        done, _ = await asyncio.wait({shared}, timeout=LLM_DISCONNECT_POLL_SECONDS)
+        if done:
+            return shared.result()
+        if await request.is_disconnected():
+            raise HTTPException(status_code=499, detail="Client closed request")
+
+
+async def chat_completion(prompt: str, model: str = LLM_MODEL, request: Optional[Request] = None,
+                          priority: int = PRIORITY_NORMAL, timeout: Optional[float] = None) -> str:
+    """Send a single-message chat completion and return the message content.
+
+    Successful completions are served from llm_cache for LLM_CACHE_TTL_SECONDS.
+    Concurrent calls with the same prompt key share one upstream request; it is
+    cancelled only when every waiting caller has gone away. Passing the
+    incoming ``request`` lets a caller stop waiting when its client disconnects.
+    The upstream request is queued in ``scheduler`` at ``priority`` and retried
+    on 429/5xx until ``timeout`` seconds (default LLM_DEADLINE_SECONDS) pass.
+    Raises HTTPException with the upstream status code on API errors, 504 when
+    the deadline passes in the queue, and 500 when the completion has no content.
+    """
+    key = prompt_key(prompt, model)
+    if LLM_CACHE_ENABLED:
+        cached = await run_in_threadpool(llm_cache.get, key)
+        if cached is not None:
+            logger.debug(f"LLM cache hit for {key}")
+            return cached
+
+    flight = _inflight.get(key)
+    if flight is None:
+        flight = _Flight(asyncio.create_task(_fetch_and_cache(key, prompt, model, priority, _deadline(timeout))))
+        _inflight[key] = flight
+        flight.task.add_done_callback(lambda _: _inflight.pop(key, None) if _inflight.get(key) is flight else None)
+        _flight_stats["leaders"] += 1
+    else:
+        _flight_stats["coalesced"] += 1
+        logger.debug(f"Joining in-flight LLM request {key}")
+
+    flight.waiters += 1
+    try:
+        return await _wait_for_flight(flight, request)
+    finally:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            # Unregister it now rather than in the done callback, so a caller arriving before that runs
+            # starts a new request instead of joining the cancelled one
+            if _inflight.get(key) is flight:
+                del _inflight[key]
+            flight.task.cancel()
+            _flight_stats["cancelled"] += 1
+            logger.info(f"Cancelled LLM request {key}: no callers left waiting")
+
+
+def _upstream_error(status_code: int, body: str, headers: httpx.Headers) -> Tuple[HTTPException, Optional[float]]:
+    """The error for a failed upstream response and its Retry-After delay; raises at once if it is not retryable"""
+    error = HTTPException(status_code=status_code, detail=f"Perplexity API error: {body}")
+    if status_code not in RETRYABLE_STATUS_CODES:
+        logger.error(f"Perplexity API error: {body}")
+        raise error
+    if status_code == 429:
+        scheduler.throttled()
+    try:
+        retry_after = min(float(headers.get("retry-after", "")), LLM_BACKOFF_MAX_SECONDS)
+    except ValueError:
+        retry_after = None
+    return error, retry_after
+
+
+async def _backoff(attempt: int, error: HTTPException, retry_after: Optional[float], deadline: Optional[float]):
+    """Sleep before the next attempt, or raise error if retries or the deadline are used up"""
+    if attempt >= LLM_MAX_RETRIES:
+        logger.error(f"Giving up after {attempt + 1} attempts: {error.detail}")
+        raise error
+    delay = retry_after if retry_after is not None else random.uniform(
+        0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt)
+    )
+    if deadline is not None and time.monotonic() + delay > deadline:
+        scheduler.counters["deadline_exceeded"] += 1
+        logger.error(f"Deadline leaves no time to retry: {error.detail}")
+        raise error
+    scheduler.counters["retries"] += 1
+    logger.warning(f"Retrying upstream request in {delay:.2f}s (attempt {attempt + 2}): {error.detail}")
+    await asyncio.sleep(delay)
+
+
+async def _request_completion(prompt: str, model: str, priority: int = PRIORITY_NORMAL,
+                              deadline: Optional[float] = None) -> str:
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        async with scheduler.slot(priority, deadline):
+            try:
+                response = await get_client().post(PERPLEXITY_API_URL, json=build_payload(prompt, model))
+            except httpx.TransportError as e:
+                response = None
+                error, retry_after = HTTPException(status_code=502, detail=f"Perplexity API unreachable: {str(e)}"), None
+        if response is not None:
+            if response.status_code == 200:
+                scheduler.succeeded()
+                break
+            error, retry_after = _upstream_error(response.status_code, response.text, response.headers)
+        await _backoff(attempt, error, retry_after, deadline)
+
+    try:
+        response_json = response.json()
+    except ValueError:
+        raise HTTPException(status_code=500, detail=f"Invalid JSON body from Perplexity API: {response.text[:500]}")
+    logger.debug(f"Perplexity API response: {response_json}")
+
+    message_content = response_json.get("choices", [{}])[0].get("message", {}).get("content", "")
+    if not message_content:
+        raise HTTPException(status_code=500, detail="Empty response from Perplexity API")
+    return message_content
+
+
+def _stream_delta(chunk: Dict[str, Any], received: str) -> str:
+    """New text in one streamed chunk: ``delta.content``, or the unseen tail of a cumulative ``message.content``"""
+    choice = (chunk.get("choices") or [{}])[0]
+    delta = (choice.get("delta") or {}).get("content")
+    if delta:
+        return delta
+    message = (choice.get("message") or {}).get("content") or ""
+    return message[len(received):] if message.startswith(received) else ""
+
+
+async def stream_chat_completion(prompt: str, model: str = LLM_MODEL, priority: int = PRIORITY_INTERACTIVE,
+                                 timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """Yield the completion text piece by piece as the upstream API produces it.
+
+    A cached completion is yielded as a single piece. The full text is cached
+    once the stream finishes. Streams are not coalesced with other callers and
+    are only retried before their first piece. Raises HTTPException like
+    chat_completion.
+    """
+    key = prompt_key(prompt, model)
+    if LLM_CACHE_ENABLED:
+        cached = await run_in_threadpool(llm_cache.get, key)
+        if cached is not None:
+            logger.debug(f"LLM cache hit for {key}")
+            yield cached
+            return
+
+    received = ""
+    payload = {**build_payload(prompt, model), "stream": True}
+    deadline = _deadline(timeout)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        async with scheduler.slot(priority, deadline):
+            try:
+                async with get_client().stream("POST", PERPLEXITY_API_URL, json=payload) as response:
+                    if response.status_code == 200:
+                        scheduler.succeeded()
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            try:
+                                chunk = json.loads(data)
+                            except ValueError:
+                                raise HTTPException(status_code=500, detail=f"Invalid stream chunk from Perplexity API: {data[:500]}")
+                            delta = _stream_delta(chunk, received)
+                            if delta:
+                                received += delta
+                                yield delta
+                        break
+                    body = (await response.aread()).decode("utf-8", errors="replace")
+                    error, retry_after = _upstream_error(response.status_code, body, response.headers)
+            except httpx.TransportError as e:
+                if received:
+                    raise HTTPException(status_code=502, detail=f"Perplexity API stream broke off: {str(e)}")
+                error, retry_after = HTTPException(status_code=502, detail=f"Perplexity API unreachable: {str(e)}"), None
+        await _backoff(attempt, error, retry_after, deadline)
+
+    if not received:
+        raise HTTPException(status_code=500, detail="Empty response from Perplexity API")
+    if LLM_CACHE_ENABLED:
+        await run_in_threadpool(llm_cache.set, key, received)
+
+
+@router.get("/cache-stats")
+async def get_llm_cache_stats():
+    """Hit/miss counts and sizes of the LLM response cache"""
+    return llm_cache.stats()
+
+
+@router.delete("/cache")
+async def clear_llm_cache():
+    """Drop every cached LLM response"""
+    await run_in_threadpool(llm_cache.clear)
+    return {"message": "LLM response cache cleared"}
+
+
+@router.get("/inflight-stats")
+async def get_llm_inflight_stats():
+    """Single-flight counters: upstream calls started, callers coalesced onto them, calls cancelled"""
+    return {**_flight_stats, "inflight": len(_inflight)}
+
+
+@router.get("/scheduler-stats")
+async def get_llm_scheduler_stats():
+    """Upstream queue depth, wait-time percentiles, effective rate limit and retry counters"""
+    return scheduler.stats()
@@ -0,0 +1,148 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Lower values are dispatched first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NORMAL: "normal", PRIORITY_BULK: "bulk"}
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LLMScheduler:
+    """Admits upstream LLM requests by priority under a concurrency cap and a token-bucket rate limit.
+
+    Callers wait in a priority queue (FIFO within a priority) until a slot is
+    free and the bucket has a token. ``rate`` is requests per second with
+    bursts of up to ``burst``; 0 disables rate limiting. The effective rate
+    adapts: it is halved (down to ``min_rate``) whenever the upstream throttles,
+    and creeps back up with every success.
+    """
+
+    def __init__(self, max_concurrency: int, rate: float, burst: int, min_rate: float):
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._queue: List[Tuple[int, int, asyncio.Future, float]] = []
+        self._sequence = itertools.count()
+        self._depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self._in_flight = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._waits: "deque[float]" = deque(maxlen=1000)
+        self.max_queue_depth = 0
+        self.counters = {"dispatched": 0, "retries": 0, "throttled": 0, "deadline_exceeded": 0}
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _has_token(self) -> bool:
+        return self.rate <= 0 or self._tokens >= 1
+
+    def _dispatch(self):
+        """Hand free slots to the highest-priority waiters, or arm a timer for the next token"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._queue and self._in_flight < self.max_concurrency and self._has_token():
+            _, _, future, enqueued_at = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            if self.rate > 0:
+                self._tokens -= 1
+            self._in_flight += 1
+            self._waits.append(time.monotonic() - enqueued_at)
+            self.counters["dispatched"] += 1
+            future.set_result(None)
+        if self._queue and self._in_flight < self.max_concurrency and self._timer is None:
+            delay = (1 - self._tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL, deadline: Optional[float] = None):
+        """Wait for a slot; raises HTTPException(504) if ``deadline`` (monotonic time) passes first"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), future, time.monotonic()))
+        self._depth[priority] = self._depth.get(priority, 0) + 1
+        self.max_queue_depth = max(self.max_queue_depth, sum(self._depth.values()))
+        self._dispatch()
+        try:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Dispatched just as the caller gave up
+                self.release()
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                self.counters["deadline_exceeded"] += 1
+                raise HTTPException(status_code=504, detail="LLM request deadline passed while queued")
+            raise
+        finally:
+            self._depth[priority] -= 1
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NORMAL, deadline: Optional[float] = None):
+        await self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def throttled(self):
+        """The upstream answered 429: halve the effective rate"""
+        self.counters["throttled"] += 1
+        if self.rate_limit > 0:
+            self.rate = max(self.min_rate, self.rate / 2)
+            logger.warning(f"Upstream throttled, LLM rate lowered to {self.rate:.2f}/s")
+
+    def succeeded(self):
+        if self.rate_limit > 0 and self.rate < self.rate_limit:
+            self.rate = min(self.rate_limit, self.rate + self.rate_limit * 0.05)
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        waits = [wait * 1000 for wait in self._waits]
+        return {
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": sum(self._depth.values()),
+            "queue_depth_by_priority": {PRIORITY_NAMES.get(p, str(p)): n for p, n in self._depth.items()},
+            "max_queue_depth": self.max_queue_depth,
+            "rate_limit_rps": self.rate_limit,
+            "effective_rate_rps": round(self.rate, 3),
+            "tokens": round(self._tokens, 2) if self.rate > 0 else None,
+            "wait_ms": {
+                "p50": round(_percentile(waits, 0.50), 1),
+                "p95": round(_percentile(waits, 0.95), 1),
+                "p99": round(_percentile(waits, 0.99), 1),
+                "max": round(max(waits), 1) if waits else 0.0
+            },
+            **self.counters
+        }
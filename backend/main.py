@@ -1,18 +1,36 @@
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from domain_identification import router as domain_router
 from insights_generation import router as insights_router
 from suggestions_generation import router as suggestions_router
-from vector_database import router as vector_db_router
-from ocr_extraction import router as ocr_router  # ✅ Add this
+from vector_database import router as vector_db_router, shutdown_vector_db
+from ocr_extraction import router as ocr_router, shutdown_ocr_pool  # ✅ Add this
 from goal import router as goal_router
+from batch_extraction import router as batch_router, shutdown_batches
+from llm_client import router as llm_router, check_api_key, close_client
+from pipeline import router as pipeline_router
+from jobs import router as jobs_router, resume_jobs, shutdown_jobs
 
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_api_key()
+    await resume_jobs()
+    yield
+    await shutdown_jobs()
+    await shutdown_batches()
+    shutdown_ocr_pool()
+    shutdown_vector_db()
+    await close_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,11 +42,15 @@ app.add_middleware(
 
 # Register routers
 app.include_router(ocr_router)
+app.include_router(batch_router)
 app.include_router(domain_router)
 app.include_router(insights_router)
 app.include_router(suggestions_router)
 app.include_router(vector_db_router)
 app.include_router(goal_router)
+app.include_router(llm_router)
+app.include_router(pipeline_router)
+app.include_router(jobs_router)
 
 if __name__ == "__main__":
     import uvicorn
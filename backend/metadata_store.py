@@ -0,0 +1,82 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_type ON items (type);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class MetadataStore:
+    """SQLite store of vector metadata keyed by vector id, so only the rows for search hits are loaded.
+
+    Metadata is kept as JSON rather than pickle. Writes share one connection; reads use a connection
+    per thread, so searches don't queue behind each other or behind a commit. Methods are blocking;
+    call them from a thread.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._readers = threading.local()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = sqlite3.connect(self.path)
+        return conn
+
+    def add(self, first_id: int, items: List[Dict[str, Any]], replace: bool = True):
+        """Store items under ids first_id, first_id + 1, ...; with replace=False rows that already exist are
+        kept, so replaying a log over rows it already wrote is idempotent"""
+        rows = [(first_id + i, item.get("type", "unknown"), json.dumps(item, default=str)) for i, item in enumerate(items)]
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self._lock, self._conn:
+            self._conn.executemany(f"{verb} INTO items (id, type, metadata) VALUES (?, ?, ?)", rows)
+
+    def get_many(self, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        rows = self._reader().execute(f"SELECT id, metadata FROM items WHERE id IN ({placeholders})", ids).fetchall()
+        return {row_id: json.loads(metadata) for row_id, metadata in rows}
+
+    def count(self) -> int:
+        return self._reader().execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def type_counts(self) -> Dict[str, int]:
+        return dict(self._reader().execute("SELECT type, COUNT(*) FROM items GROUP BY type").fetchall())
+
+    def truncate(self, count: int):
+        """Drop rows with id >= count (metadata written for vectors that never reached the index)"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM items WHERE id >= ?", (count,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM items")
+
+    def get_state(self, key: str) -> Optional[str]:
+        row = self._reader().execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
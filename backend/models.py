@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 class TextInput(BaseModel):
     text: str
@@ -22,4 +22,7 @@ class VectorStoreInput(BaseModel):
 class QueryInput(BaseModel):
     query: str
     k: int = 5
-    distance_threshold: float = 2.0
\ No newline at end of file
+    distance_threshold: float = 2.0
+    # Search-time knobs for approximate indexes: IVF lists probed and HNSW beam width (server defaults if unset)
+    nprobe: Optional[int] = Field(None, ge=1)
+    ef_search: Optional[int] = Field(None, ge=1)
\ No newline at end of file
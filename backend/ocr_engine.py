@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:  # not installed on Windows, pytesseract is used instead
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+# ✅ Set Tesseract executable path (elsewhere it is looked up on PATH)
+if os.name == "nt":
+    pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+
+# "tesserocr" keeps Tesseract loaded in-process, "pytesseract" spawns the CLI per
+# image, "auto" uses tesserocr when it is installed and works. tesserocr is in
+# requirements.txt except on Windows, where "auto" keeps the per-image CLI.
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")
+OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "eng")
+# Directory holding *.traineddata for tesserocr; None uses its compiled-in default
+OCR_TESSDATA_PATH = os.getenv("OCR_TESSDATA_PATH")
+
+
+class OcrEngine(ABC):
+    """Turns a PIL image into text"""
+
+    name = "base"
+
+    @abstractmethod
+    def image_to_string(self, image: Image.Image) -> str:
+        ...
+
+
+class PytesseractEngine(OcrEngine):
+    """Runs the tesseract executable once per image (the original behaviour)"""
+
+    name = "pytesseract"
+
+    def image_to_string(self, image: Image.Image) -> str:
+        return pytesseract.image_to_string(image, lang=OCR_LANGUAGE)
+
+
+class TesserocrEngine(OcrEngine):
+    """Keeps one Tesseract API instance alive so language data is loaded only once"""
+
+    name = "tesserocr"
+
+    def __init__(self):
+        kwargs = {"lang": OCR_LANGUAGE}
+        if OCR_TESSDATA_PATH:
+            kwargs["path"] = OCR_TESSDATA_PATH
+        self._api = tesserocr.PyTessBaseAPI(**kwargs)
+        self._lock = threading.Lock()
+
+    def image_to_string(self, image: Image.Image) -> str:
+        with self._lock:
+            self._api.SetImage(image)
+            return self._api.GetUTF8Text()
+
+
+def create_engine(name: str = OCR_ENGINE) -> OcrEngine:
+    """Build the configured engine, falling back to pytesseract in auto mode"""
+    if name == "pytesseract":
+        return PytesseractEngine()
+    if name == "tesserocr":
+        if tesserocr is None:
+            raise RuntimeError("OCR_ENGINE=tesserocr but the tesserocr package is not installed")
+        return TesserocrEngine()
+    if name != "auto":
+        raise ValueError(f"Unknown OCR engine: {name}")
+    if tesserocr is not None:
+        try:
+            return TesserocrEngine()
+        except Exception as e:
+            logger.warning(f"tesserocr unavailable, falling back to pytesseract: {str(e)}")
+    return PytesseractEngine()
+
+
+_engine: Optional[OcrEngine] = None
+
+
+def get_engine() -> OcrEngine:
+    """Return this process's OCR engine, creating it on first use"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine()
+        logger.info(f"OCR engine {_engine.name} ready in process {os.getpid()}")
+    return _engine
+
+
+def engine_name() -> str:
+    """Name of this process's engine; submitted to the OCR pool to learn what the workers run"""
+    return get_engine().name
+
+
+def init_worker():
+    """Process pool initializer: load the engine before the first image arrives"""
+    get_engine()
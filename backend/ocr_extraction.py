@@ -1,71 +1,355 @@
-import fitz  # PyMuPDF
-import pytesseract
+import asyncio
+import hashlib
+import json
+import logging
 from PIL import Image
 import io
 import os
-from fastapi import APIRouter, UploadFile, File
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from fastapi import APIRouter, HTTPException, UploadFile, File
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from docx import Document
+from cache import TieredCache
+from uploads import SpooledUpload, UploadStreamingResponse, spool_upload
+from ocr_engine import OCR_ENGINE, OCR_LANGUAGE, OCR_TESSDATA_PATH, engine_name, get_engine, init_worker
+from image_preprocessing import preprocess, settings_fingerprint
 
-# ✅ Set Tesseract executable path
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+logger = logging.getLogger(__name__)
+
+# Number of long-lived OCR worker processes; each keeps its own engine loaded
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", os.cpu_count() or 1))
+# Embedded images smaller than this (in pixels) or more elongated than the
+# aspect ratio limit are treated as decoration and not OCRed
+OCR_MIN_IMAGE_SIDE = int(os.getenv("OCR_MIN_IMAGE_SIDE", 32))
+OCR_MIN_IMAGE_AREA = int(os.getenv("OCR_MIN_IMAGE_AREA", 10000))
+OCR_MAX_ASPECT_RATIO = float(os.getenv("OCR_MAX_ASPECT_RATIO", 20))
+# Maximum number of pages queued for OCR ahead of the page currently returned
+OCR_PAGE_LOOKAHEAD = int(os.getenv("OCR_PAGE_LOOKAHEAD", 2 * OCR_MAX_WORKERS))
+
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".tif", ".tiff"]
+WORD_EXTENSIONS = [".doc", ".docx"]
+SUPPORTED_EXTENSIONS = [".pdf"] + IMAGE_EXTENSIONS + WORD_EXTENSIONS
+
+# Extraction results are cached by content hash so repeat uploads skip OCR
+EXTRACTION_CACHE_MEMORY_MB = int(os.getenv("EXTRACTION_CACHE_MEMORY_MB", 64))
+EXTRACTION_CACHE_DISK_MB = int(os.getenv("EXTRACTION_CACHE_DISK_MB", 1024))
 
 router = APIRouter(prefix="/ocr", tags=["OCR"])
 
+extraction_cache = TieredCache(
+    "extraction",
+    memory_max_bytes=EXTRACTION_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_max_bytes=EXTRACTION_CACHE_DISK_MB * 1024 * 1024
+)
+
+_ocr_pool: Optional[ProcessPoolExecutor] = None
+# Name of the engine the workers loaded, asked for as the pool's first task
+_ocr_engine_name: Optional[Future] = None
+
+
+def get_ocr_pool() -> ProcessPoolExecutor:
+    """Return the shared OCR process pool, creating it on first use"""
+    global _ocr_pool, _ocr_engine_name
+    if _ocr_pool is None:
+        _ocr_pool = ProcessPoolExecutor(max_workers=OCR_MAX_WORKERS, initializer=init_worker)
+        _ocr_engine_name = _ocr_pool.submit(engine_name)
+    return _ocr_pool
+
+
+def shutdown_ocr_pool():
+    """Stop the OCR worker processes (called on application shutdown)"""
+    global _ocr_pool, _ocr_engine_name
+    if _ocr_pool is not None:
+        _ocr_pool.shutdown(cancel_futures=True)
+        _ocr_pool = None
+        _ocr_engine_name = None
+
+
+def active_engine() -> Optional[str]:
+    """Engine the OCR workers run, or None until the pool has started and reported it"""
+    future = _ocr_engine_name
+    if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+        return None
+    return future.result()
+
+
+def _ocr_image(source: Union[str, bytes]) -> Tuple[str, Dict[str, float]]:
+    """Preprocess and OCR an image file path or encoded image bytes (executed in a worker process).
+
+    Returns the text and the time spent in each stage, in milliseconds.
+    """
+    img_obj = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+    img_obj, timings = preprocess(img_obj)
+    start = time.perf_counter()
+    text = get_engine().image_to_string(img_obj)
+    timings["ocr"] = (time.perf_counter() - start) * 1000
+    return text, timings
+
+
+def _add_timings(total: Optional[Dict[str, float]], timings: Dict[str, float]):
+    if total is None:
+        return
+    for stage, ms in timings.items():
+        total[stage] = total.get(stage, 0.0) + ms
+
+
+def _is_ocr_candidate(img: tuple) -> bool:
+    """Skip tiny or strip-shaped images (bullets, rules, logos) that carry no readable text"""
+    width, height = img[2], img[3]
+    if min(width, height) < OCR_MIN_IMAGE_SIDE or width * height < OCR_MIN_IMAGE_AREA:
+        return False
+    return max(width, height) / min(width, height) <= OCR_MAX_ASPECT_RATIO
+
+
+def _prepare_pdf_page(doc, page_num: int, pool: ProcessPoolExecutor,
+                      ocr_by_xref: Dict[int, Future]) -> Union[str, List[Future]]:
+    """Read a page's text layer, or submit its images to the OCR pool if it has none.
+
+    Images are OCRed once per document: an xref already seen on an earlier page
+    (letterheads, logos, watermarks) reuses the future from its first occurrence.
+    """
+    page = doc[page_num]
+    page_text = page.get_text()
+    if page_text.strip():
+        return page_text + "\n"
+    futures = []
+    for img in page.get_images(full=True):
+        xref = img[0]
+        if xref not in ocr_by_xref:
+            if not _is_ocr_candidate(img):
+                continue
+            ocr_by_xref[xref] = pool.submit(_ocr_image, doc.extract_image(xref)["image"])
+        futures.append(ocr_by_xref[xref])
+    return futures
+
+
+async def _collect_page_text(page_num: int, futures: List[Future]) -> str:
+    parts = []
+    for future in futures:
+        try:
+            text, _ = await asyncio.wrap_future(future)
+            parts.append(text + "\n")
+        except Exception as img_e:
+            print(f"Image OCR error on page {page_num}: {img_e}")
+    return "".join(parts)
+
+
+async def iter_pdf_pages(upload: SpooledUpload,
+                         timings: Optional[Dict[str, float]] = None) -> AsyncIterator[Tuple[int, str]]:
+    """Yield (page_num, text) for every page of a PDF, in page order.
+
+    Up to OCR_PAGE_LOOKAHEAD pages are queued on the OCR pool ahead of the page
+    being yielded, so scanned pages are OCRed in parallel while only a bounded
+    window of page images is held in memory. Per-stage OCR timings are summed
+    into ``timings`` when it is given.
+    """
+    pool = get_ocr_pool()
+    doc = await run_in_threadpool(upload.open_pdf)
+    ocr_by_xref: Dict[int, Future] = {}
+    pending = deque()
+    image_refs = 0
+    try:
+        next_page = 0
+        while next_page < doc.page_count or pending:
+            while next_page < doc.page_count and len(pending) < OCR_PAGE_LOOKAHEAD:
+                page = await run_in_threadpool(_prepare_pdf_page, doc, next_page, pool, ocr_by_xref)
+                pending.append((next_page, page))
+                next_page += 1
+            page_num, page = pending.popleft()
+            if isinstance(page, list):
+                image_refs += len(page)
+                page = await _collect_page_text(page_num, page)
+            yield page_num, page
+        for future in ocr_by_xref.values():
+            # exception() raises CancelledError on a cancelled future and blocks on an unfinished one
+            if future.done() and not future.cancelled() and future.exception() is None:
+                _add_timings(timings, future.result()[1])
+        logger.debug(f"OCR ran on {len(ocr_by_xref)} unique images for {image_refs} image references")
+    finally:
+        for _, page in pending:
+            if isinstance(page, list):
+                for future in page:
+                    future.cancel()
+        doc.close()
+
+
+def _extract_docx_text(upload: SpooledUpload) -> str:
+    """Extract paragraph and table text from a Word document"""
+    with upload.open() as f:
+        doc = Document(f)
+    parts = []
+    for paragraph in doc.paragraphs:
+        if paragraph.text.strip():
+            parts.append(paragraph.text + "\n")
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                if cell.text.strip():
+                    parts.append(cell.text + "\n")
+    return "".join(parts)
+
+
+def _join_pages(file_extension: str, pages: List[str]) -> str:
+    """Build the extract-text response body, adding End of Page markers for PDFs"""
+    if file_extension != ".pdf":
+        return "".join(pages)
+    parts = []
+    for page_num, page_text in enumerate(pages):
+        parts.append(page_text)
+        parts.append(f"\n--- End of Page {page_num + 1} ---\n")
+    return "".join(parts)
+
+
+def extraction_fingerprint() -> str:
+    """Short digest of every setting that changes extracted text: preprocessing, the OCR engine
+    and language, and which embedded images are OCRed"""
+    settings = (settings_fingerprint(), OCR_ENGINE, OCR_LANGUAGE, OCR_TESSDATA_PATH,
+                OCR_MIN_IMAGE_SIDE, OCR_MIN_IMAGE_AREA, OCR_MAX_ASPECT_RATIO)
+    return hashlib.sha256(repr(settings).encode("utf-8")).hexdigest()[:8]
+
+
+def _cache_key(upload: SpooledUpload, file_extension: str) -> str:
+    """Content address of an upload: SHA-256 of its bytes, the extraction settings
+    and the parser used"""
+    return f"{upload.sha256}-{extraction_fingerprint()}{file_extension.replace('.', '-')}"
+
+
+async def _extract_image_text(upload: SpooledUpload, timings: Optional[Dict[str, float]] = None) -> str:
+    text, image_timings = await asyncio.wrap_future(get_ocr_pool().submit(_ocr_image, upload.source))
+    _add_timings(timings, image_timings)
+    return text
+
+
+async def _single_page(file_extension: str, upload: SpooledUpload,
+                       timings: Optional[Dict[str, float]] = None) -> AsyncIterator[Tuple[int, str]]:
+    """Treat an image or Word document as a one-page result"""
+    if file_extension in IMAGE_EXTENSIONS:
+        yield 0, await _extract_image_text(upload, timings)
+    else:
+        yield 0, await run_in_threadpool(_extract_docx_text, upload)
+
+
+def _extract_pages(file_extension: str, upload: SpooledUpload,
+                   timings: Optional[Dict[str, float]] = None) -> AsyncIterator[Tuple[int, str]]:
+    if file_extension == ".pdf":
+        return iter_pdf_pages(upload, timings)
+    return _single_page(file_extension, upload, timings)
+
+
+async def extract_document(filename: str, upload: SpooledUpload) -> Dict[str, Any]:
+    """Extract the full text of a spooled upload, serving repeats from the extraction cache.
+
+    Raises HTTPException(400) for unsupported formats and unreadable Word files.
+    """
+    file_extension = os.path.splitext(filename)[1].lower()
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported file format: {file_extension}")
+
+    key = _cache_key(upload, file_extension)
+    cached = await run_in_threadpool(extraction_cache.get, key)
+    if cached is not None:
+        pages = cached["pages"]
+    else:
+        timings = {}
+        try:
+            pages = [page_text async for _, page_text in _extract_pages(file_extension, upload, timings)]
+        except Exception as doc_e:
+            if file_extension not in WORD_EXTENSIONS:
+                raise
+            print(f"Word document processing error: {doc_e}")
+            raise HTTPException(status_code=400, detail=f"Failed to process Word document: {str(doc_e)}")
+        logger.debug(f"OCR stage timings for {filename}: {timings}")
+        await run_in_threadpool(extraction_cache.set, key, {"pages": pages})
+
+    return {"filename": filename, "text": _join_pages(file_extension, pages), "cached": cached is not None}
+
 
 @router.post("/extract-text")
 async def extract_text(file: UploadFile = File(...)):
     try:
-        contents = await file.read()
         file_extension = os.path.splitext(file.filename)[1].lower()
-        text = ""
-
-        if file_extension == ".pdf":
-            doc = fitz.open(stream=contents, filetype="pdf")
-            for page_num in range(doc.page_count):
-                page = doc[page_num]
-                page_text = page.get_text()
-                if page_text.strip():
-                    text += page_text + "\n"
-                else:
-                    img_list = page.get_images(full=True)
-                    for img_index, img in enumerate(img_list):
-                        xref = img[0]
-                        base_image = doc.extract_image(xref)
-                        image_bytes = base_image["image"]
-                        try:
-                            img_obj = Image.open(io.BytesIO(image_bytes))
-                            img_text = pytesseract.image_to_string(img_obj)
-                            text += img_text + "\n"
-                        except Exception as img_e:
-                            print(f"Image OCR error on page {page_num}: {img_e}")
-                text += f"\n--- End of Page {page_num + 1} ---\n"
-            doc.close()
-
-        elif file_extension in [".png", ".jpg", ".jpeg", ".tif", ".tiff"]:
-            img = Image.open(io.BytesIO(contents))
-            text = pytesseract.image_to_string(img)
-
-        elif file_extension in [".doc", ".docx"]:
-            try:
-                doc = Document(io.BytesIO(contents))
-                for paragraph in doc.paragraphs:
-                    if paragraph.text.strip():
-                        text += paragraph.text + "\n"
-                for table in doc.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            if cell.text.strip():
-                                text += cell.text + "\n"
-            except Exception as doc_e:
-                print(f"Word document processing error: {doc_e}")
-                return JSONResponse(content={"error": f"Failed to process Word document: {str(doc_e)}"}, status_code=400)
-
-        else:
+        if file_extension not in SUPPORTED_EXTENSIONS:
             return JSONResponse(content={"error": f"Unsupported file format: {file_extension}"}, status_code=400)
 
-        return {"filename": file.filename, "text": text}
+        upload = await spool_upload(file)
+        try:
+            return await extract_document(file.filename, upload)
+        finally:
+            await run_in_threadpool(upload.close)
 
+    except HTTPException as he:
+        return JSONResponse(content={"error": he.detail}, status_code=he.status_code)
     except Exception as e:
         print(f"General error: {str(e)}")
-        return JSONResponse(content={"error": str(e)}, status_code=500)
\ No newline at end of file
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+async def _cached_pages(pages: List[str]) -> AsyncIterator[Tuple[int, str]]:
+    for page_num, page_text in enumerate(pages):
+        yield page_num, page_text
+
+
+async def _stream_pages(filename: str, file_extension: str, upload: SpooledUpload) -> AsyncIterator[str]:
+    """Produce NDJSON lines: one per page as it is extracted, then a summary line"""
+    start = time.perf_counter()
+    last = start
+    page_count = 0
+    timings = {}
+    try:
+        key = _cache_key(upload, file_extension)
+        cached = await run_in_threadpool(extraction_cache.get, key)
+        if cached is not None:
+            pages = _cached_pages(cached["pages"])
+        else:
+            pages = _extract_pages(file_extension, upload, timings)
+        collected = []
+        async for page_num, page_text in pages:
+            now = time.perf_counter()
+            page_count += 1
+            collected.append(page_text)
+            yield json.dumps({
+                "page": page_num + 1,
+                "text": page_text,
+                "page_ms": round((now - last) * 1000, 1),
+                "elapsed_ms": round((now - start) * 1000, 1)
+            }) + "\n"
+            last = now
+        if cached is None:
+            await run_in_threadpool(extraction_cache.set, key, {"pages": collected})
+        yield json.dumps({
+            "done": True,
+            "filename": filename,
+            "page_count": page_count,
+            "cached": cached is not None,
+            "ocr_timings_ms": {stage: round(ms, 1) for stage, ms in timings.items()},
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+        }) + "\n"
+    except Exception as e:
+        print(f"Streaming extraction error: {str(e)}")
+        yield json.dumps({"error": str(e), "page_count": page_count}) + "\n"
+    finally:
+        await run_in_threadpool(upload.close)
+
+
+@router.post("/extract-text/stream")
+async def extract_text_stream(file: UploadFile = File(...)):
+    """Stream extracted text as NDJSON, sending each page as soon as it is ready"""
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        return JSONResponse(content={"error": f"Unsupported file format: {file_extension}"}, status_code=400)
+    try:
+        upload = await spool_upload(file)
+    except HTTPException as he:
+        return JSONResponse(content={"error": he.detail}, status_code=he.status_code)
+    return UploadStreamingResponse(_stream_pages(file.filename, file_extension, upload), upload,
+                                   media_type="application/x-ndjson")
+
+
+@router.get("/cache-stats")
+async def get_extraction_cache_stats():
+    """Hit/miss counts and sizes of the extraction cache, and the OCR engine in use"""
+    return {**extraction_cache.stats(), "ocr_engine": OCR_ENGINE, "ocr_engine_active": active_engine()}
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
+from starlette.concurrency import run_in_threadpool
+from models import TextInput, InsightInput, SuggestionInput, VectorStoreInput
+from domain_identification import identify_domain
+from insights_generation import generate_insights
+from suggestions_generation import generate_suggestions
+from ocr_extraction import extract_document
+from uploads import SpooledUpload, UploadStreamingResponse, spool_upload
+from vector_database import build_vector_items, store_vector_items
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/analyze", tags=["Analysis Pipeline"])
+
+
+class StageSkipped(Exception):
+    """Raised by a stage whose dependency failed"""
+
+
+class AnalysisPipeline:
+    """Runs the analysis stages of one document as a dependency graph.
+
+    Every stage starts as soon as the stages it depends on have finished, so
+    independent work (storing the raw text while insights are generated) runs
+    concurrently. Each completed, failed or skipped stage is put on ``events``.
+    Stages whose results are passed in ``completed`` (from an earlier, interrupted
+    run of the same document) are not run again and produce no event.
+    """
+
+    def __init__(self, request: Optional[Request], language: str, text: Optional[str] = None,
+                 upload: Optional[SpooledUpload] = None, filename: Optional[str] = None,
+                 completed: Optional[Dict[str, Any]] = None):
+        self.request = request
+        self.language = language
+        self.text = text
+        self.upload = upload
+        self.filename = filename
+        self.results: Dict[str, Any] = dict(completed or {})
+        if "extract" in self.results:
+            self.text = self.results["extract"]["text"]
+        self.timings: Dict[str, float] = {}
+        self.events: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def stages(self) -> List[Tuple[str, List[str], Callable[[], Awaitable[Any]]]]:
+        return [
+            ("extract", [], self.extract),
+            ("domain", ["extract"], self.domain),
+            ("store_text", ["extract"], self.store_text),
+            ("insights", ["domain"], self.insights),
+            ("suggestions", ["insights"], self.suggestions),
+            ("store_results", ["domain", "insights", "suggestions"], self.store_results),
+        ]
+
+    async def extract(self) -> Dict[str, Any]:
+        if self.upload is None:
+            return {"filename": self.filename, "text": self.text, "cached": False}
+        try:
+            extracted = await extract_document(self.filename, self.upload)
+        finally:
+            await run_in_threadpool(self.upload.close)
+        self.text = extracted["text"]
+        return extracted
+
+    async def domain(self) -> Dict[str, Any]:
+        return await identify_domain(TextInput(text=self.text, language=self.language), self.request)
+
+    async def store_text(self) -> Dict[str, Any]:
+        items = build_vector_items(VectorStoreInput(text=self.text))
+        return await run_in_threadpool(store_vector_items, items)
+
+    async def insights(self) -> Dict[str, Any]:
+        input = InsightInput(domain=self.results["domain"]["domain"], content=self.text, language=self.language)
+        return await generate_insights(input, self.request)
+
+    async def suggestions(self) -> Dict[str, Any]:
+        insights = self.results["insights"]["detailed_insights"]
+        return await generate_suggestions(SuggestionInput(insights=insights), self.request)
+
+    async def store_results(self) -> Dict[str, Any]:
+        input = VectorStoreInput(
+            text=self.text,
+            domain_result=self.results["domain"],
+            insights_result=self.results["insights"],
+            suggestions=self.results["suggestions"]["suggestions"]
+        )
+        items = build_vector_items(input, include_text=False)
+        return await run_in_threadpool(store_vector_items, items)
+
+    async def _run_stage(self, name: str, depends_on: List[str], stage: Callable[[], Awaitable[Any]]) -> Any:
+        for dependency in depends_on:
+            if dependency not in self.tasks:
+                continue
+            try:
+                await self.tasks[dependency]
+            except Exception:
+                await self.events.put({"stage": name, "status": "skipped", "reason": f"{dependency} did not complete"})
+                raise StageSkipped(name)
+
+        start = time.perf_counter()
+        try:
+            result = await stage()
+        except Exception as e:
+            elapsed = round((time.perf_counter() - start) * 1000, 1)
+            self.timings[name] = elapsed
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Pipeline stage {name} failed: {detail}")
+            await self.events.put({"stage": name, "status": "error", "error": detail, "elapsed_ms": elapsed})
+            raise
+        elapsed = round((time.perf_counter() - start) * 1000, 1)
+        self.timings[name] = elapsed
+        self.results[name] = result
+        await self.events.put({"stage": name, "status": "done", "elapsed_ms": elapsed, "result": result})
+        return result
+
+    def start(self):
+        for name, depends_on, stage in self.stages():
+            if name in self.results:
+                continue
+            self.tasks[name] = asyncio.create_task(self._run_stage(name, depends_on, stage))
+
+    async def run(self):
+        """Start every stage and yield each stage event as it happens; unfinished stages are cancelled on exit"""
+        self.start()
+        try:
+            for _ in self.tasks:
+                yield await self.events.get()
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        finally:
+            for task in self.tasks.values():
+                task.cancel()
+            if self.upload is not None:
+                await run_in_threadpool(self.upload.close)
+
+    async def stream(self):
+        """Yield NDJSON lines for each stage as it finishes, then a summary line"""
+        start = time.perf_counter()
+        events = self.run()
+        try:
+            async for event in events:
+                yield json.dumps(event) + "\n"
+        finally:
+            await events.aclose()
+        yield json.dumps({
+            "done": True,
+            "stage_ms": self.timings,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+        }) + "\n"
+
+
+@router.post("/")
+async def analyze(request: Request, file: Optional[UploadFile] = File(None), text: Optional[str] = Form(None),
+                  language: str = Form("English")):
+    """Run extraction, domain identification, insights, suggestions and vector storage in one request.
+
+    Send either a document ``file`` or its ``text``. The response is NDJSON with
+    one line per stage as it completes, followed by per-stage latencies.
+    """
+    if file is None and not (text and text.strip()):
+        raise HTTPException(status_code=400, detail="Provide a file or non-empty text")
+
+    upload = await spool_upload(file) if file is not None else None
+    pipeline = AnalysisPipeline(request, language, text=text, upload=upload,
+                                filename=file.filename if file is not None else None)
+    return UploadStreamingResponse(pipeline.stream(), upload, media_type="application/x-ndjson")
@@ -0,0 +1,115 @@
+import logging
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Set, Tuple
+import numpy as np
+from chunking import CHARS_PER_TOKEN, estimate_tokens
+from vector_database import vector_db
+
+logger = logging.getLogger(__name__)
+
+# A header/footer line is boilerplate when it repeats on at least this many pages and this share of them
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", 3))
+BOILERPLATE_PAGE_FRACTION = float(os.getenv("BOILERPLATE_PAGE_FRACTION", 0.5))
+# Lines at the top and bottom of each page checked for boilerplate
+BOILERPLATE_EDGE_LINES = int(os.getenv("BOILERPLATE_EDGE_LINES", 3))
+# Most sentence units embedded when ranking; longer documents are ranked in groups of sentences
+SALIENCE_MAX_UNITS = int(os.getenv("SALIENCE_MAX_UNITS", 1500))
+
+PAGE_MARKER = re.compile(r"\n?--- End of Page \d+ ---\n?")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def _line_signature(line: str) -> str:
+    """Compare header/footer lines ignoring case, spacing and numbers (page numbers, dates)"""
+    return re.sub(r"\s+", " ", re.sub(r"\d+", "#", line.strip().lower()))
+
+
+def _edge_lines(page: str) -> Set[int]:
+    """Indexes of the first and last BOILERPLATE_EDGE_LINES non-blank lines of a page"""
+    filled = [i for i, line in enumerate(page.splitlines()) if line.strip()]
+    # At most a third of a page's lines come from each end, so body text is never mistaken for a
+    # footer; pages under three lines still offer their first and last line
+    count = min(BOILERPLATE_EDGE_LINES, max(1, len(filled) // 3))
+    return set(filled[:count] + filled[len(filled) - count:])
+
+
+def strip_boilerplate(text: str) -> str:
+    """Drop page markers and header/footer lines repeated across pages; pages are joined by blank lines.
+
+    Only a page's edge lines are candidates, both for counting repeats and for removal, so body
+    sentences or table rows that happen to repeat a header are kept.
+    """
+    pages = [page for page in PAGE_MARKER.split(text) if page.strip()]
+    if len(pages) >= BOILERPLATE_MIN_PAGES:
+        edges = [_edge_lines(page) for page in pages]
+        counts: Counter = Counter()
+        for page, page_edges in zip(pages, edges):
+            lines = page.splitlines()
+            counts.update({_line_signature(lines[i]) for i in page_edges})
+        threshold = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_PAGE_FRACTION * len(pages))
+        repeated = {signature for signature, count in counts.items() if count >= threshold}
+        if repeated:
+            pages = [
+                "\n".join(line for i, line in enumerate(page.splitlines())
+                          if not (i in page_edges and _line_signature(line) in repeated))
+                for page, page_edges in zip(pages, edges)
+            ]
+    return "\n\n".join(pages)
+
+
+def normalize_whitespace(text: str) -> str:
+    text = re.sub(r"[ \t\f\v\u00a0]+", " ", text)
+    text = "\n".join(line.strip() for line in text.splitlines())
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def _report(original: str, compacted: str) -> Dict[str, int]:
+    before, after = estimate_tokens(original), estimate_tokens(compacted)
+    return {"tokens_before": before, "tokens_after": after, "tokens_removed": before - after}
+
+
+def compact_document(text: str) -> Tuple[str, Dict[str, int]]:
+    """Strip boilerplate and excess whitespace; returns the text and a token report"""
+    compacted = normalize_whitespace(strip_boilerplate(text))
+    report = _report(text, compacted)
+    logger.info(f"Prompt compaction removed {report['tokens_removed']} of {report['tokens_before']} tokens")
+    return compacted, report
+
+
+def _sentence_units(text: str) -> List[str]:
+    sentences = [sentence.strip() for sentence in SENTENCE_BREAK.split(text) if len(sentence.strip()) > 2]
+    if len(sentences) <= SALIENCE_MAX_UNITS:
+        return sentences
+    size = -(-len(sentences) // SALIENCE_MAX_UNITS)
+    return [" ".join(sentences[i:i + size]) for i in range(0, len(sentences), size)]
+
+
+def select_salient(text: str, query: str, max_tokens: int) -> str:
+    """Keep the sentences most similar to query that fit in max_tokens, in their original order (blocking)"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    units = _sentence_units(text)
+    if not units:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    embeddings = vector_db.embed(units + [query])
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    similarities = embeddings[:-1] @ embeddings[-1]
+
+    budget = max_tokens * CHARS_PER_TOKEN
+    selected = []
+    for index in np.argsort(-similarities):
+        cost = len(units[index]) + 1
+        if cost <= budget:
+            selected.append(index)
+            budget -= cost
+    return "\n".join(units[index] for index in sorted(selected))
+
+
+def compact_for_query(text: str, query: str, max_tokens: int) -> Tuple[str, Dict[str, Any]]:
+    """compact_document, then keep only the sentences most relevant to query if still over max_tokens"""
+    compacted = select_salient(normalize_whitespace(strip_boilerplate(text)), query, max_tokens)
+    report = _report(text, compacted)
+    logger.info(f"Prompt compaction removed {report['tokens_removed']} of {report['tokens_before']} tokens")
+    return compacted, report
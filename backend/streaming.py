@@ -0,0 +1,160 @@
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from llm_client import forget_completion, stream_chat_completion
+
+logger = logging.getLogger(__name__)
+
+Path = Tuple[Any, ...]
+
+
+def _matches(pattern: Path, path: Path) -> bool:
+    return len(pattern) == len(path) and all(
+        expected == actual or (expected == "*" and isinstance(actual, int))
+        for expected, actual in zip(pattern, path)
+    )
+
+
+class IncrementalJSONParser:
+    """Scans a JSON document as it arrives and reports values at chosen paths once they are complete.
+
+    Paths are tuples of object keys, with ``"*"`` standing for any array index:
+    ``("detailed_insights", "*")`` matches each element of ``detailed_insights``.
+    Text before the first ``{`` or ``[`` (and after the matching close) is ignored,
+    so prose the model wraps around the JSON does not get in the way.
+    """
+
+    def __init__(self, paths: Iterable[Path]):
+        self.paths = [tuple(path) for path in paths]
+        self._text = ""
+        self._pos = 0
+        self._done = False
+        # One frame per open object or array
+        self._stack: List[Dict[str, Any]] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._string_is_key = False
+        self._value_path: Path = ()
+        self._scalar_start: Optional[int] = None
+
+    def _child_path(self, frame: Dict[str, Any]) -> Path:
+        return frame["path"] + ((frame["key"],) if frame["kind"] == "object" else (frame["index"],))
+
+    def _complete(self, path: Path, raw: str, events: List[Tuple[Path, Any]]):
+        if not any(_matches(pattern, path) for pattern in self.paths):
+            return
+        try:
+            events.append((path, json.loads(raw)))
+        except ValueError:
+            logger.debug(f"Skipping malformed streamed value at {path}: {raw[:100]}")
+
+    def feed(self, chunk: str) -> List[Tuple[Path, Any]]:
+        """Consume the next piece of text and return (path, value) for every watched value it completed"""
+        events: List[Tuple[Path, Any]] = []
+        self._text += chunk
+        text = self._text
+        while self._pos < len(text) and not self._done:
+            i = self._pos
+            c = text[i]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    raw = text[self._string_start:i + 1]
+                    if self._string_is_key:
+                        self._stack[-1]["key"] = json.loads(raw)
+                    else:
+                        self._complete(self._value_path, raw, events)
+                continue
+
+            if self._scalar_start is not None:
+                if c not in ",}] \t\r\n":
+                    continue
+                self._complete(self._value_path, text[self._scalar_start:i], events)
+                self._scalar_start = None
+
+            if not self._stack:
+                if c in "{[":
+                    self._stack.append({"kind": "object" if c == "{" else "array", "path": (), "start": i,
+                                        "key": None, "index": 0, "expect_key": True})
+                continue
+
+            frame = self._stack[-1]
+            if c in "{[":
+                self._stack.append({"kind": "object" if c == "{" else "array", "path": self._child_path(frame),
+                                    "start": i, "key": None, "index": 0, "expect_key": True})
+            elif c in "}]":
+                self._stack.pop()
+                self._complete(frame["path"], text[frame["start"]:i + 1], events)
+                self._done = not self._stack
+            elif c == '"':
+                self._in_string = True
+                self._string_start = i
+                self._string_is_key = frame["kind"] == "object" and frame["expect_key"]
+                if not self._string_is_key:
+                    self._value_path = self._child_path(frame)
+            elif c == ":":
+                frame["expect_key"] = False
+            elif c == ",":
+                if frame["kind"] == "object":
+                    frame["expect_key"] = True
+                else:
+                    frame["index"] += 1
+            elif not c.isspace():
+                self._scalar_start = i
+                self._value_path = self._child_path(frame)
+        return events
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def stream_json_completion(prompt: str, watch: Dict[Path, str],
+                                 parse: Callable[[str], Any]) -> AsyncIterator[str]:
+    """Stream a completion as server-sent events.
+
+    Every upstream piece is forwarded as a ``token`` event. Whenever a value at
+    one of the ``watch`` paths is complete it is sent as an event named by
+    ``watch``, with its path and value. The full text is then checked with
+    ``parse`` (the same validation the non-streaming endpoint runs) and sent as
+    ``result``, or as ``error`` with a status code and detail.
+    """
+    parser = IncrementalJSONParser(watch)
+    parts = []
+    try:
+        async for delta in stream_chat_completion(prompt):
+            parts.append(delta)
+            yield sse_event("token", {"delta": delta})
+            for path, value in parser.feed(delta):
+                event = next(name for pattern, name in watch.items() if _matches(pattern, path))
+                yield sse_event(event, {"path": list(path), "value": value})
+        result = parse("".join(parts))
+    except json.JSONDecodeError as je:
+        await forget_completion(prompt)
+        logger.error(f"Invalid JSON in streamed response: {''.join(parts)}")
+        yield sse_event("error", {"status_code": 422, "detail": f"The model returned an invalid response format: {str(je)}"})
+        return
+    except HTTPException as he:
+        await forget_completion(prompt)
+        yield sse_event("error", {"status_code": he.status_code, "detail": he.detail})
+        return
+    except Exception as e:
+        await forget_completion(prompt)
+        logger.error(f"Streaming completion failed: {str(e)}")
+        yield sse_event("error", {"status_code": 500, "detail": str(e)})
+        return
+    yield sse_event("result", result)
@@ -1,22 +1,17 @@
 import json
 import logging
-import requests
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from llm_client import chat_completion, forget_completion
+from llm_scheduler import PRIORITY_BULK
 from models import SuggestionInput
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/generate-suggestions", tags=["Suggestions Generation"])
 
-PERPLEXITY_API_KEY = "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"
-HEADERS = {
-    "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-    "Content-Type": "application/json"
-}
-PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
 
 @router.post("/")
-async def generate_suggestions(input: SuggestionInput):
+async def generate_suggestions(input: SuggestionInput, request: Request):
     if not input.insights or not isinstance(input.insights, list):
         logger.warning("Invalid or empty insights received for suggestions")
         raise HTTPException(status_code=400, detail="Insights must be a non-empty list")
@@ -47,27 +42,8 @@ Input Insights:
 {insights_json}
 """
 
-    payload = {
-        "model": "sonar-pro",
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
-
     try:
-        response = requests.post(PERPLEXITY_API_URL, headers=HEADERS, json=payload)
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Perplexity API error: {response.text}"
-            )
-
-        response_json = response.json()
-        logger.debug(f"Perplexity API response for suggestions: {response_json}")
-
-        message_content = response_json.get("choices", [{}])[0].get("message", {}).get("content", "")
-        if not message_content:
-            raise HTTPException(status_code=500, detail="Empty response from Perplexity API")
+        message_content = await chat_completion(prompt, request=request, priority=PRIORITY_BULK)
 
         json_start = message_content.find('[')
         json_end = message_content.rfind(']') + 1
@@ -80,6 +56,7 @@ Input Insights:
         return {"suggestions": suggestions}
 
     except json.JSONDecodeError as je:
+        await forget_completion(prompt)
         logger.error(f"Invalid JSON response for suggestions: {message_content}")
         logger.error(f"JSON decode error: {str(je)}")
         raise HTTPException(status_code=422, detail={
@@ -89,5 +66,6 @@ Input Insights:
         })
 
     except Exception as e:
+        await forget_completion(prompt)
         logger.error(f"Error generating suggestions: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate suggestions: {str(e)}")
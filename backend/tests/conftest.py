@@ -0,0 +1,74 @@
+import hashlib
+import os
+import sys
+import numpy as np
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Keep the embedding cache small and the checkpoint thread idle unless a test asks for a checkpoint
+os.environ.setdefault("EMBEDDING_CACHE_MEMORY_ITEMS", "1000")
+os.environ.setdefault("EMBEDDING_CACHE_DISK_ITEMS", "0")
+os.environ.setdefault("VECTOR_DB_CHECKPOINT_SECONDS", "3600")
+os.environ.setdefault("VECTOR_DB_WAL_FSYNC", "0")
+
+
+def items(*texts):
+    """(text, metadata) pairs as add_vectors takes them"""
+    return [(text, {"type": "input_text", "content": text}) for text in texts]
+
+
+def top_content(db, text):
+    return db.query_vectors(text, k=1)["results"][0]["content"]["content"]
+
+
+def crash(db):
+    """Stop a database without its final checkpoint, leaving the WAL as a crash would"""
+    db._wal.flush()
+    db._closed.set()
+    db._checkpoint_requested.set()
+    db._checkpointer.join()
+    db._wal.close()
+    db.embedding_batcher.close()
+
+
+class HashingModel:
+    """Deterministic stand-in for the sentence-transformers model: a unit vector seeded by the text"""
+
+    def __init__(self, name: str, dimension: int = 384):
+        self.dimension = dimension
+
+    def encode(self, texts, **kwargs):
+        vectors = np.zeros((len(texts), self.dimension), dtype="float32")
+        for row, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vectors[row] = np.random.default_rng(seed).standard_normal(self.dimension)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def vector_database(tmp_path, monkeypatch):
+    """The vector_database module with its data directory under tmp_path and the model replaced"""
+    import sentence_transformers
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sentence_transformers, "SentenceTransformer", HashingModel)
+    import vector_database
+    monkeypatch.setattr(vector_database, "SentenceTransformer", HashingModel)
+    os.makedirs(vector_database.DATA_DIR, exist_ok=True)
+    return vector_database
+
+
+@pytest.fixture
+def open_database(vector_database):
+    """Open VectorDatabase instances on the test's data directory; all are closed at teardown"""
+    opened = []
+
+    def open_():
+        db = vector_database.VectorDatabase()
+        opened.append(db)
+        return db
+
+    yield open_
+    for db in opened:
+        db.close()
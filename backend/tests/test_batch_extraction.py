@@ -0,0 +1,83 @@
+import asyncio
+import io
+import os
+import zipfile
+import pytest
+from fastapi import HTTPException, UploadFile
+from uploads import SpooledUpload
+
+
+@pytest.fixture
+def batch_extraction(tmp_path, monkeypatch):
+    """The batch_extraction module, with any cache directory it creates under tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    import batch_extraction
+    return batch_extraction
+
+
+def zip_upload(members) -> SpooledUpload:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    upload = SpooledUpload(suffix=".zip")
+    upload.write(buffer.getvalue())
+    upload.finish()
+    return upload
+
+
+def fail_to_spool(*args, **kwargs):
+    raise AssertionError("spooled a member of an archive over the limits")
+
+
+def test_zip_with_too_many_entries_is_refused_before_extraction(batch_extraction, monkeypatch):
+    monkeypatch.setattr(batch_extraction, "BATCH_MAX_ZIP_MEMBERS", 3)
+    monkeypatch.setattr(batch_extraction, "spool_file", fail_to_spool)
+    upload = zip_upload([(f"folder{n}/", b"") for n in range(3)] + [("a.pdf", b"%PDF")])
+    with pytest.raises(HTTPException) as error:
+        batch_extraction._expand_zip(upload)
+    assert error.value.status_code == 413
+
+
+def test_zip_that_expands_too_far_is_refused_before_extraction(batch_extraction, monkeypatch):
+    monkeypatch.setattr(batch_extraction, "BATCH_MAX_ZIP_MB", 1)
+    monkeypatch.setattr(batch_extraction, "spool_file", fail_to_spool)
+    # About 2 KB compressed, 2 MB declared
+    upload = zip_upload([("small.pdf", b"%PDF"), ("bomb.pdf", bytes(2 * 1024 * 1024))])
+    with pytest.raises(HTTPException) as error:
+        batch_extraction._expand_zip(upload)
+    assert error.value.status_code == 413
+
+
+def test_zip_within_the_limits_is_expanded(batch_extraction):
+    documents = batch_extraction._expand_zip(zip_upload([("a.pdf", b"%PDF"), ("notes.txt", b"x"), ("__MACOSX/a.pdf", b"")]))
+    assert [(name, upload is not None) for name, upload in documents] == [("a.pdf", True), ("notes.txt", False)]
+    documents[0][1].close()
+
+
+def test_shutdown_deletes_the_spooled_files_of_unfinished_jobs(batch_extraction, monkeypatch):
+    spooled = []
+
+    async def never_finishes(filename, upload):
+        spooled.append(upload.path)
+        await asyncio.Event().wait()
+
+    async def run():
+        monkeypatch.setattr(batch_extraction, "_batch_semaphore", asyncio.Semaphore(1))
+        files = [UploadFile(io.BytesIO(b"%PDF-1.4 document"), filename=f"{n}.pdf") for n in range(3)]
+        job = await batch_extraction.submit_batch(files)
+        # Wait until the first document is extracting and the other two wait for the semaphore
+        while not spooled:
+            await asyncio.sleep(0.01)
+        paths = [upload.path for _, upload in next(iter(batch_extraction._tasks.values()))]
+        await batch_extraction.shutdown_batches()
+        return job, paths
+
+    # Spill every document to disk so leaks show up as files
+    monkeypatch.setattr(batch_extraction, "BATCH_MEMORY_LIMIT_MB", 0)
+    monkeypatch.setattr(batch_extraction, "extract_document", never_finishes)
+    job, paths = asyncio.run(run())
+    assert job["total"] == 3
+    assert len(paths) == 3 and all(paths)
+    assert not any(os.path.exists(path) for path in paths)
+    assert not batch_extraction._tasks
@@ -0,0 +1,53 @@
+import asyncio
+import json
+import os
+from benchmarks.run import RssSampler, compare, run_level
+
+
+class FlakyScenario:
+    """Every third request fails; the rest take a little longer each time"""
+
+    name = "flaky"
+
+    def __init__(self):
+        self.active = 0
+        self.peak_active = 0
+
+    async def execute(self, client, i):
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        await asyncio.sleep(0.001 * (i % 5))
+        self.active -= 1
+        if i % 3 == 2:
+            raise RuntimeError("upstream error")
+        return True, 0.0005
+
+
+def test_level_runs_at_the_requested_concurrency_and_counts_errors():
+    scenario = FlakyScenario()
+    result = asyncio.run(run_level(None, scenario, concurrency=4, requests=30, sampler=RssSampler(os.getpid())))
+    assert scenario.peak_active == 4
+    assert result["errors"] == 10
+    assert 0 < result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    assert result["first_byte_p50_ms"] == 0.5
+    assert result["throughput_rps"] > 0
+    assert result["peak_rss_mb"] > 0
+
+
+def test_compare_flags_slower_smaller_and_failing_levels(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    before = {"p95_ms": 100.0, "throughput_rps": 50.0, "errors": 0}
+    baseline.write_text(json.dumps({"results": [
+        {"scenario": "domain", "concurrency": 8, **before},
+        {"scenario": "insights", "concurrency": 8, **before},
+    ]}))
+    results = [
+        {"scenario": "domain", "concurrency": 8, "p95_ms": 109.0, "throughput_rps": 46.0, "errors": 0},
+        {"scenario": "insights", "concurrency": 8, "p95_ms": 150.0, "throughput_rps": 30.0, "errors": 2},
+        {"scenario": "insights", "concurrency": 32, "p95_ms": 900.0, "throughput_rps": 1.0, "errors": 9},
+    ]
+    assert compare(results, str(baseline), tolerance=0.1) == [
+        "insights @ 8: p95 100.0 -> 150.0 ms",
+        "insights @ 8: throughput 50.0 -> 30.0 req/s",
+        "insights @ 8: errors 0 -> 2",
+    ]
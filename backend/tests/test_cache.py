@@ -0,0 +1,104 @@
+import os
+import pytest
+import cache
+from cache import TieredCache
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def payload(size):
+    """A value whose JSON encoding is exactly size bytes"""
+    return "x" * (size - 2)
+
+
+def test_memory_tier_evicts_least_recently_used_by_bytes():
+    store = TieredCache("test", memory_max_bytes=300, disk_max_bytes=10 ** 6)
+    for key in ("a", "b", "c"):
+        store.set(key, payload(100))
+    assert store.get("a") is not None
+    store.set("d", payload(100))
+    stats = store.stats()
+    assert stats["memory_entries"] == 3
+    assert stats["memory_bytes"] == 300
+
+    # b was evicted from memory but is still on disk, and comes back into memory
+    assert store.get("b") == payload(100)
+    assert store.stats()["disk_hits"] == 1
+    assert store.get("b") == payload(100)
+    assert store.stats()["memory_hits"] == 2
+
+
+def test_value_larger_than_the_memory_tier_is_kept_on_disk_only():
+    store = TieredCache("test", memory_max_bytes=50, disk_max_bytes=10 ** 6)
+    store.set("big", payload(100))
+    assert store.stats()["memory_entries"] == 0
+    assert store.get("big") == payload(100)
+    assert store.stats()["disk_hits"] == 1
+
+
+def test_disk_tier_survives_a_restart_and_evicts_least_recently_used_files():
+    store = TieredCache("test", memory_max_bytes=10 ** 6, disk_max_bytes=10 ** 6)
+    store.set("old", payload(100))
+    store.set("new", payload(100))
+    os.utime(store._path("old"), (1, 1))
+
+    size = store.stats()["disk_bytes"]
+    # Room for two entries, whatever the length of their timestamps
+    reopened = TieredCache("test", memory_max_bytes=10 ** 6, disk_max_bytes=size + 50)
+    assert reopened.stats()["disk_bytes"] == size
+    reopened.set("newest", payload(100))
+    assert not os.path.exists(reopened._path("old"))
+    assert reopened.get("old") is None
+    assert reopened.get("new") == payload(100)
+    assert reopened.get("newest") == payload(100)
+    assert reopened.stats()["disk_bytes"] <= size + 50
+
+
+def test_expired_entries_are_misses_and_are_deleted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    store = TieredCache("test", memory_max_bytes=10 ** 6, disk_max_bytes=10 ** 6, ttl_seconds=60)
+    store.set("key", {"answer": 42})
+    now[0] += 30
+    assert store.get("key") == {"answer": 42}
+    now[0] += 60
+    assert store.get("key") is None
+    stats = store.stats()
+    assert stats["expired"] == 1
+    assert stats["misses"] == 1
+    assert stats["memory_entries"] == 0
+    assert not os.path.exists(store._path("key"))
+
+
+def test_unreadable_file_is_discarded():
+    store = TieredCache("test", memory_max_bytes=10 ** 6, disk_max_bytes=10 ** 6)
+    with open(store._path("broken"), "wb") as f:
+        f.write(b"not a timestamp\n{}")
+    assert store.get("broken") is None
+    assert not os.path.exists(store._path("broken"))
+
+
+def test_discard_and_clear_empty_both_tiers():
+    store = TieredCache("test", memory_max_bytes=10 ** 6, disk_max_bytes=10 ** 6)
+    store.set("a", 1)
+    store.set("b", 2)
+    store.discard("a")
+    assert store.get("a") is None
+    assert store.get("b") == 2
+    store.clear()
+    assert store.get("b") is None
+    stats = store.stats()
+    assert stats["memory_bytes"] == 0
+    assert stats["disk_bytes"] == 0
+    assert os.listdir(store.directory) == []
+
+
+def test_prompt_key_ignores_whitespace_but_not_the_model():
+    import llm_client
+    key = llm_client.prompt_key("Summarize  this\n\treport ", "sonar-pro")
+    assert key == llm_client.prompt_key("Summarize this report", "sonar-pro")
+    assert key != llm_client.prompt_key("Summarize this report", "sonar")
+    assert key != llm_client.prompt_key("Summarize that report", "sonar-pro")
@@ -0,0 +1,41 @@
+from chunking import CHARS_PER_TOKEN, chunk_text, excerpt
+
+
+def paragraphs(count, words=40):
+    return [" ".join(f"p{n}w{w}" for w in range(words)) for n in range(count)]
+
+
+def test_chunks_stay_within_budget_and_keep_every_paragraph():
+    text = "\n\n".join(paragraphs(60))
+    chunks = chunk_text(text, max_tokens=200)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 200 * CHARS_PER_TOKEN for chunk in chunks)
+    assert "\n\n".join(chunks).split("\n\n") == text.split("\n\n")
+
+
+def test_oversized_paragraph_is_split_at_whitespace():
+    chunks = chunk_text(" ".join(["word"] * 1000), max_tokens=100)
+    assert all(len(chunk) <= 100 * CHARS_PER_TOKEN for chunk in chunks)
+    assert all(set(piece.split()) == {"word"} for piece in chunks)
+
+
+def test_page_markers_are_not_sent_to_the_model():
+    text = "First page text\n--- End of Page 1 ---\nSecond page text"
+    assert chunk_text(text) == ["First page text\n\nSecond page text"]
+
+
+def test_editing_the_end_keeps_earlier_chunks_identical():
+    original = paragraphs(80)
+    edited = original[:-1] + ["a rewritten closing paragraph"]
+    before = chunk_text("\n\n".join(original), max_tokens=200)
+    after = chunk_text("\n\n".join(edited), max_tokens=200)
+    assert before[:-1] == after[:-1]
+
+
+def test_excerpt_covers_the_whole_document_within_its_budget():
+    text = "".join(f"[{n:04d}]" for n in range(2000))
+    short = excerpt(text, 1000)
+    assert len(short) <= 1000
+    assert short.startswith("[0000]")
+    assert "[1999]" in short
+    assert excerpt("short text", 1000) == "short text"
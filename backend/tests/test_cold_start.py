@@ -0,0 +1,75 @@
+import os
+import pickle
+import threading
+import faiss
+from conftest import HashingModel, items, top_content
+from metadata_store import MetadataStore
+
+
+def test_checkpoint_reopens_from_the_index_file_without_replay(vector_database, open_database):
+    db = open_database()
+    assert db.add_vectors(items("alpha", "beta", "gamma"))
+    assert db.checkpoint()
+    db.close()
+    assert os.path.getsize(vector_database.WAL_PATH) == 0
+
+    reopened = open_database()
+    assert reopened.index.base.ntotal == 3
+    assert reopened.index.count == 0
+    assert reopened.index.path == vector_database.FAISS_INDEX_PATH
+    assert top_content(reopened, "beta") == "beta"
+
+
+def test_legacy_pickle_metadata_is_migrated_once(vector_database, open_database):
+    texts = ["alpha", "beta"]
+    index = faiss.IndexFlatL2(384)
+    index.add(HashingModel("legacy").encode(texts))
+    faiss.write_index(index, vector_database.FAISS_INDEX_PATH)
+    with open(vector_database.LEGACY_METADATA_PATH, "wb") as f:
+        pickle.dump({"stored_data": [metadata for _, metadata in items(*texts)]}, f)
+
+    db = open_database()
+    assert db.metadata.count() == 2
+    assert top_content(db, "beta") == "beta"
+    assert not os.path.exists(vector_database.LEGACY_METADATA_PATH)
+    assert os.path.exists(vector_database.LEGACY_METADATA_PATH + ".migrated")
+
+
+def test_restart_after_failed_load_keeps_metadata_consistent(vector_database, open_database):
+    db = open_database()
+    assert db.add_vectors(items("alpha"))
+    db.close()
+    with open(vector_database.FAISS_INDEX_PATH, "r+b") as f:
+        f.write(b"not a faiss index")
+
+    db = open_database()
+    assert db.index.ntotal == 0
+    assert db.metadata.count() == 0
+    assert db.add_vectors(items("beta"))
+    assert top_content(db, "beta") == "beta"
+    db.close()
+
+    # The unreadable files were set aside, so the next start sees only the new database
+    db = open_database()
+    assert db.index.ntotal == 1
+    assert top_content(db, "beta") == "beta"
+
+
+def test_metadata_replay_keeps_rows_and_inserts_replace_them(tmp_path):
+    store = MetadataStore(str(tmp_path / "metadata.sqlite3"))
+    store.add(0, [{"type": "a", "content": "first"}, {"type": "b", "content": "second"}])
+    store.add(1, [{"type": "b", "content": "replayed"}, {"type": "b", "content": "third"}], replace=False)
+    assert store.get_many([0, 1, 2]) == {0: {"type": "a", "content": "first"}, 1: {"type": "b", "content": "second"},
+                                         2: {"type": "b", "content": "third"}}
+    store.add(1, [{"type": "a", "content": "replaced"}])
+    assert store.get_many([1])[1]["content"] == "replaced"
+    assert store.type_counts() == {"a": 2, "b": 1}
+
+    store.truncate(1)
+    assert store.count() == 1
+    # Each thread reads through its own connection and sees committed rows
+    seen = []
+    reader = threading.Thread(target=lambda: seen.append(store.get_many([0])))
+    reader.start()
+    reader.join()
+    assert seen == [{0: {"type": "a", "content": "first"}}]
@@ -0,0 +1,68 @@
+import json
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def classifier(vector_database, monkeypatch):
+    """domain_classifier with fixed similarities: the first label clearly ahead of the rest"""
+    import domain_classifier
+    similarities = np.zeros(len(domain_classifier.labels()))
+    similarities[0] = 0.3
+    monkeypatch.setattr(domain_classifier, "label_similarities", lambda text: similarities)
+    monkeypatch.setattr(domain_classifier, "_calibration", None)
+    monkeypatch.setattr(domain_classifier, "DOMAIN_CALIBRATION_PATH", "domain_calibration.json")
+    return domain_classifier
+
+
+def test_result_has_the_llm_shape_with_a_numeric_confidence(classifier):
+    result = classifier.classify("Quarterly revenue and cash flow")
+    assert result["domain"] == classifier.labels()[0]
+    assert isinstance(result["confidence"], float)
+    assert result["confidence"] == result["classifier_score"]
+    assert result["calibrated"] is False
+    assert result["reason"]
+
+
+def test_calibration_bins_replace_the_raw_score(classifier):
+    with open("domain_calibration.json", "w") as f:
+        json.dump({"temperature": classifier.DOMAIN_CLASSIFIER_TEMPERATURE,
+                   "bins": [[0.5, 0.4], [0.9, 0.7], [1.0, 0.85]]}, f)
+    result = classifier.classify("Quarterly revenue and cash flow")
+    assert result["calibrated"] is True
+    assert result["confidence"] == 0.85
+    assert result["classifier_score"] > 0.9
+
+
+def test_calibration_for_another_temperature_is_ignored(classifier):
+    with open("domain_calibration.json", "w") as f:
+        json.dump({"temperature": classifier.DOMAIN_CLASSIFIER_TEMPERATURE * 2, "bins": [[1.0, 0.1]]}, f)
+    assert classifier.classify("Quarterly revenue")["calibrated"] is False
+
+
+def test_fast_path_is_off_by_default(classifier):
+    assert classifier.DOMAIN_FASTPATH_ENABLED is False
+    assert classifier.try_fast_path("Quarterly revenue and cash flow") is None
+
+
+def test_fast_path_compares_the_confidence(classifier, monkeypatch):
+    monkeypatch.setattr(classifier, "DOMAIN_FASTPATH_ENABLED", True)
+    monkeypatch.setattr(classifier, "DOMAIN_FASTPATH_THRESHOLD", 0.9)
+    assert classifier.try_fast_path("Quarterly revenue")["source"] == "local_classifier"
+    with open("domain_calibration.json", "w") as f:
+        json.dump({"temperature": classifier.DOMAIN_CLASSIFIER_TEMPERATURE, "bins": [[1.0, 0.6]]}, f)
+    monkeypatch.setattr(classifier, "_calibration", None)
+    assert classifier.try_fast_path("Quarterly revenue") is None
+
+
+def test_evaluation_bins_pool_out_of_order_bins(vector_database):
+    from benchmarks.domain_eval import calibration_bins
+    scores = np.array([0.35, 0.55, 0.58, 0.95, 0.97])
+    correct = np.array([1.0, 0.0, 0.0, 1.0, 1.0])
+    bins = calibration_bins(scores, correct)
+    accuracies = [accuracy for _, accuracy in bins]
+    assert len(bins) == 10 and bins[-1][0] == 1.0
+    assert accuracies == sorted(accuracies)
+    # 0.35 (right) and the two 0.5s (wrong) pool to 1/3 rather than lifting the 0.5s to 1.0
+    assert accuracies[3] == accuracies[5] == 0.333
+    assert accuracies[-1] == 1.0
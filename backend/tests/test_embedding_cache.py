@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from conftest import HashingModel
+from embedding_cache import EmbeddingCache, embedding_key, model_fingerprint
+
+DIMENSION = 8
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+class CountingModel(HashingModel):
+    def __init__(self):
+        super().__init__("model", DIMENSION)
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.append(list(texts))
+        return super().encode(texts, **kwargs)
+
+
+def test_only_distinct_uncached_texts_are_encoded():
+    model = CountingModel()
+    cache = EmbeddingCache("test", "fp", DIMENSION, memory_items=10, disk_items=0)
+    vectors = cache.encode(["a", "b", "a"], model.encode)
+    assert model.encoded == [["a", "b"]]
+    assert vectors.dtype == np.float32
+    assert np.allclose(vectors, model.encode(["a", "b", "a"]))
+
+    model.encoded.clear()
+    assert np.allclose(cache.encode(["b", "c"], model.encode), model.encode(["b", "c"]))
+    assert model.encoded[0] == ["c"]
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"]) == (1, 4)
+    assert cache.encode([], model.encode).shape == (0, DIMENSION)
+
+
+def test_memory_tier_evicts_the_least_recently_used_embedding():
+    model = CountingModel()
+    cache = EmbeddingCache("test", "fp", DIMENSION, memory_items=2, disk_items=0)
+    cache.encode(["a", "b"], model.encode)
+    cache.encode(["a"], model.encode)
+    cache.encode(["c"], model.encode)
+    found = cache.get_many([embedding_key(text) for text in ("a", "b", "c")])
+    assert [vector is not None for vector in found] == [True, False, True]
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_disk_tier_survives_a_restart_until_the_model_changes():
+    model = CountingModel()
+    cache = EmbeddingCache("test", "fp", DIMENSION, memory_items=10, disk_items=10)
+    expected = cache.encode(["a", "b"], model.encode)
+    cache.flush()
+
+    reopened = EmbeddingCache("test", "fp", DIMENSION, memory_items=10, disk_items=10)
+    found = reopened.get_many([embedding_key("a"), embedding_key("b")])
+    assert np.allclose(np.vstack(found), expected)
+    assert reopened.stats()["disk_hits"] == 2
+    # Disk hits are promoted to memory
+    reopened.get_many([embedding_key("a")])
+    assert reopened.stats()["memory_hits"] == 1
+
+    other_model = EmbeddingCache("test", "other fp", DIMENSION, memory_items=10, disk_items=10)
+    assert other_model.get_many([embedding_key("a")]) == [None]
+    assert other_model.stats()["disk_entries"] == 0
+
+
+def test_full_disk_tier_overwrites_its_oldest_entries():
+    model = CountingModel()
+    cache = EmbeddingCache("test", "fp", DIMENSION, memory_items=1, disk_items=2)
+    for text in ("a", "b", "c"):
+        cache.encode([text], model.encode)
+    cache.flush()
+
+    reopened = EmbeddingCache("test", "fp", DIMENSION, memory_items=10, disk_items=2)
+    found = reopened.get_many([embedding_key(text) for text in ("a", "b", "c")])
+    assert [vector is not None for vector in found] == [False, True, True]
+    # Writing resumes after the newest entry, so b is the next to go
+    reopened.put_many([embedding_key("d")], model.encode(["d"]))
+    assert set(reopened._disk_slots) == {embedding_key("c"), embedding_key("d")}
+
+
+def test_fingerprint_changes_with_the_model_weights():
+    def encode(texts):
+        return np.ones((len(texts), DIMENSION))
+
+    def retrained(texts):
+        return np.full((len(texts), DIMENSION), 0.5)
+
+    assert model_fingerprint("m", encode) == model_fingerprint("m", encode)
+    assert model_fingerprint("m", encode) != model_fingerprint("m", retrained)
+    assert model_fingerprint("m", encode) != model_fingerprint("n", encode)
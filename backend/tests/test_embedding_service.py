@@ -0,0 +1,95 @@
+import threading
+import numpy as np
+import pytest
+from embedding_service import EmbeddingBatcher, Histogram
+
+
+class GatedModel:
+    """Encodes each text as [len(text)], holding its first call until released so later requests queue up"""
+
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail_on = fail_on
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        self.started.set()
+        self.release.wait(5)
+        if self.fail_on in texts:
+            raise ValueError(f"cannot encode {self.fail_on}")
+        return np.array([[len(text)] for text in texts])
+
+
+@pytest.fixture
+def model():
+    return GatedModel()
+
+
+@pytest.fixture
+def batcher(model):
+    batcher = EmbeddingBatcher(model.encode, max_batch_size=4, max_wait_ms=50)
+    yield batcher
+    model.release.set()
+    batcher.close()
+
+
+def test_queued_requests_share_a_batch_and_get_their_own_rows(model, batcher):
+    first = batcher.submit(["a"])
+    assert model.started.wait(5)
+    waiting = [batcher.submit(["bb", "ccc"]), batcher.submit(["dddd"]), batcher.submit(["e"]),
+               batcher.submit(["ff"])]
+    model.release.set()
+    assert first.result(5).tolist() == [[1]]
+    assert [future.result(5).tolist() for future in waiting] == [[[2], [3]], [[4]], [[1]], [[2]]]
+    # The last request would have pushed the second batch past four texts, so it starts a third
+    assert model.calls == [["a"], ["bb", "ccc", "dddd", "e"], ["ff"]]
+    # Metrics are recorded after the futures resolve; stopping the worker waits for them
+    batcher.close()
+    stats = batcher.stats()
+    assert (stats["requests"], stats["texts"], stats["batches"]) == (5, 6, 3)
+    assert stats["requests_per_batch"]["buckets"]["<=4"] == 1
+
+
+def test_request_larger_than_a_batch_is_encoded_on_its_own(model, batcher):
+    model.release.set()
+    texts = [str(n) * n for n in range(1, 7)]
+    assert batcher.encode(texts).ravel().tolist() == list(range(1, 7))
+    assert model.calls == [texts]
+
+
+def test_failed_batch_fails_its_callers_and_the_worker_carries_on():
+    model = GatedModel(fail_on="bad")
+    model.release.set()
+    batcher = EmbeddingBatcher(model.encode, max_batch_size=4, max_wait_ms=1)
+    with pytest.raises(ValueError, match="bad"):
+        batcher.encode(["bad"])
+    assert batcher.encode(["good"]).tolist() == [[4]]
+    batcher.close()
+    assert batcher.stats()["errors"] == 1
+
+
+def test_close_finishes_queued_requests_and_refuses_new_ones(model, batcher):
+    first = batcher.submit(["a"])
+    assert model.started.wait(5)
+    queued = batcher.submit(["bb"])
+    closing = threading.Thread(target=batcher.close)
+    closing.start()
+    model.release.set()
+    closing.join(5)
+    assert not closing.is_alive()
+    assert first.result(0).tolist() == [[1]]
+    assert queued.result(0).tolist() == [[2]]
+    with pytest.raises(RuntimeError, match="stopped"):
+        batcher.encode(["late"])
+    assert batcher.submit([]).result(0).shape == (0, 0)
+
+
+def test_histogram_counts_values_into_their_buckets():
+    histogram = Histogram((1, 10))
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+    summary = histogram.summary()
+    assert summary["buckets"] == {"<=1": 2, "<=10": 1, ">10": 1}
+    assert summary["p50"] == 5
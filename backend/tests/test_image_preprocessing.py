@@ -0,0 +1,40 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+from image_preprocessing import binarize, deskew, preprocess, to_grayscale
+
+
+def transparent_png(mode: str) -> Image.Image:
+    """Black text on a fully transparent background, saved and reloaded as PNG"""
+    image = Image.new("RGBA", (200, 60), (0, 0, 0, 0))
+    ImageDraw.Draw(image).rectangle((20, 20, 120, 35), fill=(0, 0, 0, 255))
+    options = {}
+    if mode == "LA":
+        image = image.convert("LA")
+    elif mode == "P":
+        image = image.convert("P")
+        options["transparency"] = image.getpixel((0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", **options)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "LA", "P"])
+def test_transparent_background_becomes_white(mode):
+    image = transparent_png(mode)
+    for processed in (preprocess(image)[0], to_grayscale(image), binarize(image)):
+        pixels = np.asarray(processed)
+        assert pixels[5, 5] == 255
+        assert pixels[25, 50] == 0
+
+
+def test_deskew_flattens_transparency():
+    pixels = np.asarray(deskew(transparent_png("RGBA")).convert("L"))
+    assert pixels[5, 5] == 255
+
+
+def test_opaque_image_is_unchanged_by_flattening():
+    image = Image.new("RGB", (10, 10), (100, 150, 200))
+    assert np.array_equal(np.asarray(to_grayscale(image)), np.asarray(image.convert("L")))
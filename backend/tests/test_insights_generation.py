@@ -0,0 +1,97 @@
+import asyncio
+import json
+import pytest
+from fastapi import HTTPException
+from models import InsightInput
+
+
+@pytest.fixture
+def insights_generation(vector_database, monkeypatch):
+    """The insights_generation module with a fake LLM: each chunk yields an insight named after its first word"""
+    import insights_generation
+
+    async def chat_completion(prompt, request=None, priority=None):
+        if "Partial summaries:" in prompt:
+            return json.dumps({"domain_summary": "Whole document"})
+        content = prompt.split("Content:\n", 1)[1].strip()
+        if content.startswith("broken"):
+            raise HTTPException(status_code=502, detail="Upstream failed")
+        topic = content.split()[0]
+        return json.dumps({
+            "detailed_insights": [
+                {"title": topic, "description": f"About {topic}", "supporting_data": [topic], "risk_factors": []},
+                {"title": "Shared", "description": "Everywhere", "supporting_data": [topic], "risk_factors": []}
+            ],
+            "domain_summary": f"Part about {topic}"
+        })
+
+    async def forget_completion(prompt):
+        pass
+
+    monkeypatch.setattr(insights_generation, "chat_completion", chat_completion)
+    monkeypatch.setattr(insights_generation, "forget_completion", forget_completion)
+    return insights_generation
+
+
+def document(*chunks):
+    return InsightInput(domain="Finance", content="\n\n".join(chunks), language="English")
+
+
+def parse_events(stream):
+    events = []
+    for message in stream:
+        lines = message.strip().split("\n")
+        events.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return events
+
+
+def test_merge_ranks_repeated_and_better_supported_insights_first(insights_generation):
+    results = [
+        {"detailed_insights": [
+            {"title": "Once", "description": "x", "supporting_data": [], "risk_factors": []},
+            {"title": "Detailed", "description": "y", "supporting_data": ["a", "b"], "risk_factors": ["c"]},
+            {"title": "Twice", "description": "z", "supporting_data": ["a"], "risk_factors": []},
+        ]},
+        {"detailed_insights": [{"title": "twice!", "description": "Z", "supporting_data": ["b"], "risk_factors": []}]},
+    ]
+    merged = insights_generation._merge_insights(results, limit=2)
+    assert [insight["title"] for insight in merged] == ["Twice", "Detailed"]
+    assert merged[0]["supporting_data"] == ["a", "b"]
+
+
+def test_merged_insights_are_capped(insights_generation, monkeypatch):
+    monkeypatch.setattr(insights_generation, "INSIGHTS_MAX_MERGED", 3)
+    chunks = [f"topic{n} text" for n in range(5)]
+    result = asyncio.run(insights_generation.generate_insights_map_reduce(document(*chunks), chunks, None))
+    # Shared is found in every chunk, so it survives the cap ahead of the per-chunk insights
+    assert [insight["title"] for insight in result["detailed_insights"]] == ["Shared", "topic0", "topic1"]
+    assert result["domain_summary"] == "Whole document"
+
+
+def test_stream_sends_each_chunk_then_the_merged_result(insights_generation):
+    chunks = ["alpha text", "broken text", "gamma text"]
+
+    async def collect():
+        stream = insights_generation.stream_insights_map_reduce(document(*chunks), chunks, {"saved": 0}, None)
+        return [message async for message in stream]
+
+    events = parse_events(asyncio.run(collect()))
+    names = [name for name, _ in events]
+    assert sorted(names[:3]) == ["chunk", "chunk", "chunk_error"]
+    assert names[3:] == ["summary", "result"]
+    assert {data["index"] for _, data in events[:3]} == {0, 1, 2}
+    result = events[-1][1]
+    assert result["chunks"] == {"total": 3, "failed": 1}
+    assert result["prompt_compaction"] == {"saved": 0}
+    assert {insight["title"] for insight in result["detailed_insights"]} == {"Shared", "alpha", "gamma"}
+
+
+def test_stream_reports_an_error_when_every_chunk_fails(insights_generation):
+    chunks = ["broken one", "broken two"]
+
+    async def collect():
+        stream = insights_generation.stream_insights_map_reduce(document(*chunks), chunks, {}, None)
+        return [message async for message in stream]
+
+    name, data = parse_events(asyncio.run(collect()))[-1]
+    assert name == "error" and data["status_code"] == 502
@@ -0,0 +1,117 @@
+import asyncio
+import os
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+
+
+@pytest.fixture
+def stages():
+    """Names of the stages run so far, and the gate the insights stage waits on"""
+    return SimpleNamespace(ran=[], gate=asyncio.Event())
+
+
+@pytest.fixture
+def jobs(vector_database, stages, tmp_path, monkeypatch):
+    """The jobs module with a fresh store, and pipelines whose stages only record that they ran"""
+    import jobs
+    import pipeline
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(jobs, "store", jobs.JobStore(str(tmp_path / "jobs" / "jobs.sqlite3")))
+    monkeypatch.setattr(jobs, "_job_semaphore", asyncio.Semaphore(2))
+
+    class RecordingPipeline(pipeline.AnalysisPipeline):
+        async def extract(self):
+            stages.ran.append("extract")
+            self.text = "report text"
+            return {"filename": self.filename, "text": self.text, "cached": False}
+
+        async def domain(self):
+            stages.ran.append("domain")
+            return {"domain": "Finance"}
+
+        async def store_text(self):
+            stages.ran.append("store_text")
+            return {"stored": 1}
+
+        async def insights(self):
+            stages.ran.append("insights")
+            await stages.gate.wait()
+            return {"detailed_insights": [f"{self.results['domain']['domain']} on {self.text}"]}
+
+        async def suggestions(self):
+            stages.ran.append("suggestions")
+            return {"suggestions": ["act"]}
+
+        async def store_results(self):
+            stages.ran.append("store_results")
+            return {"stored": 2}
+
+    monkeypatch.setattr(jobs, "AnalysisPipeline", RecordingPipeline)
+    return jobs
+
+
+def submit(jobs, job_id):
+    path = os.path.join(jobs.JOBS_DIR, job_id, "0.pdf")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"%PDF")
+    jobs.store.create_job(job_id, "English", [{"position": 0, "filename": "report.pdf", "path": path,
+                                               "status": "queued"}])
+    jobs._start_job(job_id, "English", jobs.store.get_documents(job_id))
+    return path
+
+
+async def wait_for_stages(jobs, job_id, count):
+    for _ in range(500):
+        if len(jobs.store.get_documents(job_id)[0]["stages"]) >= count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("stages did not finish")
+
+
+def test_resumed_document_skips_the_stages_it_finished(jobs, stages):
+    async def scenario():
+        path = submit(jobs, "job1")
+        await wait_for_stages(jobs, "job1", 3)
+        await jobs.shutdown_jobs()
+        document = jobs.store.get_documents("job1")[0]
+        assert document["status"] == "running"
+        assert set(document["stages"]) == {"extract", "domain", "store_text"}
+
+        # As after a restart: the documents left running are picked up again
+        stages.ran.clear()
+        stages.gate.set()
+        await jobs.resume_jobs()
+        await asyncio.gather(*jobs._job_tasks.values())
+        return path
+
+    path = asyncio.run(scenario())
+    assert stages.ran == ["insights", "suggestions", "store_results"]
+    job = jobs.store.get_job("job1")
+    assert job["status"] == "completed"
+    assert job["completed"] == 1
+    document = jobs.store.get_documents("job1")[0]
+    assert document["status"] == "done"
+    assert document["results"]["insights"] == {"detailed_insights": ["Finance on report text"]}
+    assert not os.path.exists(path)
+
+
+def test_cancelled_job_keeps_finished_stages_and_drops_its_files(jobs):
+    async def scenario():
+        path = submit(jobs, "job2")
+        await wait_for_stages(jobs, "job2", 3)
+        assert await jobs.cancel_job("job2") == {"job_id": "job2", "status": "cancelled"}
+        with pytest.raises(HTTPException) as error:
+            await jobs.cancel_job("job2")
+        assert error.value.status_code == 409
+        return path
+
+    path = asyncio.run(scenario())
+    assert not os.path.exists(os.path.dirname(path))
+    assert jobs.store.get_job("job2")["status"] == "cancelled"
+    document = jobs.store.get_documents("job2")[0]
+    assert document["status"] == "cancelled"
+    assert document["results"]["domain"] == {"domain": "Finance"}
+    assert "insights" not in document["results"]
+    assert jobs._job_tasks == {}
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+
+
+@pytest.fixture
+def llm_client(tmp_path, monkeypatch):
+    """The llm_client module, with an empty cache under tmp_path and no client open"""
+    monkeypatch.chdir(tmp_path)
+    import llm_client
+    from cache import TieredCache
+    monkeypatch.setattr(llm_client, "_client", None)
+    monkeypatch.setattr(llm_client, "llm_cache", TieredCache("llm", 10 ** 6, 10 ** 6))
+    return llm_client
+
+
+def test_missing_api_key_fails_before_any_request(llm_client, monkeypatch):
+    monkeypatch.setattr(llm_client, "PERPLEXITY_API_KEY", None)
+    with pytest.raises(RuntimeError, match="PERPLEXITY_API_KEY"):
+        llm_client.check_api_key()
+    with pytest.raises(RuntimeError, match="PERPLEXITY_API_KEY"):
+        llm_client.get_client()
+
+
+def test_client_sends_the_configured_key(llm_client, monkeypatch):
+    monkeypatch.setattr(llm_client, "PERPLEXITY_API_KEY", "test-key")
+    assert llm_client.get_client().headers["Authorization"] == "Bearer test-key"
+
+
+class FakeUpstream:
+    """Stands in for _request_completion: counts calls and answers once released"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+        self.release = None
+
+    async def __call__(self, prompt, model, priority, deadline):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"answer to {prompt}"
+
+
+class FakeRequest:
+    def __init__(self):
+        self.gone = False
+
+    async def is_disconnected(self):
+        return self.gone
+
+
+@pytest.fixture
+def upstream(llm_client, monkeypatch):
+    fake = FakeUpstream()
+    monkeypatch.setattr(llm_client, "_request_completion", fake)
+    monkeypatch.setattr(llm_client, "_flight_stats", {"leaders": 0, "coalesced": 0, "cancelled": 0})
+    monkeypatch.setattr(llm_client, "LLM_DISCONNECT_POLL_SECONDS", 0.01)
+    return fake
+
+
+def test_concurrent_identical_prompts_share_one_request(llm_client, upstream):
+    async def scenario():
+        upstream.release = asyncio.Event()
+        callers = [asyncio.create_task(llm_client.chat_completion(prompt))
+                   for prompt in ("Summarize it", "Summarize  it", "Summarize it\n")]
+        await asyncio.sleep(0.01)
+        upstream.release.set()
+        return await asyncio.gather(*callers)
+
+    assert asyncio.run(scenario()) == ["answer to Summarize it"] * 3
+    assert upstream.calls == 1
+    assert llm_client._flight_stats == {"leaders": 1, "coalesced": 2, "cancelled": 0}
+    assert llm_client._inflight == {}
+
+    # The completion was cached, so the next call does not go upstream
+    assert asyncio.run(llm_client.chat_completion("Summarize it")) == "answer to Summarize it"
+    assert upstream.calls == 1
+
+
+def test_request_is_cancelled_only_when_every_caller_has_gone(llm_client, upstream):
+    async def scenario():
+        upstream.release = asyncio.Event()
+        first, second = FakeRequest(), FakeRequest()
+        leaving = asyncio.create_task(llm_client.chat_completion("Report", request=first))
+        staying = asyncio.create_task(llm_client.chat_completion("Report", request=second))
+        await asyncio.sleep(0.01)
+        first.gone = True
+        with pytest.raises(HTTPException) as error:
+            await leaving
+        assert error.value.status_code == 499
+        assert upstream.cancelled == 0
+
+        second.gone = True
+        with pytest.raises(HTTPException):
+            await staying
+        await asyncio.sleep(0)
+        assert upstream.cancelled == 1
+        assert llm_client._inflight == {}
+
+        # A later caller starts a fresh request rather than joining the cancelled one
+        upstream.release.set()
+        return await llm_client.chat_completion("Report")
+
+    assert asyncio.run(scenario()) == "answer to Report"
+    assert upstream.calls == 2
+    assert llm_client._flight_stats == {"leaders": 2, "coalesced": 1, "cancelled": 1}
@@ -0,0 +1,130 @@
+import asyncio
+import time
+import httpx
+import pytest
+from fastapi import HTTPException
+from llm_scheduler import LLMScheduler, PRIORITY_BULK, PRIORITY_INTERACTIVE, PRIORITY_NORMAL
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1, rate=0, burst=1, min_rate=0)
+        admitted = []
+
+        async def call(name, priority):
+            async with scheduler.slot(priority):
+                admitted.append(name)
+                await asyncio.sleep(0)
+
+        await scheduler.acquire()
+        callers = [asyncio.create_task(call(name, priority)) for name, priority in [
+            ("bulk", PRIORITY_BULK), ("normal 1", PRIORITY_NORMAL),
+            ("interactive", PRIORITY_INTERACTIVE), ("normal 2", PRIORITY_NORMAL)
+        ]]
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queue_depth_by_priority"] == {"interactive": 1, "normal": 2, "bulk": 1}
+        scheduler.release()
+        await asyncio.gather(*callers)
+        return admitted, scheduler.stats()
+
+    admitted, stats = asyncio.run(scenario())
+    assert admitted == ["interactive", "normal 1", "normal 2", "bulk"]
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+    assert stats["max_queue_depth"] == 4
+    assert stats["dispatched"] == 5
+
+
+def test_deadline_passing_in_the_queue_gives_504_and_frees_its_place():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1, rate=0, burst=1, min_rate=0)
+        await scheduler.acquire()
+        with pytest.raises(HTTPException) as error:
+            await scheduler.acquire(deadline=time.monotonic() + 0.05)
+        assert error.value.status_code == 504
+        waiting = asyncio.create_task(scheduler.acquire())
+        scheduler.release()
+        await asyncio.wait_for(waiting, 1)
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["deadline_exceeded"] == 1
+    assert stats["in_flight"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_token_bucket_spaces_requests_after_the_burst():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=10, rate=20, burst=2, min_rate=1)
+        start = time.monotonic()
+        for _ in range(4):
+            await scheduler.acquire()
+        return time.monotonic() - start
+
+    # Two tokens up front, then one every 50ms
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_throttling_halves_the_rate_and_successes_restore_it():
+    scheduler = LLMScheduler(max_concurrency=1, rate=8, burst=1, min_rate=1)
+    for _ in range(5):
+        scheduler.throttled()
+    assert scheduler.rate == 1
+    assert scheduler.counters["throttled"] == 5
+    for _ in range(100):
+        scheduler.succeeded()
+    assert scheduler.rate == 8
+
+
+@pytest.fixture
+def llm_client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import llm_client
+    monkeypatch.setattr(llm_client, "scheduler", LLMScheduler(max_concurrency=1, rate=0, burst=1, min_rate=0))
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE_SECONDS", 0.01)
+    return llm_client
+
+
+def fake_upstream(llm_client, monkeypatch, responses):
+    """Answer successive posts with the given responses"""
+    remaining = list(responses)
+
+    class Client:
+        async def post(self, url, json):
+            return remaining.pop(0)
+
+    monkeypatch.setattr(llm_client, "get_client", lambda: Client())
+    return remaining
+
+
+def completion(text):
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+def test_throttled_and_failed_requests_are_retried(llm_client, monkeypatch):
+    remaining = fake_upstream(llm_client, monkeypatch, [
+        httpx.Response(429, headers={"retry-after": "0.01"}), httpx.Response(503), completion("done")
+    ])
+    assert asyncio.run(llm_client._request_completion("prompt", "model")) == "done"
+    assert remaining == []
+    assert llm_client.scheduler.counters["retries"] == 2
+    assert llm_client.scheduler.counters["throttled"] == 1
+
+
+def test_client_errors_are_not_retried(llm_client, monkeypatch):
+    remaining = fake_upstream(llm_client, monkeypatch, [httpx.Response(400, text="bad request"), completion("unused")])
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(llm_client._request_completion("prompt", "model"))
+    assert error.value.status_code == 400
+    assert len(remaining) == 1
+
+
+def test_retry_that_would_overrun_the_deadline_is_not_attempted(llm_client, monkeypatch):
+    remaining = fake_upstream(llm_client, monkeypatch, [
+        httpx.Response(503, headers={"retry-after": "5"}), completion("too late")
+    ])
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(llm_client._request_completion("prompt", "model", deadline=time.monotonic() + 1))
+    assert error.value.status_code == 503
+    assert len(remaining) == 1
+    assert llm_client.scheduler.counters["deadline_exceeded"] == 1
@@ -0,0 +1,24 @@
+import pytest
+import ocr_engine
+
+
+def test_auto_falls_back_to_pytesseract_without_tesserocr(monkeypatch):
+    monkeypatch.setattr(ocr_engine, "tesserocr", None)
+    assert ocr_engine.create_engine("auto").name == "pytesseract"
+    with pytest.raises(RuntimeError):
+        ocr_engine.create_engine("tesserocr")
+
+
+def test_auto_falls_back_when_tesserocr_cannot_load(monkeypatch):
+    class BrokenTesserocr:
+        @staticmethod
+        def PyTessBaseAPI(**kwargs):
+            raise RuntimeError("Failed to init API, possibly an invalid tessdata path")
+
+    monkeypatch.setattr(ocr_engine, "tesserocr", BrokenTesserocr)
+    assert ocr_engine.create_engine("auto").name == "pytesseract"
+
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError):
+        ocr_engine.create_engine("easyocr")
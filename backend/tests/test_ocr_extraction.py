@@ -0,0 +1,231 @@
+import asyncio
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import fitz
+import pytest
+from PIL import Image
+from uploads import SpooledUpload
+
+
+@pytest.fixture
+def ocr_extraction(tmp_path, monkeypatch):
+    """The ocr_extraction module, with any cache directory it creates under tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    import ocr_extraction
+    return ocr_extraction
+
+
+@pytest.fixture
+def upload():
+    upload = SpooledUpload(suffix=".png")
+    upload.write(b"not really a png")
+    upload.finish()
+    yield upload
+    upload.close()
+
+
+@pytest.mark.parametrize("setting, value", [
+    ("OCR_ENGINE", "pytesseract"),
+    ("OCR_LANGUAGE", "deu"),
+    ("OCR_MIN_IMAGE_SIDE", 1),
+    ("OCR_MIN_IMAGE_AREA", 1),
+])
+def test_cache_key_changes_with_extraction_settings(ocr_extraction, upload, monkeypatch, setting, value):
+    before = ocr_extraction._cache_key(upload, ".png")
+    monkeypatch.setattr(ocr_extraction, setting, value)
+    assert ocr_extraction._cache_key(upload, ".png") != before
+
+
+def test_cache_key_is_stable_for_the_same_settings(ocr_extraction, upload):
+    assert ocr_extraction._cache_key(upload, ".png") == ocr_extraction._cache_key(upload, ".png")
+    assert ocr_extraction._cache_key(upload, ".png") != ocr_extraction._cache_key(upload, ".pdf")
+
+
+def test_cache_stats_report_the_engine_the_workers_run(ocr_extraction):
+    assert asyncio.run(ocr_extraction.get_extraction_cache_stats())["ocr_engine_active"] is None
+    ocr_extraction.get_ocr_pool()
+    try:
+        ocr_extraction._ocr_engine_name.result(timeout=60)
+        stats = asyncio.run(ocr_extraction.get_extraction_cache_stats())
+    finally:
+        ocr_extraction.shutdown_ocr_pool()
+    assert stats["ocr_engine"] == ocr_extraction.OCR_ENGINE
+    # auto resolves in the workers, to tesserocr when it loads and to pytesseract otherwise
+    assert stats["ocr_engine_active"] in ("tesserocr", "pytesseract")
+
+
+def png(width, height, shade=0):
+    buffer = io.BytesIO()
+    Image.new("L", (width, height), shade).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def pdf_bytes(pages) -> bytes:
+    """A PDF with one page per entry: a string becomes its text layer, bytes an image filling the page"""
+    doc = fitz.open()
+    for content in pages:
+        page = doc.new_page()
+        if isinstance(content, str):
+            page.insert_text((72, 72), content)
+        else:
+            page.insert_image(page.rect, stream=content)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def pdf_upload(pages) -> SpooledUpload:
+    upload = SpooledUpload(suffix=".pdf")
+    upload.write(pages if isinstance(pages, bytes) else pdf_bytes(pages))
+    upload.finish()
+    return upload
+
+
+class FakeOcr:
+    """Stands in for the worker pool: "OCR" reports the image size, and can be held back with an event"""
+
+    def __init__(self):
+        self.calls = []
+        self.running = 0
+        self.most_running = 0
+        self.release = threading.Event()
+        self.release.set()
+        self._lock = threading.Lock()
+
+    def __call__(self, source):
+        with self._lock:
+            self.calls.append(source)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        self.release.wait(10)
+        time.sleep(0.02)
+        with self._lock:
+            self.running -= 1
+        width, height = Image.open(io.BytesIO(source)).size
+        return f"image {width}x{height}", {"ocr": 1.0}
+
+
+@pytest.fixture
+def fake_ocr(ocr_extraction, monkeypatch):
+    ocr = FakeOcr()
+    pool = ThreadPoolExecutor(max_workers=4)
+    monkeypatch.setattr(ocr_extraction, "_ocr_image", ocr)
+    monkeypatch.setattr(ocr_extraction, "get_ocr_pool", lambda: pool)
+    yield ocr
+    ocr.release.set()
+    pool.shutdown()
+
+
+def test_scanned_pages_are_ocred_in_parallel_and_returned_in_order(ocr_extraction, fake_ocr):
+    upload = pdf_upload([png(200 + n, 300) for n in range(6)] + ["Text layer page"])
+
+    async def pages():
+        timings = {}
+        return [page async for page in ocr_extraction.iter_pdf_pages(upload, timings)], timings
+
+    pages, timings = asyncio.run(pages())
+    assert [num for num, _ in pages] == list(range(7))
+    assert [text.strip() for _, text in pages[:6]] == [f"image {200 + n}x300" for n in range(6)]
+    assert "Text layer page" in pages[6][1]
+    assert len(fake_ocr.calls) == 6
+    assert fake_ocr.most_running > 1
+    assert timings["ocr"] == 6.0
+    upload.close()
+
+
+def test_ocr_runs_at_most_the_lookahead_ahead_of_the_reader(ocr_extraction, fake_ocr, monkeypatch):
+    monkeypatch.setattr(ocr_extraction, "OCR_PAGE_LOOKAHEAD", 2)
+    upload = pdf_upload([png(200 + n, 300) for n in range(6)])
+    fake_ocr.release.clear()
+
+    async def read_all():
+        reader = asyncio.create_task(collect())
+        while len(fake_ocr.calls) < 2:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+        queued = len(fake_ocr.calls)
+        fake_ocr.release.set()
+        return queued, await reader
+
+    async def collect():
+        return [text async for _, text in ocr_extraction.iter_pdf_pages(upload)]
+
+    queued, texts = asyncio.run(read_all())
+    assert queued == 2
+    assert len(texts) == 6
+    upload.close()
+
+
+
+@pytest.fixture
+def empty_cache(ocr_extraction, monkeypatch):
+    from cache import TieredCache
+    cache = TieredCache("extraction-test", memory_max_bytes=1024 * 1024, disk_max_bytes=0)
+    monkeypatch.setattr(ocr_extraction, "extraction_cache", cache)
+    return cache
+
+
+def stream_lines(ocr_extraction, upload):
+    async def collect():
+        return [json.loads(line) async for line in ocr_extraction._stream_pages("scan.pdf", ".pdf", upload)]
+    return asyncio.run(collect())
+
+
+def test_stream_sends_each_page_then_a_summary_and_closes_the_upload(ocr_extraction, fake_ocr, empty_cache):
+    upload = pdf_upload([png(200, 300), "Second page", png(210, 300)])
+    lines = stream_lines(ocr_extraction, upload)
+    assert [line.get("page") for line in lines[:3]] == [1, 2, 3]
+    assert lines[0]["text"].strip() == "image 200x300"
+    assert all(line["elapsed_ms"] >= 0 and line["page_ms"] >= 0 for line in lines[:3])
+    assert lines[3]["done"] and lines[3]["page_count"] == 3 and not lines[3]["cached"]
+    assert lines[3]["ocr_timings_ms"]["ocr"] == 2.0
+    # The stream owns the upload and deletes it when it ends
+    assert upload.path is None and upload._buffer is None
+
+
+def test_stream_of_a_repeated_document_is_served_from_the_cache(ocr_extraction, fake_ocr, empty_cache):
+    document = pdf_bytes([png(200, 300), "Second page"])
+    first = stream_lines(ocr_extraction, pdf_upload(document))
+    calls = len(fake_ocr.calls)
+    second = stream_lines(ocr_extraction, pdf_upload(document))
+    assert len(fake_ocr.calls) == calls
+    assert second[-1]["cached"]
+    assert [line.get("text") for line in second[:-1]] == [line.get("text") for line in first[:-1]]
+
+
+def test_stream_reports_an_unreadable_document_as_an_error_line(ocr_extraction, fake_ocr, empty_cache):
+    upload = SpooledUpload(suffix=".pdf")
+    upload.write(b"not a pdf")
+    upload.finish()
+    lines = stream_lines(ocr_extraction, upload)
+    assert lines == [{"error": lines[0]["error"], "page_count": 0}]
+
+
+def test_image_repeated_across_pages_is_ocred_once(ocr_extraction, fake_ocr):
+    doc = fitz.open()
+    logo_xref = None
+    for number in range(3):
+        page = doc.new_page()
+        if logo_xref is None:
+            logo_xref = page.insert_image(fitz.Rect(0, 0, 300, 300), stream=png(250, 250))
+        else:
+            page.insert_image(fitz.Rect(0, 0, 300, 300), xref=logo_xref)
+        page.insert_image(fitz.Rect(0, 400, 300, 700), stream=png(200 + number, 300, shade=number))
+        # Decoration: too small to carry text
+        page.insert_image(fitz.Rect(0, 750, 10, 760), stream=png(8, 8))
+    upload = pdf_upload(doc.tobytes())
+    doc.close()
+
+    async def texts():
+        return [text async for _, text in ocr_extraction.iter_pdf_pages(upload)]
+
+    pages = asyncio.run(texts())
+    assert len(fake_ocr.calls) == 1 + 3
+    for number, text in enumerate(pages):
+        assert "image 250x250" in text
+        assert f"image {200 + number}x300" in text
+        assert "image 8x8" not in text
+    upload.close()
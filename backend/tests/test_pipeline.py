@@ -0,0 +1,86 @@
+import asyncio
+import json
+import pytest
+
+
+@pytest.fixture
+def pipeline(vector_database):
+    import pipeline
+    return pipeline
+
+
+def fake_pipeline(pipeline, fail=()):
+    """An AnalysisPipeline whose stages record when they run instead of calling the LLM or the database"""
+
+    class FakePipeline(pipeline.AnalysisPipeline):
+        def __init__(self, **kwargs):
+            super().__init__(None, "English", text="report text", **kwargs)
+            self.started = []
+            self.text_stored = asyncio.Event()
+
+        async def _stage(self, name):
+            self.started.append(name)
+            await asyncio.sleep(0)
+            if name in fail:
+                raise RuntimeError(f"{name} broke")
+            return {"stage": name}
+
+        async def domain(self):
+            result = await self._stage("domain")
+            # Finishes only once store_text has run, so the two must run concurrently
+            await asyncio.wait_for(self.text_stored.wait(), 5)
+            return result
+
+        async def store_text(self):
+            result = await self._stage("store_text")
+            self.text_stored.set()
+            return result
+
+        async def insights(self):
+            return await self._stage("insights")
+
+        async def suggestions(self):
+            return await self._stage("suggestions")
+
+        async def store_results(self):
+            return await self._stage("store_results")
+
+    return FakePipeline
+
+
+def run(pipeline):
+    async def collect():
+        return [event async for event in pipeline.run()]
+    return asyncio.run(collect())
+
+
+def test_stages_run_after_their_dependencies_and_independent_ones_overlap(pipeline):
+    analysis = fake_pipeline(pipeline)()
+    events = run(analysis)
+    assert all(event["status"] == "done" for event in events)
+    order = [event["stage"] for event in events]
+    assert order[0] == "extract"
+    assert order.index("store_text") < order.index("domain") < order.index("insights")
+    assert order.index("insights") < order.index("suggestions") < order.index("store_results")
+    assert analysis.results["extract"]["text"] == "report text"
+    assert set(analysis.timings) == set(order)
+
+
+def test_failed_stage_skips_only_the_stages_that_depend_on_it(pipeline):
+    analysis = fake_pipeline(pipeline, fail={"insights"})()
+    statuses = {event["stage"]: event["status"] for event in run(analysis)}
+    assert statuses == {"extract": "done", "domain": "done", "store_text": "done", "insights": "error",
+                        "suggestions": "skipped", "store_results": "skipped"}
+    assert "suggestions" not in analysis.started
+
+
+def test_stream_ends_with_a_summary_line(pipeline):
+    analysis = fake_pipeline(pipeline)()
+
+    async def collect():
+        return [json.loads(line) async for line in analysis.stream()]
+
+    lines = asyncio.run(collect())
+    assert len(lines) == 7
+    assert lines[-1]["done"] is True
+    assert set(lines[-1]["stage_ms"]) == {line["stage"] for line in lines[:-1]}
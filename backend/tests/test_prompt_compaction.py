@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.fixture
+def prompt_compaction(vector_database):
+    import prompt_compaction
+    return prompt_compaction
+
+
+def pdf_text(*pages):
+    return "".join(f"{page}\n--- End of Page {number} ---\n" for number, page in enumerate(pages, 1))
+
+
+TOPICS = ["revenue", "costs", "hiring", "outlook", "risks", "dividends"]
+
+
+def body(number):
+    """Six body lines that differ in words, not only in numbers, from page to page"""
+    return "\n".join(f"Page {number} discusses {TOPICS[(number + line) % 6]} and {TOPICS[line]}." for line in range(6))
+
+
+def test_repeated_headers_and_footers_are_removed(prompt_compaction):
+    text = pdf_text(*[f"ACME Corp Annual Report\n{body(n)}\nPage {n} of 4" for n in range(1, 5)])
+    stripped = prompt_compaction.strip_boilerplate(text)
+    assert "ACME Corp" not in stripped
+    assert "of 4" not in stripped
+    assert "End of Page" not in stripped
+    assert body(3) in stripped
+
+
+def test_body_line_repeating_a_header_is_kept(prompt_compaction):
+    pages = [f"ACME Corp Annual Report\n{body(n)}\nPage {n} of 4" for n in range(1, 5)]
+    # A line from the middle of page 2
+    pages[1] = pages[1].replace("Page 2 discusses dividends and outlook.", "ACME Corp Annual Report")
+    stripped = prompt_compaction.strip_boilerplate(pdf_text(*pages))
+    assert stripped.count("ACME Corp Annual Report") == 1
+
+
+@pytest.mark.parametrize("short_page", ["ACME Corp Annual Report", "ACME Corp Annual Report\nPage 5 of 5"])
+def test_short_page_offers_its_first_and_last_line(prompt_compaction, short_page):
+    assert prompt_compaction._edge_lines(short_page) == set(range(len(short_page.splitlines())))
+    pages = [f"ACME Corp Annual Report\n{body(n)}\nPage {n} of 5" for n in range(1, 5)] + [short_page]
+    stripped = prompt_compaction.strip_boilerplate(pdf_text(*pages))
+    assert "ACME Corp" not in stripped
+    assert "of 5" not in stripped
+
+
+def test_short_page_with_unrepeated_text_is_kept(prompt_compaction):
+    pages = [f"ACME Corp Annual Report\n{body(n)}\nPage {n} of 5" for n in range(1, 5)] + ["Thank you for reading"]
+    assert prompt_compaction.strip_boilerplate(pdf_text(*pages)).endswith("Thank you for reading")
+
+
+def test_edge_lines_take_at_most_a_third_of_a_page(prompt_compaction):
+    page = "\n".join(f"line {n}" for n in range(6))
+    assert prompt_compaction._edge_lines(page) == {0, 1, 4, 5}
+    assert prompt_compaction._edge_lines("\n\n") == set()
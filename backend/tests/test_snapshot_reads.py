@@ -0,0 +1,102 @@
+import asyncio
+import json
+import threading
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from conftest import items, top_content
+from models import QueryInput
+from vector_index import IndexSnapshot, build_index
+
+
+def test_published_snapshot_is_unaffected_by_later_inserts(vector_database, open_database):
+    db = open_database()
+    assert db.add_vectors(items("alpha", "beta"))
+    snapshot = db.index
+    assert db.add_vectors(items(*(f"later {i}" for i in range(2000))))
+    assert snapshot.ntotal == 2
+    _, ids = snapshot.search(db.embed(["later 5"]), 5)
+    assert set(ids[0]) <= {0, 1, -1}
+    assert db.index.ntotal == 2002
+
+
+def test_snapshot_search_merges_base_and_recent_vectors():
+    vectors = np.random.default_rng(0).standard_normal((300, 16)).astype("float32")
+    snapshot = IndexSnapshot(build_index("flat", vectors[:200], 16), 16)
+    for start in range(200, 300, 25):
+        snapshot = snapshot.appended(vectors[start:start + 25])
+    queries = vectors[::30] + 0.01
+    expected_distances, expected_ids = build_index("flat", vectors, 16).search(queries, 4)
+    distances, ids = snapshot.search(queries, 4)
+    assert np.array_equal(ids, expected_ids)
+    assert np.allclose(distances, expected_distances, rtol=1e-4)
+    assert np.allclose(snapshot.reconstruct(190, 210), vectors[190:210])
+
+
+def test_rag_query_holds_no_lock_while_the_llm_answers(vector_database, open_database, monkeypatch):
+    db = open_database()
+    assert db.add_vectors(items("alpha"))
+    monkeypatch.setattr(vector_database, "vector_db", db)
+
+    async def chat_completion(prompt, request=None, priority=None):
+        # A write while the answer is pending would deadlock if the query still held vector_db_lock
+        assert not vector_database.vector_db_lock.locked()
+        assert await run_in_threadpool(db.add_vectors, items("written meanwhile"))
+        return json.dumps({"response": "An answer"})
+
+    monkeypatch.setattr(vector_database, "chat_completion", chat_completion)
+    result = asyncio.run(asyncio.wait_for(vector_database.query_vector_db(QueryInput(query="alpha"), None), 10))
+    assert result["response"] == "An answer"
+    assert top_content(db, "written meanwhile") == "written meanwhile"
+
+
+def test_concurrent_append_search_and_checkpoint(vector_database, open_database):
+    db = open_database()
+    assert db.add_vectors(items(*(f"seed {i}" for i in range(50))))
+    errors = []
+    stop = threading.Event()
+
+    def guarded(work):
+        def run():
+            try:
+                work()
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+        return threading.Thread(target=run)
+
+    def write(writer):
+        for batch in range(40):
+            if not db.add_vectors(items(*(f"writer {writer} batch {batch} item {i}" for i in range(5)))):
+                raise AssertionError("insert failed")
+
+    def read():
+        while not stop.is_set():
+            index = db.index
+            _, ids = index.search(db.embed(["seed 7"]), 5)
+            assert ids[0][0] == 7
+            assert ids.max() < index.ntotal
+            assert db.metadata.get_many([7])[7]["content"] == "seed 7"
+
+    def checkpoint():
+        while not stop.is_set():
+            db.checkpoint()
+
+    writers = [guarded(lambda writer=writer: write(writer)) for writer in range(3)]
+    others = [guarded(read) for _ in range(3)] + [guarded(checkpoint)]
+    for thread in writers + others:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in others:
+        thread.join()
+
+    assert not errors, errors
+    total = 50 + 3 * 40 * 5
+    assert db.index.ntotal == total
+    assert db.metadata.count() == total
+    db.close()
+
+    reopened = open_database()
+    assert reopened.index.ntotal == total
+    assert top_content(reopened, "writer 2 batch 39 item 4") == "writer 2 batch 39 item 4"
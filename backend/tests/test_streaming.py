@@ -0,0 +1,96 @@
+import asyncio
+import json
+import pytest
+
+DOCUMENT = ('Here is the analysis:\n```json\n{"summary": "Costs {rose} by \\"10%\\"", "score": 0.75, '
+            '"detailed_insights": [{"title": "A", "tags": ["x", "y"]}, {"title": "B ] }", "tags": []}], '
+            '"flag": true}\n```\nHope this helps {not json}')
+
+WATCH = [("summary",), ("score",), ("detailed_insights", "*"), ("flag",)]
+EXPECTED = [
+    (("summary",), 'Costs {rose} by "10%"'),
+    (("score",), 0.75),
+    (("detailed_insights", 0), {"title": "A", "tags": ["x", "y"]}),
+    (("detailed_insights", 1), {"title": "B ] }", "tags": []}),
+    (("flag",), True),
+]
+
+
+@pytest.fixture
+def streaming(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import streaming
+    return streaming
+
+
+def test_values_are_reported_once_complete_however_the_text_is_split(streaming):
+    whole = streaming.IncrementalJSONParser(WATCH).feed(DOCUMENT)
+    assert whole == EXPECTED
+
+    parser = streaming.IncrementalJSONParser(WATCH)
+    seen = []
+    for c in DOCUMENT:
+        seen.extend(parser.feed(c))
+    assert seen == EXPECTED
+
+
+def test_unwatched_paths_and_malformed_values_are_skipped(streaming):
+    parser = streaming.IncrementalJSONParser([("items", "*")])
+    assert parser.feed('{"other": [1, 2], "items": [1, nope, {"a": [3]}]}') == [
+        (("items", 0), 1), (("items", 2), {"a": [3]})
+    ]
+
+
+def test_whole_document_can_be_watched(streaming):
+    parser = streaming.IncrementalJSONParser([()])
+    assert parser.feed('[1, {"a"') == []
+    assert parser.feed(': 2}] trailing') == [((), [1, {"a": 2}])]
+    assert parser.feed('[3]') == []
+
+
+def events(stream):
+    async def collect():
+        return [chunk async for chunk in stream]
+
+    parsed = []
+    for chunk in asyncio.run(collect()):
+        name, data = chunk.strip().split("\n")
+        parsed.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return parsed
+
+
+def fake_completion(streaming, monkeypatch, pieces):
+    forgotten = []
+
+    async def stream_chat_completion(prompt):
+        for piece in pieces:
+            yield piece
+
+    async def forget_completion(prompt):
+        forgotten.append(prompt)
+
+    monkeypatch.setattr(streaming, "stream_chat_completion", stream_chat_completion)
+    monkeypatch.setattr(streaming, "forget_completion", forget_completion)
+    return forgotten
+
+
+def test_stream_sends_tokens_watched_values_and_the_parsed_result(streaming, monkeypatch):
+    forgotten = fake_completion(streaming, monkeypatch, ['{"insights": [{"t": 1}', ', {"t": 2}]}'])
+    watch = {("insights", "*"): "insight"}
+    sent = events(streaming.stream_json_completion("prompt", watch, json.loads))
+    assert sent == [
+        ("token", {"delta": '{"insights": [{"t": 1}'}),
+        ("insight", {"path": ["insights", 0], "value": {"t": 1}}),
+        ("token", {"delta": ', {"t": 2}]}'}),
+        ("insight", {"path": ["insights", 1], "value": {"t": 2}}),
+        ("result", {"insights": [{"t": 1}, {"t": 2}]}),
+    ]
+    assert forgotten == []
+
+
+def test_invalid_result_is_reported_and_not_kept_in_the_cache(streaming, monkeypatch):
+    forgotten = fake_completion(streaming, monkeypatch, ['{"insights": [', 'oops'])
+    sent = events(streaming.stream_json_completion("prompt", {("insights", "*"): "insight"}, json.loads))
+    assert sent[-1][0] == "error"
+    assert sent[-1][1]["status_code"] == 422
+    assert forgotten == ["prompt"]
@@ -0,0 +1,84 @@
+import asyncio
+import hashlib
+import io
+import os
+import fitz
+import pytest
+from fastapi import HTTPException, UploadFile
+from starlette.requests import ClientDisconnect
+import uploads
+from uploads import SpooledUpload, UploadStreamingResponse, spool_file, spool_upload
+
+
+def test_small_upload_stays_in_memory():
+    upload = spool_file(io.BytesIO(b"hello"), "note.pdf", memory_limit=1024)
+    assert upload.path is None
+    assert upload.source == b"hello"
+    assert upload.sha256 == hashlib.sha256(b"hello").hexdigest()
+    upload.close()
+
+
+def test_large_upload_spills_to_disk_and_is_deleted_on_close():
+    data = os.urandom(3 * uploads.UPLOAD_CHUNK_SIZE + 17)
+    upload = spool_file(io.BytesIO(data), "scan.pdf", memory_limit=1024)
+    assert upload.path is not None and upload.path.endswith(".pdf")
+    assert upload.size == len(data)
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+    with upload.open() as f:
+        assert f.read() == data
+    path = upload.path
+    upload.close()
+    assert not os.path.exists(path)
+    upload.close()
+
+
+def test_spilled_pdf_is_opened_from_its_path():
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Spilled page")
+    data = doc.tobytes()
+    doc.close()
+    upload = spool_file(io.BytesIO(data), "doc.pdf", memory_limit=16)
+    with upload.open_pdf() as pdf:
+        assert pdf.name == upload.path
+        assert "Spilled page" in pdf[0].get_text()
+    upload.close()
+
+
+def test_upload_over_the_limit_is_refused(monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_MB", 1)
+    file = UploadFile(io.BytesIO(bytes(2 * 1024 * 1024)), filename="big.pdf")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(spool_upload(file, memory_limit=1024))
+    assert error.value.status_code == 413
+
+
+def test_from_path_leaves_the_callers_file_in_place(tmp_path):
+    path = tmp_path / "kept.pdf"
+    path.write_bytes(b"%PDF")
+    upload = SpooledUpload.from_path(str(path))
+    assert upload.sha256 == hashlib.sha256(b"%PDF").hexdigest()
+    upload.close()
+    assert path.exists()
+
+
+def test_streaming_response_closes_its_upload_when_the_body_never_starts():
+    upload = spool_file(io.BytesIO(b"x" * 100), "scan.pdf", memory_limit=16)
+    path = upload.path
+    started = []
+
+    async def body():
+        started.append(True)
+        yield b"never sent"
+
+    async def send(message):
+        raise OSError("client went away")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    response = UploadStreamingResponse(body(), upload)
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(response(scope, receive, send))
+    assert not started
+    assert not os.path.exists(path)
@@ -0,0 +1,38 @@
+import os
+import numpy as np
+from conftest import crash, items, top_content
+
+
+def test_replay_stops_at_torn_or_zeroed_tail(vector_database, open_database):
+    db = open_database()
+    assert db.add_vectors(items("alpha", "beta"))
+    assert db.add_vectors(items("gamma"))
+    crash(db)
+    wal_path = vector_database.WAL_PATH
+    with open(wal_path, "rb") as f:
+        logged = f.read()
+
+    # What delayed allocation leaves after a power loss, then a record cut off mid-payload
+    for tail in (b"\0" * 64, vector_database.encode_wal_record(3, np.ones((1, 384), dtype="float32"), [{}])[:-10]):
+        with open(wal_path, "wb") as f:
+            f.write(logged + tail)
+        records, valid_bytes = vector_database.read_wal(wal_path)
+        assert valid_bytes == len(logged)
+        assert [len(embeddings) for _, embeddings, _ in records] == [2, 1]
+
+        reopened = open_database()
+        assert reopened.index.ntotal == 3
+        assert top_content(reopened, "gamma") == "gamma"
+        # The torn tail is cut off, so the next record lands where replay will find it
+        assert os.path.getsize(wal_path) == len(logged)
+        reopened.close()
+
+
+def test_clear_resets_the_log_position(vector_database, open_database):
+    db = open_database()
+    assert db.add_vectors(items("alpha", "beta"))
+    db.clear()
+    assert db.wal_stats()["wal_bytes"] == 0
+    assert db.add_vectors(items("gamma"))
+    db._wal.flush()
+    assert db.wal_stats()["wal_bytes"] == os.path.getsize(vector_database.WAL_PATH)
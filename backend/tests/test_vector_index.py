@@ -0,0 +1,94 @@
+import threading
+import time
+import numpy as np
+import pytest
+import vector_index
+from conftest import items, top_content
+
+
+def random_vectors(count, dimension=32, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dimension)).astype("float32")
+
+
+def test_tiers_are_sorted_start_flat_and_give_ivf_enough_vectors():
+    assert vector_index.parse_tiers("hnsw:5000,ivf:10") == [(0, "flat"), (vector_index.IVF_MIN_VECTORS, "ivf"),
+                                                            (5000, "hnsw")]
+    with pytest.raises(ValueError):
+        vector_index.parse_tiers("flat:0,annoy:100")
+
+
+def test_kind_follows_the_configured_tiers(monkeypatch):
+    monkeypatch.setattr(vector_index, "TIERS", vector_index.parse_tiers("flat:0,ivf:2000,ivfpq:100000"))
+    assert vector_index.kind_for_size(0) == "flat"
+    assert vector_index.kind_for_size(1999) == "flat"
+    assert vector_index.kind_for_size(2000) == "ivf"
+    assert vector_index.kind_for_size(10 ** 6) == "ivfpq"
+
+
+@pytest.mark.parametrize("kind", ["ivf", "hnsw"])
+def test_approximate_index_finds_what_flat_finds(kind):
+    vectors = random_vectors(3000)
+    queries = vectors[:50] + 0.01 * random_vectors(50, seed=1)
+    exact = vector_index.build_index("flat", vectors, 32)
+    approximate = vector_index.build_index(kind, vectors, 32)
+    assert vector_index.index_kind(approximate) == kind
+    _, expected = exact.search(queries, 1)
+    _, found = vector_index.search(approximate, queries, 1, nprobe=8, ef_search=64)
+    assert (found == expected).mean() >= 0.9
+
+
+def test_small_ivfpq_falls_back_to_ivf_flat_and_reconstructs_in_order():
+    vectors = random_vectors(vector_index.IVF_MIN_VECTORS)
+    index = vector_index.build_index("ivfpq", vectors, 32)
+    # Too few vectors to train product quantization codebooks
+    assert vector_index.index_kind(index) == "ivf"
+    assert np.allclose(vector_index.reconstruct(index, 10, 20, 32), vectors[10:20])
+
+
+def test_search_parameters_match_the_index_kind():
+    assert vector_index.search_parameters(vector_index.build_index("flat", random_vectors(10), 32)) is None
+    ivf = vector_index.build_index("ivf", random_vectors(2000), 32)
+    assert vector_index.search_parameters(ivf, nprobe=3).nprobe == 3
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_clear_does_not_wait_for_a_tier_rebuild(vector_database, open_database, monkeypatch):
+    monkeypatch.setattr(vector_index, "TIERS", [(0, "flat"), (20, "hnsw")])
+    release = threading.Event()
+    build_index = vector_database.build_index
+
+    def slow_build_index(kind, vectors, dimension):
+        if kind != "flat":
+            release.wait(10)
+        return build_index(kind, vectors, dimension)
+
+    monkeypatch.setattr(vector_database, "build_index", slow_build_index)
+    db = open_database()
+    assert db.add_vectors(items(*(f"first {i}" for i in range(30))))
+    wait_for(lambda: db._rebuilding == "hnsw")
+
+    clearing = threading.Thread(target=db.clear)
+    clearing.start()
+    clearing.join(5)
+    assert not clearing.is_alive()
+    release.set()
+    wait_for(lambda: db._rebuilding is None)
+    assert db.index.ntotal == 0
+    assert db.index_tier == "flat"
+
+    # Without a clear the rebuilt base is published, with later inserts on top
+    release.clear()
+    assert db.add_vectors(items(*(f"second {i}" for i in range(30))))
+    wait_for(lambda: db._rebuilding == "hnsw")
+    assert db.add_vectors(items("late"))
+    release.set()
+    wait_for(lambda: db.index_tier == "hnsw")
+    assert db.index.kind == "hnsw"
+    assert db.index.ntotal == 31
+    assert top_content(db, "late") == "late"
@@ -0,0 +1,155 @@
+import hashlib
+import io
+import os
+import tempfile
+from typing import Any, BinaryIO, Optional, Union
+import fitz  # PyMuPDF
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.types import Receive, Scope, Send
+
+# Bytes of an upload kept in memory before it is spilled to a temp file on disk
+UPLOAD_MEMORY_LIMIT_MB = int(os.getenv("UPLOAD_MEMORY_LIMIT_MB", 8))
+# Largest accepted upload; 0 disables the limit
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", 0))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class SpooledUpload:
+    """An uploaded file held in memory up to a ceiling, then spilled to disk.
+
+    The SHA-256 digest is computed while the upload is copied, so the content
+    hash is available without a second pass over the data. Once spilled, the
+    document is opened from its path and parsers read only what they need.
+    """
+
+    def __init__(self, suffix: str = "", memory_limit: int = UPLOAD_MEMORY_LIMIT_MB * 1024 * 1024):
+        self.suffix = suffix
+        self.memory_limit = memory_limit
+        self.size = 0
+        self.path: Optional[str] = None
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file: Optional[BinaryIO] = None
+        self._hash = hashlib.sha256()
+        self._owned = True
+
+    @classmethod
+    def from_path(cls, path: str) -> "SpooledUpload":
+        """Wrap a file that is already on disk (blocking: it is hashed); close() leaves the file in place"""
+        upload = cls(suffix=os.path.splitext(path)[1].lower())
+        upload._buffer = None
+        upload.path = path
+        upload._owned = False
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                upload._hash.update(chunk)
+                upload.size += len(chunk)
+        return upload
+
+    def write(self, chunk: bytes):
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        if self._buffer is not None and self.size > self.memory_limit:
+            self._file = tempfile.NamedTemporaryFile(suffix=self.suffix, delete=False)
+            self.path = self._file.name
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer.write(chunk)
+
+    def finish(self):
+        """Flush and close the spill file so it can be reopened for reading"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    @property
+    def source(self) -> Union[str, bytes]:
+        """The spill file path, or the bytes themselves for small uploads"""
+        return self.path if self.path else self._buffer.getvalue()
+
+    def open(self) -> BinaryIO:
+        """A readable binary stream over the upload contents"""
+        if self.path:
+            return open(self.path, "rb")
+        return io.BytesIO(self._buffer.getvalue())
+
+    def open_pdf(self) -> fitz.Document:
+        if self.path:
+            return fitz.open(self.path, filetype="pdf")
+        return fitz.open(stream=self._buffer.getvalue(), filetype="pdf")
+
+    def close(self):
+        self.finish()
+        if self.path and self._owned and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self._buffer = None
+
+
+def _check_size(upload: SpooledUpload, chunk: bytes):
+    if UPLOAD_MAX_MB and upload.size + len(chunk) > UPLOAD_MAX_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_MB} MB limit")
+
+
+async def spool_upload(file: UploadFile, memory_limit: int = UPLOAD_MEMORY_LIMIT_MB * 1024 * 1024) -> SpooledUpload:
+    """Copy an UploadFile into a SpooledUpload in fixed-size chunks"""
+    upload = SpooledUpload(suffix=os.path.splitext(file.filename or "")[1].lower(), memory_limit=memory_limit)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            _check_size(upload, chunk)
+            await run_in_threadpool(upload.write, chunk)
+        await run_in_threadpool(upload.finish)
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+def spool_file(f: BinaryIO, filename: str, memory_limit: int = UPLOAD_MEMORY_LIMIT_MB * 1024 * 1024) -> SpooledUpload:
+    """Copy a blocking binary stream, such as a ZIP member, into a SpooledUpload"""
+    upload = SpooledUpload(suffix=os.path.splitext(filename)[1].lower(), memory_limit=memory_limit)
+    try:
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            _check_size(upload, chunk)
+            upload.write(chunk)
+        upload.finish()
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+class UploadStreamingResponse(StreamingResponse):
+    """A StreamingResponse that closes its body generator and then its upload once the response ends.
+
+    This also covers a client that disconnects before the body starts, when the generator never runs
+    and so its own cleanup never does.
+    """
+
+    def __init__(self, content: Any, upload: Optional[SpooledUpload], **kwargs):
+        super().__init__(content, **kwargs)
+        self.upload = upload
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            if self.upload is not None:
+                await run_in_threadpool(self.upload.close)
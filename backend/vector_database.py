@@ -2,123 +2,462 @@ import json
 import logging
 import os
 import pickle
+import shutil
+import struct
+import time
+import zlib
 import numpy as np
 import faiss
-import requests
-from threading import Lock
-from fastapi import APIRouter, HTTPException
+from threading import Event, Lock, Thread
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
 from sentence_transformers import SentenceTransformer
+from llm_client import chat_completion, forget_completion
+from llm_scheduler import PRIORITY_INTERACTIVE
+from streaming import sse_event, sse_response, stream_json_completion
 from models import VectorStoreInput, QueryInput
-from typing import Dict, Any, List
+from embedding_cache import EmbeddingCache, model_fingerprint
+from embedding_service import EmbeddingBatcher
+from metadata_store import MetadataStore
+from vector_index import IndexSnapshot, build_index, index_kind, kind_for_size, open_index
+from typing import Dict, Any, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["Vector Database"])  # Removed prefix="/vector-db"
 
-# Thread lock for vector database operations
+# Serializes writers (inserts, checkpoints, clear); searches read the published snapshot without it
 vector_db_lock = Lock()
 
 # Vector database file paths
 DATA_DIR = "data"
-VECTOR_DB_PATH = os.path.join(DATA_DIR, "vector_db.pkl")
 FAISS_INDEX_PATH = os.path.join(DATA_DIR, "faiss_index.bin")
+METADATA_DB_PATH = os.path.join(DATA_DIR, "vector_metadata.sqlite3")
+# Write-ahead log of inserts since the last checkpoint, and the segment a running checkpoint is folding in
+WAL_PATH = os.path.join(DATA_DIR, "vectors.wal")
+WAL_CHECKPOINT_PATH = WAL_PATH + ".checkpoint"
+# Pickled metadata written by earlier versions; moved into METADATA_DB_PATH once, then renamed
+LEGACY_METADATA_PATH = os.path.join(DATA_DIR, "vector_db.pkl")
+
+# Sentence-transformers model used for every embedding; changing it invalidates the embedding cache
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Seconds between background checkpoints, and WAL size that triggers one early
+VECTOR_DB_CHECKPOINT_SECONDS = float(os.getenv("VECTOR_DB_CHECKPOINT_SECONDS", 300))
+VECTOR_DB_CHECKPOINT_BYTES = int(os.getenv("VECTOR_DB_CHECKPOINT_BYTES", 64 * 1024 * 1024))
+# fsync each WAL append; turning it off risks losing the last inserts on power loss, not corruption
+VECTOR_DB_WAL_FSYNC = os.getenv("VECTOR_DB_WAL_FSYNC", "1") == "1"
+
+# WAL record header: payload length and CRC32; payload header: first vector id, vector count, dimension
+WAL_HEADER = struct.Struct("<II")
+WAL_RECORD = struct.Struct("<QII")
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# Replace with your actual Perplexity API key
-PERPLEXITY_API_KEY = "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"
-HEADERS = {
-    "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-    "Content-Type": "application/json"
-}
-PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
+
+def _write_atomic(path: str, data: bytes):
+    """Write to a temporary file, fsync it, then rename it over path"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _fsync_dir(path: str):
+    """Make renames in a directory durable (no-op where directories can't be opened)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def encode_wal_record(first_id: int, embeddings: np.ndarray, metadata: List[Any]) -> bytes:
+    payload = (WAL_RECORD.pack(first_id, len(embeddings), embeddings.shape[1]) + embeddings.tobytes()
+               + json.dumps(metadata, default=str).encode("utf-8"))
+    return WAL_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_wal(path: str) -> Tuple[List[Tuple[int, np.ndarray, List[Any]]], int]:
+    """Return the complete (first_id, embeddings, metadata) records in a WAL file and the byte length they cover.
+
+    Reading stops at the first torn or corrupt record, which is what a crash mid-append leaves behind.
+    That includes a zero-filled tail (delayed allocation after a power loss): its empty payload passes
+    the CRC check, so lengths are checked against the record header too.
+    """
+    records = []
+    valid_bytes = 0
+    if not os.path.exists(path):
+        return records, valid_bytes
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(WAL_HEADER.size)
+            if len(header) < WAL_HEADER.size:
+                break
+            length, checksum = WAL_HEADER.unpack(header)
+            payload = f.read(length)
+            if length < WAL_RECORD.size or len(payload) < length or zlib.crc32(payload) != checksum:
+                logger.warning(f"Ignoring torn record at byte {valid_bytes} of {path}")
+                break
+            first_id, count, dimension = WAL_RECORD.unpack_from(payload)
+            vectors_end = WAL_RECORD.size + count * dimension * 4
+            try:
+                if count == 0 or vectors_end > length:
+                    raise ValueError(f"{count} x {dimension} vectors don't fit a {length} byte record")
+                metadata = json.loads(payload[vectors_end:])
+            except ValueError as e:
+                logger.warning(f"Ignoring corrupt record at byte {valid_bytes} of {path}: {str(e)}")
+                break
+            embeddings = np.frombuffer(payload[WAL_RECORD.size:vectors_end], dtype="float32").reshape(count, dimension)
+            records.append((first_id, embeddings, metadata))
+            valid_bytes += WAL_HEADER.size + length
+    return records, valid_bytes
+
 
 class VectorDatabase:
-    """Improved vector database class with proper state management"""
+    """Improved vector database class with proper state management.
+
+    Inserts are appended to a write-ahead log, their metadata to a SQLite store, and their vectors to
+    an in-memory array, so their cost depends on the batch, not the database. A background
+    thread checkpoints the index with an atomic rename and starts a fresh log. On startup the last
+    checkpoint is memory-mapped (not read) and only the log is replayed, so cold start does not
+    grow with the corpus; search hits load their metadata rows by id.
+
+    The index kind follows VECTOR_INDEX_TIERS: when the database grows into the next tier, the next
+    checkpoint trains the new index from the current vectors instead of appending to the old one.
+
+    ``index`` is an immutable IndexSnapshot. Searches take a reference to it and need no lock; writers
+    hold vector_db_lock and publish a new snapshot by assignment once WAL and metadata are written.
+    """
     
     def __init__(self, dimension: int = 384):
         self.dimension = dimension
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.index = faiss.IndexFlatL2(dimension)
-        self.stored_data = []
+        self.model = SentenceTransformer(EMBEDDING_MODEL)
+        self.embedding_cache = EmbeddingCache("embeddings", model_fingerprint(EMBEDDING_MODEL, self.model.encode), dimension)
+        self.embedding_batcher = EmbeddingBatcher(self.model.encode)
+        self.metadata = MetadataStore(METADATA_DB_PATH)
+        self.index = self._empty_index()
+        # Tier the base index was built for (a small "ivfpq" database may hold an IVF-Flat index)
+        self.index_tier = kind_for_size(0)
+        self._rebuilding: Optional[str] = None
+        # Bumped on every change, so checkpoints can tell whether there is anything to write
+        self.version = 0
+        self.checkpoint_version = 0
+        # Bumped by clear(), so a rebuild started before it is not published
+        self.generation = 0
+        self.last_checkpoint_at: Optional[float] = None
+        self._checkpoint_lock = Lock()
+        self._closed = Event()
+        self._checkpoint_requested = Event()
         self.load_database()
-    
-    def save_database(self):
-        """Save the vector database to disk"""
-        try:
-            faiss.write_index(self.index, FAISS_INDEX_PATH)
-            with open(VECTOR_DB_PATH, 'wb') as f:
-                pickle.dump(self.stored_data, f)
-            logger.info(f"Saved vector database with {len(self.stored_data)} items")
-        except Exception as e:
-            logger.error(f"Error saving database: {str(e)}")
-            raise
+        self._wal = open(WAL_PATH, "ab")
+        self._checkpointer = Thread(target=self._checkpoint_loop, name="vector-db-checkpoint", daemon=True)
+        self._checkpointer.start()
+        self._maybe_migrate()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as float32 rows, through the embedding cache; misses are batched with concurrent callers (blocking)"""
+        return self.embedding_cache.encode(texts, self.embedding_batcher.encode)
+
+    def _empty_index(self) -> IndexSnapshot:
+        base = build_index(kind_for_size(0), np.zeros((0, self.dimension), dtype="float32"), self.dimension)
+        return IndexSnapshot(base, self.dimension)
     
     def load_database(self):
-        """Load the vector database from disk"""
+        """Open the last checkpoint memory-mapped and replay the write-ahead log on top of it"""
         try:
-            if os.path.exists(FAISS_INDEX_PATH) and os.path.exists(VECTOR_DB_PATH):
-                self.index = faiss.read_index(FAISS_INDEX_PATH)
-                with open(VECTOR_DB_PATH, 'rb') as f:
-                    self.stored_data = pickle.load(f)
-                logger.info(f"Loaded vector database with {len(self.stored_data)} items")
+            self._migrate_legacy_metadata()
+            if os.path.exists(FAISS_INDEX_PATH):
+                kind = self.metadata.get_state("index_kind") or "flat"
+                base, mapped = open_index(FAISS_INDEX_PATH, kind)
+                self.index = IndexSnapshot(base, self.dimension, FAISS_INDEX_PATH, mapped)
+                self.index_tier = self.metadata.get_state("index_tier") or index_kind(base)
+                logger.info(f"Opened vector index with {base.ntotal} vectors ({'memory-mapped' if mapped else 'in memory'})")
             else:
                 logger.info("No existing database found, starting fresh")
+            replayed = self._replay_wal()
+            if replayed:
+                logger.info(f"Replayed {replayed} write-ahead log records, database has {self.index.ntotal} items")
+            # Drop metadata whose vectors never made it into the log (crash between the two writes)
+            self.metadata.truncate(self.index.ntotal)
         except Exception as e:
             logger.error(f"Error loading database: {str(e)}")
-            self.index = faiss.IndexFlatL2(self.dimension)
-            self.stored_data = []
+            self._set_aside_unreadable()
+            self.index = self._empty_index()
+            self.index_tier = kind_for_size(0)
+            # New vectors start at id 0 again, so no old row may be read back as their metadata
+            self.metadata.clear()
+
+    def _set_aside_unreadable(self):
+        """Rename the index and log files that failed to load, so they are kept for inspection but never replayed
+        over the fresh database"""
+        for path in (FAISS_INDEX_PATH, WAL_CHECKPOINT_PATH, WAL_PATH):
+            if os.path.exists(path):
+                os.replace(path, path + ".corrupt")
+                logger.warning(f"Moved unreadable {path} to {path}.corrupt")
+
+    def _migrate_legacy_metadata(self):
+        """Move metadata from the pickle earlier versions wrote into the SQLite store (once)"""
+        if not os.path.exists(LEGACY_METADATA_PATH) or self.metadata.count():
+            return
+        with open(LEGACY_METADATA_PATH, 'rb') as f:
+            state = pickle.load(f)
+        stored_data = state if isinstance(state, list) else state["stored_data"]
+        self.metadata.add(0, stored_data)
+        os.replace(LEGACY_METADATA_PATH, LEGACY_METADATA_PATH + ".migrated")
+        logger.info(f"Migrated {len(stored_data)} metadata items from {LEGACY_METADATA_PATH}")
+
+    def _replay_wal(self) -> int:
+        replayed = 0
+        for path in (WAL_CHECKPOINT_PATH, WAL_PATH):
+            records, valid_bytes = read_wal(path)
+            for first_id, embeddings, metadata in records:
+                if first_id + len(embeddings) <= self.index.ntotal:
+                    # Already in the checkpoint
+                    continue
+                if first_id != self.index.ntotal:
+                    logger.error(f"Write-ahead log gap in {path}: expected id {self.index.ntotal}, found {first_id}")
+                    break
+                self.metadata.add(first_id, metadata, replace=False)
+                self.index = self.index.appended(embeddings)
+                replayed += 1
+            if path == WAL_PATH and os.path.exists(path) and os.path.getsize(path) > valid_bytes:
+                # Drop the torn tail so new records aren't appended after it
+                with open(path, "r+b") as f:
+                    f.truncate(valid_bytes)
+        self.version += replayed
+        return replayed
+
+    def _append_wal(self, first_id: int, embeddings: np.ndarray, metadata: List[Any]) -> int:
+        """Durably log one insert before it is applied and return the offset it starts at; the caller holds vector_db_lock"""
+        start = self._wal.tell()
+        try:
+            self._wal.write(encode_wal_record(first_id, embeddings, metadata))
+            self._wal.flush()
+            if VECTOR_DB_WAL_FSYNC:
+                os.fsync(self._wal.fileno())
+        except Exception:
+            self._truncate_wal(start)
+            raise
+        if self._wal.tell() >= VECTOR_DB_CHECKPOINT_BYTES:
+            self._checkpoint_requested.set()
+        return start
+
+    def _truncate_wal(self, offset: int):
+        """Cut the log back to offset; truncating doesn't move the file position, so seek back too"""
+        self._wal.truncate(offset)
+        self._wal.seek(offset)
+
+    def _rotate_wal(self):
+        """Move the current log aside for a checkpoint and start an empty one; the caller holds vector_db_lock"""
+        self._wal.close()
+        if os.path.exists(WAL_CHECKPOINT_PATH):
+            # An earlier checkpoint failed: keep its records in front of the new ones
+            with open(WAL_CHECKPOINT_PATH, "ab") as segment, open(WAL_PATH, "rb") as wal:
+                shutil.copyfileobj(wal, segment)
+            os.remove(WAL_PATH)
+        else:
+            os.replace(WAL_PATH, WAL_CHECKPOINT_PATH)
+        self._wal = open(WAL_PATH, "ab")
+
+    def _maybe_migrate(self):
+        """Ask for an early checkpoint if the database has grown into another index tier"""
+        if kind_for_size(self.index.ntotal) != self.index_tier:
+            self._checkpoint_requested.set()
+
+    def _rebuild(self) -> Optional[Tuple[faiss.Index, int, str, int]]:
+        """Train a base of the tier the database has grown into, if it has; returns the base, how many vectors
+        it holds, its tier and the clear generation it was built in.
+
+        Training takes minutes for large IVF-PQ indexes, so it holds no lock: inserts, clear() and shutdown
+        go on meanwhile, and checkpoint() drops the result if the database was cleared.
+        """
+        with vector_db_lock:
+            target = kind_for_size(self.index.ntotal)
+            if target == self.index_tier or self._closed.is_set():
+                return None
+            current = self.index
+            generation = self.generation
+            self._rebuilding = target
+        logger.info(f"Rebuilding vector index from {current.kind} to {target} with {current.ntotal} vectors")
+        try:
+            base = build_index(target, current.reconstruct(0, current.ntotal), self.dimension)
+        finally:
+            self._rebuilding = None
+        return base, current.ntotal, target, generation
+
+    def checkpoint(self, rebuild: bool = True) -> bool:
+        """Fold recent vectors into a new base index file and drop the log it covers; False if nothing changed.
+
+        Only taking the snapshot and publishing the next one happen under vector_db_lock, so inserts and
+        searches keep going while the new base is built and written. If the database is now in another tier
+        (and rebuild is set), the new base is first trained as that kind, outside _checkpoint_lock.
+        """
+        rebuilt = self._rebuild() if rebuild else None
+        with self._checkpoint_lock:
+            with vector_db_lock:
+                if self._wal.closed:
+                    # Shut down while the rebuild ran; the next start asks for it again
+                    return False
+                if rebuilt is not None and rebuilt[3] != self.generation:
+                    logger.info("Vector database was cleared during the index rebuild, discarding it")
+                    rebuilt = None
+                if (rebuilt is None and self.version == self.checkpoint_version
+                        and not os.path.exists(WAL_CHECKPOINT_PATH)):
+                    return False
+                current = self.index
+                version = self.version
+                self._rotate_wal()
+
+            started = time.time()
+            if rebuilt is not None:
+                base, covered, tier, _ = rebuilt
+            else:
+                base, covered, tier = current.writable_base(), current.base.ntotal, self.index_tier
+            base.add(current.reconstruct(covered, current.ntotal))
+            _write_atomic(FAISS_INDEX_PATH, faiss.serialize_index(base).tobytes())
+            _fsync_dir(DATA_DIR)
+            self.metadata.set_state("index_kind", index_kind(base))
+            self.metadata.set_state("index_tier", tier)
+            del base
+            reopened, mapped = open_index(FAISS_INDEX_PATH, self.metadata.get_state("index_kind"))
+
+            with vector_db_lock:
+                index = IndexSnapshot(reopened, self.dimension, FAISS_INDEX_PATH, mapped)
+                # Inserts made while the checkpoint was written stay on top of the new base
+                self.index = index.appended(self.index.reconstruct(current.ntotal, self.index.ntotal))
+                self.index_tier = tier
+            os.remove(WAL_CHECKPOINT_PATH)
+            self.checkpoint_version = version
+            self.last_checkpoint_at = time.time()
+            logger.info(f"Checkpointed vector index with {reopened.ntotal} vectors in {time.time() - started:.1f}s")
+            return True
+
+    def _checkpoint_loop(self):
+        while not self._closed.is_set():
+            self._checkpoint_requested.wait(VECTOR_DB_CHECKPOINT_SECONDS)
+            self._checkpoint_requested.clear()
+            if self._closed.is_set():
+                break
+            try:
+                self.checkpoint()
+            except Exception as e:
+                logger.error(f"Error checkpointing vector database: {str(e)}")
+
+    def close(self):
+        """Stop the checkpoint thread and write a final checkpoint in the current tier"""
+        if self._closed.is_set():
+            return
+        with vector_db_lock:
+            self._closed.set()
+            rebuilding = self._rebuilding is not None
+        self._checkpoint_requested.set()
+        if not rebuilding:
+            # A running tier rebuild is left to the daemon thread rather than waited for
+            self._checkpointer.join()
+        try:
+            self.checkpoint(rebuild=False)
+        finally:
+            self._wal.close()
+            self.embedding_batcher.close()
+            self.embedding_cache.flush()
+
+    def clear(self):
+        """Remove all vectors and metadata, the checkpoint file and the log"""
+        with self._checkpoint_lock, vector_db_lock:
+            self.index = self._empty_index()
+            self.index_tier = kind_for_size(0)
+            self.metadata.clear()
+            self._truncate_wal(0)
+            self.version += 1
+            self.checkpoint_version = self.version
+            self.generation += 1
+            for path in (FAISS_INDEX_PATH, WAL_CHECKPOINT_PATH):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def wal_stats(self) -> Dict[str, Any]:
+        return {
+            "wal_bytes": self._wal.tell(),
+            "vectors_since_checkpoint": self.index.count,
+            "last_checkpoint_at": self.last_checkpoint_at
+        }
+
+    def index_stats(self) -> Dict[str, Any]:
+        return {
+            "index_type": self.index.kind,
+            "index_tier": self.index_tier,
+            "memory_mapped": self.index.mapped,
+            "rebuilding_to": self._rebuilding
+        }
     
     def add_vectors(self, texts_with_metadata: List[tuple]) -> bool:
-        """Add vectors to the database with proper error handling"""
+        """Add vectors to the database with proper error handling (blocking; embeds before taking vector_db_lock)"""
         try:
             if not texts_with_metadata:
                 return False
             
             texts = [text for text, _ in texts_with_metadata]
-            embeddings = self.model.encode(texts)
-            embeddings = np.array(embeddings).astype('float32')
+            embeddings = self.embed(texts)
             
             if embeddings.shape[1] != self.dimension:
                 raise ValueError(f"Embedding dimension mismatch: expected {self.dimension}, got {embeddings.shape[1]}")
             
-            self.index.add(embeddings)
-            for _, metadata in texts_with_metadata:
-                self.stored_data.append(metadata)
+            metadata = [metadata for _, metadata in texts_with_metadata]
+            with vector_db_lock:
+                first_id = self.index.ntotal
+                wal_offset = self._append_wal(first_id, embeddings, metadata)
+                try:
+                    self.metadata.add(first_id, metadata)
+                    self.index = self.index.appended(embeddings)
+                except Exception:
+                    # Unlog the insert, or the next one would reuse first_id and replay would stop at it
+                    self._truncate_wal(wal_offset)
+                    self.metadata.truncate(first_id)
+                    raise
+                self.version += 1
             
-            if self.index.ntotal != len(self.stored_data):
-                logger.error(f"Index and metadata out of sync: {self.index.ntotal} vs {len(self.stored_data)}")
-                return False
-            
-            self.save_database()
             logger.info(f"Added {len(texts_with_metadata)} vectors to database")
+            self._maybe_migrate()
             return True
             
         except Exception as e:
             logger.error(f"Error adding vectors: {str(e)}")
             return False
     
-    def query_vectors(self, query_text: str, k: int = 5, distance_threshold: float = 2.0) -> Dict[str, Any]:
+    def query_vectors(self, query_text: str, k: int = 5, distance_threshold: float = 2.0,
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Dict[str, Any]:
         """Query vectors with improved error handling and results"""
         try:
             if not query_text.strip():
                 return {"results": [], "message": "Query cannot be empty"}
             
-            if self.index.ntotal == 0:
+            # One snapshot for the whole query, however many inserts or checkpoints publish meanwhile
+            index = self.index
+            if index.ntotal == 0:
                 return {"results": [], "message": "No data available in the vector database"}
             
-            query_embedding = self.model.encode([query_text]).astype('float32')
-            actual_k = min(k, self.index.ntotal)
-            distances, indices = self.index.search(query_embedding, actual_k)
+            query_embedding = self.embed([query_text])
+            actual_k = min(k, index.ntotal)
+            distances, indices = index.search(query_embedding, actual_k, nprobe, ef_search)
+            hits = [(int(idx), float(distance)) for idx, distance in zip(indices[0], distances[0]) if idx >= 0]
+            stored = self.metadata.get_many(idx for idx, _ in hits)
             
             results = []
-            for idx, distance in zip(indices[0], distances[0]):
-                if 0 <= idx < len(self.stored_data):
+            for idx, distance in hits:
+                if idx in stored:
                     results.append({
-                        "content": self.stored_data[idx],
-                        "distance": float(distance),
-                        "similarity_score": 1.0 / (1.0 + float(distance))
+                        "content": stored[idx],
+                        "distance": distance,
+                        "similarity_score": 1.0 / (1.0 + distance)
                     })
             
             results.sort(key=lambda x: x["distance"])
@@ -128,14 +467,16 @@ class VectorDatabase:
                 return {
                     "results": [], 
                     "message": f"No relevant results found within similarity threshold (distance <= {distance_threshold})",
-                    "total_vectors": self.index.ntotal,
+                    "total_vectors": index.ntotal,
+                    "index_type": index.kind,
                     "searched_vectors": actual_k
                 }
             
             return {
                 "results": filtered_results,
                 "message": f"Found {len(filtered_results)} relevant results",
-                "total_vectors": self.index.ntotal,
+                "total_vectors": index.ntotal,
+                "index_type": index.kind,
                 "searched_vectors": actual_k
             }
             
@@ -146,26 +487,14 @@ class VectorDatabase:
 # Initialize global vector database
 vector_db = VectorDatabase()
 
-def call_perplexity_api(prompt: str) -> str:
+def shutdown_vector_db():
+    """Checkpoint the vector database (called on application shutdown)"""
+    vector_db.close()
+
+async def call_perplexity_api(prompt: str, request: Optional[Request] = None) -> str:
     """Call the Perplexity API with the given prompt"""
-    payload = {
-        "model": "sonar-pro",
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
     try:
-        response = requests.post(PERPLEXITY_API_URL, headers=HEADERS, json=payload)
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Perplexity API error: {response.text}"
-            )
-        response_json = response.json()
-        content = response_json.get("choices", [{}])[0].get("message", {}).get("content", "")
-        if not content:
-            raise HTTPException(status_code=500, detail="Empty response from Perplexity API")
-        return content
+        return await chat_completion(prompt, request=request, priority=PRIORITY_INTERACTIVE)
     except Exception as e:
         logger.error(f"Perplexity API call failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Perplexity API call failed: {str(e)}")
@@ -188,121 +517,117 @@ def safe_json_parse(message_content: str) -> Dict[str, Any]:
             "error": str(je)
         })
 
-@router.post("/store-vector")
-async def store_in_vector_db(input: VectorStoreInput):
-    """Store data in the vector database"""
-    try:
-        with vector_db_lock:
-            texts_to_vectorize = []
-            
-            texts_to_vectorize.append((
-                input.text[:1000],
-                {
-                    "type": "input_text", 
-                    "content": input.text,
-                    "timestamp": str(np.datetime64('now'))
-                }
-            ))
-            
-            if input.domain_result and 'reason' in input.domain_result:
-                texts_to_vectorize.append((
-                    input.domain_result['reason'], 
-                    {
-                        "type": "domain_reason", 
-                        "content": input.domain_result,
-                        "timestamp": str(np.datetime64('now'))
-                    }
-                ))
-            
-            if input.insights_result and 'domain_summary' in input.insights_result:
+def build_vector_items(input: VectorStoreInput, include_text: bool = True) -> List[tuple]:
+    """Turn a store request into (text to embed, metadata) pairs"""
+    texts_to_vectorize = []
+    
+    if include_text:
+        texts_to_vectorize.append((
+            input.text[:1000],
+            {
+                "type": "input_text", 
+                "content": input.text,
+                "timestamp": str(np.datetime64('now'))
+            }
+        ))
+    
+    if input.domain_result and 'reason' in input.domain_result:
+        texts_to_vectorize.append((
+            input.domain_result['reason'], 
+            {
+                "type": "domain_reason", 
+                "content": input.domain_result,
+                "timestamp": str(np.datetime64('now'))
+            }
+        ))
+    
+    if input.insights_result and 'domain_summary' in input.insights_result:
+        texts_to_vectorize.append((
+            input.insights_result['domain_summary'], 
+            {
+                "type": "summary", 
+                "content": input.insights_result['domain_summary'],
+                "timestamp": str(np.datetime64('now'))
+            }
+        ))
+    
+    if input.insights_result and 'detailed_insights' in input.insights_result:
+        for i, insight in enumerate(input.insights_result['detailed_insights']):
+            if isinstance(insight, dict) and 'description' in insight:
                 texts_to_vectorize.append((
-                    input.insights_result['domain_summary'], 
+                    insight['description'], 
                     {
-                        "type": "summary", 
-                        "content": input.insights_result['domain_summary'],
+                        "type": "insight", 
+                        "content": insight,
+                        "insight_index": i,
                         "timestamp": str(np.datetime64('now'))
                     }
                 ))
-            
-            if input.insights_result and 'detailed_insights' in input.insights_result:
-                for i, insight in enumerate(input.insights_result['detailed_insights']):
-                    if isinstance(insight, dict) and 'description' in insight:
-                        texts_to_vectorize.append((
-                            insight['description'], 
-                            {
-                                "type": "insight", 
-                                "content": insight,
-                                "insight_index": i,
-                                "timestamp": str(np.datetime64('now'))
-                            }
-                        ))
-            
-            for i, suggestion in enumerate(input.suggestions):
-                if suggestion and isinstance(suggestion, str):
-                    texts_to_vectorize.append((
-                        suggestion, 
-                        {
-                            "type": "suggestion", 
-                            "content": suggestion,
-                            "suggestion_index": i,
-                            "timestamp": str(np.datetime64('now'))
-                        }
-                    ))
-            
-            if not texts_to_vectorize:
-                return {"message": "No valid data to store", "stored_count": 0}
-            
-            success = vector_db.add_vectors(texts_to_vectorize)
-            
-            if success:
-                return {
-                    "message": "Data stored successfully in vector database", 
-                    "stored_count": len(texts_to_vectorize),
-                    "total_vectors": vector_db.index.ntotal
+    
+    for i, suggestion in enumerate(input.suggestions):
+        if suggestion and isinstance(suggestion, str):
+            texts_to_vectorize.append((
+                suggestion, 
+                {
+                    "type": "suggestion", 
+                    "content": suggestion,
+                    "suggestion_index": i,
+                    "timestamp": str(np.datetime64('now'))
                 }
-            else:
-                raise HTTPException(status_code=500, detail="Failed to store data in vector database")
+            ))
+
+    return texts_to_vectorize
+
+def store_vector_items(texts_to_vectorize: List[tuple]) -> Dict[str, Any]:
+    """Embed and persist items (blocking, run it in a thread)"""
+    if not texts_to_vectorize:
+        return {"message": "No valid data to store", "stored_count": 0}
+
+    success = vector_db.add_vectors(texts_to_vectorize)
+    total_vectors = vector_db.index.ntotal
+
+    if success:
+        return {
+            "message": "Data stored successfully in vector database", 
+            "stored_count": len(texts_to_vectorize),
+            "total_vectors": total_vectors
+        }
+    raise HTTPException(status_code=500, detail="Failed to store data in vector database")
+
+@router.post("/store-vector")
+async def store_in_vector_db(input: VectorStoreInput):
+    """Store data in the vector database"""
+    try:
+        return await run_in_threadpool(store_vector_items, build_vector_items(input))
 
     except Exception as e:
         logger.error(f"Error storing in vector database: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to store in vector database: {str(e)}")
 
-@router.post("/query-vector")
-async def query_vector_db(input: QueryInput):
-    """Query the vector database and enhance with Perplexity API"""
-    if not input.query.strip():
-        raise HTTPException(status_code=400, detail="Query cannot be empty")
-
-    try:
-        with vector_db_lock:
-            query_result = vector_db.query_vectors(
-                input.query, 
-                k=input.k, 
-                distance_threshold=input.distance_threshold
-            )
-            
-            context_parts = []
-            for result in query_result["results"]:
-                content = result["content"]
-                content_data = content.get("content", "")
-                
-                if content.get("type") == "input_text":
-                    context_parts.append(str(content_data))
-                elif content.get("type") == "domain_reason" and isinstance(content_data, dict) and 'reason' in content_data:
-                    context_parts.append(content_data['reason'])
-                elif content.get("type") == "summary":
-                    context_parts.append(str(content_data))
-                elif content.get("type") == "insight" and isinstance(content_data, dict) and 'description' in content_data:
-                    context_parts.append(content_data['description'])
-                elif content.get("type") == "suggestion":
-                    context_parts.append(str(content_data))
-            
-            context_text = "\n".join(context_parts) if context_parts else "No relevant information found in the database."
-            
-            prompt = f"""
+def build_rag_prompt(query: str, query_result: Dict[str, Any]) -> str:
+    """Turn retrieved items into a context block and wrap it in the answer prompt"""
+    context_parts = []
+    for result in query_result["results"]:
+        content = result["content"]
+        content_data = content.get("content", "")
+        
+        if content.get("type") == "input_text":
+            context_parts.append(str(content_data))
+        elif content.get("type") == "domain_reason" and isinstance(content_data, dict) and 'reason' in content_data:
+            context_parts.append(content_data['reason'])
+        elif content.get("type") == "summary":
+            context_parts.append(str(content_data))
+        elif content.get("type") == "insight" and isinstance(content_data, dict) and 'description' in content_data:
+            context_parts.append(content_data['description'])
+        elif content.get("type") == "suggestion":
+            context_parts.append(str(content_data))
+    
+    context_text = "\n".join(context_parts) if context_parts else "No relevant information found in the database."
+    
+    return f"""
 You are a helpful assistant. Based on the following context retrieved from a database, provide a concise, natural language answer to the user's query. Use the context to inform your response, but synthesize the information to answer the query accurately and coherently. If the context is insufficient or the query is ambiguous, explain that and suggest how the user can clarify it.
 
-Query: {input.query}
+Query: {query}
 
 Context:
 {context_text}
@@ -312,26 +637,57 @@ Respond with a JSON object in this format:
   "response": "Your natural language answer here based on the context"
 }}
 """
-            logger.debug(f"Sending prompt to Perplexity API: {prompt[:500]}...")
-            
-            message_content = call_perplexity_api(prompt)
-            result = safe_json_parse(message_content)
-            
-            if not result.get("response") or not isinstance(result["response"], str):
-                logger.error(f"Invalid Perplexity response: {result}")
-                raise HTTPException(status_code=500, detail="Invalid or missing 'response' field in Perplexity API response")
-            
-            logger.info(f"Generated response for query '{input.query}': {result['response'][:200]}...")
-            
-            return {
-                "response": result["response"].strip(),
-                "retrieved_context": query_result["results"][:input.k],
-                "query_info": {
-                    "total_vectors": query_result.get("total_vectors", 0),
-                    "results_found": len(query_result["results"]),
-                    "distance_threshold": input.distance_threshold
-                }
-            }
+
+def parse_rag_answer(message_content: str) -> Dict[str, Any]:
+    """Parse the answer JSON and check it has a non-empty 'response' string"""
+    result = safe_json_parse(message_content)
+    if not result.get("response") or not isinstance(result["response"], str):
+        logger.error(f"Invalid Perplexity response: {result}")
+        raise HTTPException(status_code=500, detail="Invalid or missing 'response' field in Perplexity API response")
+    return result
+
+def build_rag_result(input: QueryInput, query_result: Dict[str, Any], answer: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "response": answer["response"].strip(),
+        "retrieved_context": query_result["results"][:input.k],
+        "query_info": {
+            "total_vectors": query_result.get("total_vectors", 0),
+            "results_found": len(query_result["results"]),
+            "distance_threshold": input.distance_threshold
+        }
+    }
+
+def retrieve_context(input: QueryInput) -> Dict[str, Any]:
+    """Embed the query and search the current snapshot (blocking, run it in a thread; takes no lock)"""
+    return vector_db.query_vectors(
+        input.query, 
+        k=input.k, 
+        distance_threshold=input.distance_threshold,
+        nprobe=input.nprobe,
+        ef_search=input.ef_search
+    )
+
+@router.post("/query-vector")
+async def query_vector_db(input: QueryInput, request: Request):
+    """Query the vector database and enhance with Perplexity API"""
+    if not input.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    try:
+        query_result = await run_in_threadpool(retrieve_context, input)
+        prompt = build_rag_prompt(input.query, query_result)
+        logger.debug(f"Sending prompt to Perplexity API: {prompt[:500]}...")
+        
+        message_content = await call_perplexity_api(prompt, request)
+        try:
+            result = parse_rag_answer(message_content)
+        except HTTPException:
+            await forget_completion(prompt)
+            raise
+        
+        logger.info(f"Generated response for query '{input.query}': {result['response'][:200]}...")
+        
+        return build_rag_result(input, query_result, result)
 
     except Exception as e:
         logger.error(f"Error querying vector database: {str(e)}")
@@ -339,45 +695,66 @@ Respond with a JSON object in this format:
             raise e
         raise HTTPException(status_code=500, detail=f"Failed to query vector database: {str(e)}")
 
+@router.post("/query-vector/stream")
+async def query_vector_db_stream(input: QueryInput):
+    """Server-sent events: the retrieved context, upstream tokens, the answer text once complete, then the full result"""
+    if not input.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    query_result = await run_in_threadpool(retrieve_context, input)
+    prompt = build_rag_prompt(input.query, query_result)
+
+    def parse(message_content: str) -> Dict[str, Any]:
+        return build_rag_result(input, query_result, parse_rag_answer(message_content))
+
+    async def events():
+        yield sse_event("context", query_result["results"][:input.k])
+        async for event in stream_json_completion(prompt, {("response",): "response"}, parse):
+            yield event
+
+    return sse_response(events())
+
+def collect_vector_db_stats() -> Dict[str, Any]:
+    """Counts taken between writes, so index and metadata agree (blocking, run it in a thread)"""
+    with vector_db_lock:
+        stats = {
+            "total_vectors": vector_db.index.ntotal,
+            "stored_metadata_count": vector_db.metadata.count(),
+            "dimension": vector_db.dimension,
+            **vector_db.wal_stats(),
+            **vector_db.index_stats()
+        }
+    stats["is_synchronized"] = stats["total_vectors"] == stats["stored_metadata_count"]
+    stats["content_type_distribution"] = vector_db.metadata.type_counts()
+    return stats
+
 @router.get("/vector-db-stats")
 async def get_vector_db_stats():
     """Get statistics about the vector database"""
     try:
-        with vector_db_lock:
-            stats = {
-                "total_vectors": vector_db.index.ntotal,
-                "stored_metadata_count": len(vector_db.stored_data),
-                "dimension": vector_db.dimension,
-                "is_synchronized": vector_db.index.ntotal == len(vector_db.stored_data)
-            }
-            
-            type_counts = {}
-            for metadata in vector_db.stored_data:
-                content_type = metadata.get("type", "unknown")
-                type_counts[content_type] = type_counts.get(content_type, 0) + 1
-            
-            stats["content_type_distribution"] = type_counts
-            return stats
+        return await run_in_threadpool(collect_vector_db_stats)
             
     except Exception as e:
         logger.error(f"Error getting vector DB stats: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get vector database statistics: {str(e)}")
 
+@router.get("/embedding-cache-stats")
+async def get_embedding_cache_stats():
+    """Hit/miss counts and sizes of the embedding cache shared by inserts, queries and classification"""
+    return vector_db.embedding_cache.stats()
+
+@router.get("/embedding-service-stats")
+async def get_embedding_service_stats():
+    """Batch-size, queue-latency and encode-time histograms of the embedding batcher"""
+    return vector_db.embedding_batcher.stats()
+
 @router.delete("/clear-vector-db")
 async def clear_vector_db():
     """Clear all data from the vector database"""
     try:
-        with vector_db_lock:
-            vector_db.index = faiss.IndexFlatL2(vector_db.dimension)
-            vector_db.stored_data = []
-            
-            if os.path.exists(FAISS_INDEX_PATH):
-                os.remove(FAISS_INDEX_PATH)
-            if os.path.exists(VECTOR_DB_PATH):
-                os.remove(VECTOR_DB_PATH)
-            
-            logger.info("Vector database cleared successfully")
-            return {"message": "Vector database cleared successfully"}
+        await run_in_threadpool(vector_db.clear)
+        logger.info("Vector database cleared successfully")
+        return {"message": "Vector database cleared successfully"}
             
     except Exception as e:
         logger.error(f"Error clearing vector database: {str(e)}")
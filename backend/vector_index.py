@@ -0,0 +1,213 @@
+import logging
+import math
+import os
+from typing import List, Optional, Tuple
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+# Index kind to use from each database size on, as "kind:min_vectors" pairs (kinds: flat, ivf, ivfpq, hnsw)
+VECTOR_INDEX_TIERS = os.getenv("VECTOR_INDEX_TIERS", "flat:0,ivf:50000,ivfpq:1000000")
+# Default search-time knobs, overridable per query
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", 16))
+VECTOR_INDEX_EF_SEARCH = int(os.getenv("VECTOR_INDEX_EF_SEARCH", 64))
+# HNSW graph degree and build-time beam width
+VECTOR_INDEX_HNSW_M = int(os.getenv("VECTOR_INDEX_HNSW_M", 32))
+VECTOR_INDEX_EF_CONSTRUCTION = int(os.getenv("VECTOR_INDEX_EF_CONSTRUCTION", 80))
+# PQ sub-quantizers; must divide the embedding dimension (384 / 48 = 8 dimensions per 1-byte code)
+VECTOR_INDEX_PQ_M = int(os.getenv("VECTOR_INDEX_PQ_M", 48))
+# Training points per IVF list; faiss wants at least 39
+VECTOR_INDEX_TRAIN_PER_LIST = int(os.getenv("VECTOR_INDEX_TRAIN_PER_LIST", 64))
+
+INDEX_KINDS = ("flat", "ivf", "ivfpq", "hnsw")
+# Flags that open a saved index of each kind memory-mapped instead of reading it into RAM
+# (flat codes can only be mapped from faiss 1.10 on; older versions read them normally)
+MMAP_FLAGS = {
+    "flat": getattr(faiss, "IO_FLAG_MMAP_IFC", None),
+    "hnsw": getattr(faiss, "IO_FLAG_MMAP_IFC", None),
+    "ivf": faiss.IO_FLAG_MMAP,
+    "ivfpq": faiss.IO_FLAG_MMAP,
+}
+# Smallest database an IVF tier applies to; below it there is too little data to train on
+IVF_MIN_VECTORS = 1000
+# Vectors needed to train 8-bit PQ codebooks without faiss warning about too few points
+PQ_MIN_TRAIN = 39 * 256
+
+
+def parse_tiers(spec: str) -> List[Tuple[int, str]]:
+    """Parse VECTOR_INDEX_TIERS into (min_vectors, kind) pairs sorted by size"""
+    tiers = []
+    for part in spec.split(","):
+        kind, _, threshold = part.strip().partition(":")
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown vector index kind '{kind}' in VECTOR_INDEX_TIERS")
+        threshold = int(threshold or 0)
+        if kind in ("ivf", "ivfpq"):
+            threshold = max(threshold, IVF_MIN_VECTORS)
+        tiers.append((threshold, kind))
+    tiers.sort()
+    if tiers[0][0] != 0:
+        tiers.insert(0, (0, "flat"))
+    return tiers
+
+
+TIERS = parse_tiers(VECTOR_INDEX_TIERS)
+
+
+def kind_for_size(count: int) -> str:
+    """The index kind configured for a database of count vectors"""
+    kind = TIERS[0][1]
+    for threshold, tier_kind in TIERS:
+        if count >= threshold:
+            kind = tier_kind
+    return kind
+
+
+def nlist_for_size(count: int) -> int:
+    """IVF list count: about 4 * sqrt(n), with enough training points per list"""
+    return max(1, min(int(4 * math.sqrt(count)), count // VECTOR_INDEX_TRAIN_PER_LIST or 1, 65536))
+
+
+def index_kind(index: faiss.Index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def build_index(kind: str, vectors: np.ndarray, dimension: int) -> faiss.Index:
+    """Create an index of the given kind, train it on vectors if needed and add them in order (blocking)"""
+    count = len(vectors)
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, VECTOR_INDEX_HNSW_M)
+        index.hnsw.efConstruction = VECTOR_INDEX_EF_CONSTRUCTION
+    else:
+        nlist = nlist_for_size(count)
+        if kind == "ivfpq" and count >= PQ_MIN_TRAIN:
+            index = faiss.index_factory(dimension, f"IVF{nlist},PQ{VECTOR_INDEX_PQ_M}")
+        else:
+            # Too few vectors to train the 256-entry PQ codebooks; IVF-Flat is exact within each list
+            index = faiss.index_factory(dimension, f"IVF{nlist},Flat")
+        sample_size = min(count, max(nlist * VECTOR_INDEX_TRAIN_PER_LIST, PQ_MIN_TRAIN))
+        sample = vectors
+        if sample_size < count:
+            sample = vectors[np.random.default_rng(0).choice(count, sample_size, replace=False)]
+        index.train(sample)
+        # Keep id -> list lookups so vectors can be reconstructed for the next migration
+        faiss.extract_index_ivf(index).make_direct_map()
+    for start in range(0, count, 65536):
+        index.add(vectors[start:start + 65536])
+    return index
+
+
+def reconstruct(index: faiss.Index, start: int, stop: int, dimension: int) -> np.ndarray:
+    """Vectors start..stop-1 in insertion order (approximate for PQ indexes)"""
+    if stop <= start:
+        return np.zeros((0, dimension), dtype="float32")
+    return index.reconstruct_n(start, stop - start)
+
+
+def search_parameters(index: faiss.Index, nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None) -> Optional[faiss.SearchParameters]:
+    """Per-query search knobs for the index kind, so concurrent searches don't share settings"""
+    kind = index_kind(index)
+    if kind in ("ivf", "ivfpq"):
+        return faiss.SearchParametersIVF(nprobe=nprobe or VECTOR_INDEX_NPROBE)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search or VECTOR_INDEX_EF_SEARCH)
+    return None
+
+
+def search(index: faiss.Index, queries: np.ndarray, k: int, nprobe: Optional[int] = None,
+           ef_search: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    params = search_parameters(index, nprobe, ef_search)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+
+def open_index(path: str, kind: str) -> Tuple[faiss.Index, bool]:
+    """Open a saved index memory-mapped where faiss supports it for kind; returns the index and whether it is mapped"""
+    flag = MMAP_FLAGS.get(kind)
+    if flag is not None:
+        try:
+            return faiss.read_index(path, flag), True
+        except RuntimeError as e:
+            logger.warning(f"Could not memory-map {path}, reading it into memory: {str(e)}")
+    return faiss.read_index(path), False
+
+
+class IndexSnapshot:
+    """An immutable view of the index: a base that is never modified in place, plus the vectors added since.
+
+    The base can therefore be memory-mapped read-only, and searches can run on a snapshot while writers
+    publish the next one. Newer vectors sit in a preallocated array that successive snapshots share;
+    each only reads its own first ``count`` rows, and writers only fill rows past the latest count.
+    Checkpoints fold those vectors into a new base file. Ids run through the base first, then the rest.
+    """
+
+    def __init__(self, base: faiss.Index, dimension: int, path: Optional[str] = None, mapped: bool = False,
+                 vectors: Optional[np.ndarray] = None, count: int = 0):
+        self.base = base
+        self.dimension = dimension
+        # File the base was read from, so a writable copy can be read back without going through the mapping
+        self.path = path
+        self.mapped = mapped
+        self.vectors = vectors if vectors is not None else np.zeros((0, dimension), dtype="float32")
+        self.count = count
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + self.count
+
+    @property
+    def kind(self) -> str:
+        return index_kind(self.base)
+
+    def appended(self, vectors: np.ndarray) -> "IndexSnapshot":
+        """A new snapshot with vectors added; call it on the latest snapshot only, under the writer lock"""
+        count = self.count + len(vectors)
+        storage = self.vectors
+        if count > len(storage):
+            storage = np.zeros((max(count, 2 * len(storage), 1024), self.dimension), dtype="float32")
+            storage[:self.count] = self.vectors[:self.count]
+        storage[self.count:count] = vectors
+        return IndexSnapshot(self.base, self.dimension, self.path, self.mapped, storage, count)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.count == 0:
+            return search(self.base, queries, k, nprobe, ef_search)
+        recent_distances, recent_ids = faiss.knn(queries, self.vectors[:self.count], min(k, self.count))
+        recent_ids = np.where(recent_ids >= 0, recent_ids + self.base.ntotal, -1)
+        if self.base.ntotal == 0:
+            return recent_distances, recent_ids
+        base_distances, base_ids = search(self.base, queries, min(k, self.base.ntotal), nprobe, ef_search)
+        distances = np.hstack([base_distances, recent_distances])
+        ids = np.hstack([base_ids, recent_ids])
+        # Missing results (-1) sort last
+        distances = np.where(ids >= 0, distances, np.inf)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def reconstruct(self, start: int, stop: int) -> np.ndarray:
+        split = self.base.ntotal
+        parts = []
+        if start < split:
+            parts.append(reconstruct(self.base, start, min(stop, split), self.dimension))
+        if stop > split:
+            parts.append(self.vectors[max(start, split) - split:stop - split].copy())
+        return np.vstack(parts) if parts else np.zeros((0, self.dimension), dtype="float32")
+
+    def writable_base(self) -> faiss.Index:
+        """An in-memory copy of the base that vectors can be added to (blocking)"""
+        if self.path is not None:
+            return faiss.read_index(self.path)
+        return faiss.deserialize_index(faiss.serialize_index(self.base))